@@ -0,0 +1,105 @@
+# admin/auditoria.py
+from typing import List, Optional
+import asyncio
+
+from db import db_settings
+from .schemas import AuditLog, MetricasAuditoria
+
+
+class RegistroAuditoria:
+    """
+    Escritura diferida de la auditoría: los eventos van a una cola acotada y
+    una tarea los guarda con insert_many, por lotes de `tamano_lote` o cada
+    `intervalo` segundos, lo que ocurra primero. Con la cola llena, la
+    política "descartar" bota el evento y lo cuenta; "esperar" hace esperar
+    a quien registra hasta que haya espacio.
+    """
+
+    def __init__(self, max_cola: int, tamano_lote: int, intervalo: float, politica: str):
+        if politica not in ("descartar", "esperar"):
+            raise ValueError(f"AUDIT_OVERFLOW_POLICY desconocida: {politica}")
+        self._tamano_lote = tamano_lote
+        self._intervalo = intervalo
+        self._politica = politica
+        self._cola: "asyncio.Queue[AuditLog]" = asyncio.Queue(maxsize=max_cola)
+        self._tarea: Optional[asyncio.Task] = None
+        # Lote que se está juntando y escritura en curso, para no perderlos al cerrar
+        self._lote: List[AuditLog] = []
+        self._escritura: Optional[asyncio.Future] = None
+        self._escritos = 0
+        self._descartados = 0
+        self._fallidos = 0
+
+    async def registrar(self, evento: AuditLog) -> None:
+        if self._politica == "esperar":
+            await self._cola.put(evento)
+            return
+        try:
+            self._cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self._descartados += 1
+
+    async def _escribir(self, lote: List[AuditLog]) -> None:
+        try:
+            await AuditLog.insert_many(lote)
+            self._escritos += len(lote)
+        except Exception as error:
+            self._fallidos += len(lote)
+            print(f"Error al guardar {len(lote)} eventos de auditoría: {error}")
+
+    async def _ciclo(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._lote = lote = [await self._cola.get()]
+            limite = loop.time() + self._intervalo
+            while len(lote) < self._tamano_lote:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            self._lote = []
+            # shield: si se cancela la tarea a mitad del insert, la escritura termina igual
+            self._escritura = asyncio.ensure_future(self._escribir(lote))
+            await asyncio.shield(self._escritura)
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def cerrar(self) -> None:
+        """Detiene la tarea y guarda todo lo que quedaba en la cola."""
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        if self._escritura is not None and not self._escritura.done():
+            await self._escritura
+
+        pendientes, self._lote = self._lote, []
+        while not self._cola.empty():
+            pendientes.append(self._cola.get_nowait())
+        for inicio in range(0, len(pendientes), self._tamano_lote):
+            await self._escribir(pendientes[inicio:inicio + self._tamano_lote])
+
+    def metricas(self) -> MetricasAuditoria:
+        return MetricasAuditoria(
+            politica=self._politica,
+            enCola=self._cola.qsize(),
+            escritos=self._escritos,
+            descartados=self._descartados,
+            fallidos=self._fallidos
+        )
+
+
+registro_auditoria = RegistroAuditoria(
+    db_settings.AUDIT_QUEUE_MAX,
+    db_settings.AUDIT_BATCH_SIZE,
+    db_settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+    db_settings.AUDIT_OVERFLOW_POLICY
+)
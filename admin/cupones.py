@@ -0,0 +1,18 @@
+# admin/cupones.py
+from typing import Optional
+
+from cache import CacheTTL
+from .schemas import Cupon
+
+# Los cupones cambian poco y solo desde el panel admin, que invalida el cache
+cupones_cache = CacheTTL(max_entradas=1024, ttl=300)
+
+
+async def buscar_cupon(codigo: str) -> Optional[Cupon]:
+    """
+    Cupón por código, desde el cache. El objeto se comparte entre peticiones:
+    no se debe modificar.
+    """
+    return await cupones_cache.obtener_o_cargar(
+        codigo, lambda: Cupon.find_one(Cupon.codigo == codigo)
+    )
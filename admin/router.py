@@ -1,16 +1,32 @@
 # admin/router.py
 from datetime import date
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Request
 from typing import List, Dict
-from auth.schemas import User
-from .schemas import ReglasCarrito, Cupon, CuponCreate, CuponOut, SecuritySettings, AuditLog, UserUpdateAdmin
+from pydantic import TypeAdapter
+from auth.schemas import User, MetricasHash
+from auth.usuarios import invalidar_usuario
+from auth.tokens import revocaciones
+from auth.hashing import pool_hash
+from auth.limites import limitar, CUPON_POR_IP
+from .schemas import (
+    ReglasCarrito, Cupon, CuponCreate, CuponOut, SecuritySettings, AuditLog, UserUpdateAdmin,
+    MetricasAuditoria
+)
+from .auditoria import registro_auditoria
 from beanie import BeanieObjectId
+from streaming import respuesta_streaming
+from .cupones import cupones_cache, buscar_cupon
+from cart.schemas import ResultadoCompactacion, ResultadoRepreciado
+from cart.tareas import compactar_carritos, repreciar_carritos
+from cart.reservas import reglas_cache
 
 router = APIRouter(
     prefix="/api/admin",
     tags=["4. Administración (Reglas y Cupones)"]
 )
 
+_USER = TypeAdapter(User)
+
 # === Endpoints para Reglas del Carrito ===
 
 @router.get("/carrito/reglas", response_model=ReglasCarrito)
@@ -29,9 +45,20 @@ async def actualizar_reglas_carrito(reglas_data: ReglasCarrito):
         await reglas.insert()
     else:
         await reglas.update({"$set": reglas_data.model_dump(exclude_unset=True)})
+    reglas_cache.invalidar()
     
     return reglas
 
+@router.post("/carrito/repreciar", response_model=ResultadoRepreciado)
+async def repreciar_carritos_abiertos():
+    """Lleva todos los carritos abiertos a los precios actuales del catálogo."""
+    return await repreciar_carritos()
+
+@router.post("/carrito/compactar", response_model=ResultadoCompactacion)
+async def compactar_carritos_ahora():
+    """Borra los carritos vacíos sin actividad y archiva los abandonados sin esperar a la tarea."""
+    return await compactar_carritos()
+
 # === Endpoints para Gestión de Cupones ===
 
 @router.post("/cupones", response_model=CuponOut, status_code=status.HTTP_201_CREATED)
@@ -45,6 +72,7 @@ async def crear_cupon(cupon_data: CuponCreate):
             
     nuevo_cupon = Cupon(**cupon_data.model_dump())
     await nuevo_cupon.insert()
+    cupones_cache.invalidar()
     return CuponOut.model_validate(nuevo_cupon)
 
 @router.get("/cupones", response_model=List[CuponOut])
@@ -57,23 +85,22 @@ async def actualizar_cupon(cupon_id: BeanieObjectId, cupon_data: CuponCreate):
     cupon = await Cupon.get(cupon_id)
     if not cupon:
         raise HTTPException(
-            status_code=status.HTTP_44_NOT_FOUND,
+            status_code=status.HTTP_404_NOT_FOUND,
             detail="Cupón no encontrado"
         )
     
     await cupon.update({"$set": cupon_data.model_dump(exclude_unset=True)})
+    cupones_cache.invalidar()
     cupon_actualizado = await Cupon.get(cupon_id)
     return cupon_actualizado
 
 @router.get("/cupones/validar/{codigo}")
-async def validar_cupon_publico(codigo: str):
+async def validar_cupon_publico(request: Request, codigo: str):
+    await limitar((CUPON_POR_IP, request.client.host))
     # 1. Buscar cupón activo por código
-    cupon = await Cupon.find_one(
-        Cupon.codigo == codigo, 
-        Cupon.estado == "Activo"
-    )
+    cupon = await buscar_cupon(codigo)
     
-    if not cupon:
+    if not cupon or cupon.estado != "Activo":
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Cupón no válido o no existe")
     
     # 2. Validar Fechas
@@ -102,6 +129,7 @@ async def eliminar_cupon(cupon_id: BeanieObjectId):
         )
     
     await cupon.delete()
+    cupones_cache.invalidar()
     return
 
 # ==========================================
@@ -109,9 +137,8 @@ async def eliminar_cupon(cupon_id: BeanieObjectId):
 # ==========================================
 
 @router.get("/users", response_model=List[User])
-async def listar_usuarios():
-    users = await User.find_all().to_list()
-    return users
+async def listar_usuarios(request: Request):
+    return respuesta_streaming(request, User.find_all(), _USER)
 
 @router.put("/users/{user_id}")
 async def actualizar_usuario_admin(user_id: BeanieObjectId, data: UserUpdateAdmin):
@@ -120,6 +147,9 @@ async def actualizar_usuario_admin(user_id: BeanieObjectId, data: UserUpdateAdmi
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
     
     await user.update({"$set": data.model_dump(exclude_unset=True)})
+    # El rol y el nombre van en el token: los emitidos antes quedan viejos
+    await revocaciones.nueva_version(user.id)
+    invalidar_usuario(user.email)
     return await User.get(user_id)
 
 @router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -128,6 +158,8 @@ async def eliminar_usuario(user_id: BeanieObjectId):
     if not user:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
     await user.delete()
+    await revocaciones.revocar_usuario(user.id)
+    invalidar_usuario(user.email)
     return
 
 # ==========================================
@@ -153,11 +185,21 @@ async def actualizar_config_seguridad(settings_data: SecuritySettings):
         settings = await SecuritySettings.find_one()
     return settings
 
+@router.get("/security/hash-pool", response_model=MetricasHash)
+async def metricas_pool_hash():
+    """Ocupación y rechazos del pool de bcrypt de este proceso."""
+    return pool_hash.metricas()
+
 @router.get("/security/audit-logs", response_model=List[AuditLog])
 async def obtener_auditoria():
     logs = await AuditLog.find_all().sort("-fecha").limit(50).to_list()
     return logs
 
+@router.get("/security/audit-logs/metricas", response_model=MetricasAuditoria)
+async def metricas_auditoria():
+    """Eventos en cola, guardados, descartados por cola llena y fallidos de este proceso."""
+    return registro_auditoria.metricas()
+
 @router.post("/security/audit-logs")
 async def crear_log_auditoria(log: AuditLog):
     await log.insert()
@@ -3,6 +3,7 @@ from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import date, datetime
 from beanie import Document, BeanieObjectId
+from pymongo import IndexModel
 
 # --- Modelo para Reglas del carrito ---
 class ReglasCarrito(Document):
@@ -31,6 +32,9 @@ class CuponCreate(CuponBase):
 class Cupon(Document, CuponBase):
     class Settings:
         name = "cupones"
+        indexes = [
+            IndexModel([("codigo", 1)], unique=True),
+        ]
 
 class CuponOut(CuponBase):
     id: BeanieObjectId
@@ -58,6 +62,16 @@ class AuditLog(Document):
     
     class Settings:
         name = "audit_logs"
+        indexes = [
+            [("fecha", -1)],
+        ]
+
+class MetricasAuditoria(BaseModel):
+    politica: str
+    enCola: int
+    escritos: int
+    descartados: int
+    fallidos: int
 
 # --- Schema para Editar Usuario (Admin) ---
 class UserUpdateAdmin(BaseModel):
@@ -0,0 +1,47 @@
+# auth/codigos.py
+from datetime import datetime, timedelta, timezone
+import hashlib
+
+from .schemas import CodigoVerificacion
+
+MINUTOS_CODIGO_2FA = 5
+# Intentos fallidos que aguanta un código antes de quedar inutilizable
+MAX_INTENTOS_CODIGO = 5
+
+
+def _resumen(codigo: str) -> str:
+    # Solo se guarda el hash: un volcado de la colección no sirve para entrar
+    return hashlib.sha256(codigo.encode("utf-8")).hexdigest()
+
+
+async def emitir_codigo(clave: str, codigo: str, minutos: int) -> None:
+    """Guarda (o reemplaza) el código de `clave`, con los intentos en cero."""
+    await CodigoVerificacion.get_motor_collection().update_one(
+        {"clave": clave},
+        {"$set": {
+            "codigo": _resumen(codigo),
+            "intentos": 0,
+            # En UTC: el índice TTL compara contra la hora UTC del servidor de Mongo
+            "expira": datetime.now(timezone.utc) + timedelta(minutes=minutos)
+        }},
+        upsert=True
+    )
+
+
+async def verificar_y_consumir(clave: str, codigo: str) -> bool:
+    """
+    Un solo find_one_and_delete: el código sirve una vez, si no venció y si
+    no agotó sus intentos. Si no calza, se cuenta el intento fallido.
+    """
+    coleccion = CodigoVerificacion.get_motor_collection()
+    ahora = datetime.now(timezone.utc)
+    consumido = await coleccion.find_one_and_delete({
+        "clave": clave,
+        "codigo": _resumen(codigo),
+        "expira": {"$gt": ahora},
+        "intentos": {"$lt": MAX_INTENTOS_CODIGO}
+    })
+    if consumido:
+        return True
+    await coleccion.update_one({"clave": clave, "expira": {"$gt": ahora}}, {"$inc": {"intentos": 1}})
+    return False
@@ -0,0 +1,170 @@
+# auth/correo.py
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+
+from db import db_settings
+
+PLANTILLAS_DIR = os.path.join(os.path.dirname(__file__), "plantillas")
+TAMANO_LOTE_CORREO = 20
+MAX_INTENTOS_CORREO = 5
+# Espera entre reconexiones: se duplica en cada fallo hasta el máximo
+ESPERA_MINIMA = 1.0
+ESPERA_MAXIMA = 60.0
+# Plazo que se da al apagar para enviar lo que quedó en cola
+SEGUNDOS_CIERRE = 10.0
+
+
+class ServicioCorreo:
+    """
+    Envío de correos en segundo plano: encolar() responde en el acto y una
+    tarea los manda por lotes sobre una conexión SMTP que se mantiene
+    abierta. Si la conexión falla, los mensajes vuelven a la cola y se
+    reconecta con espera exponencial; tras MAX_INTENTOS_CORREO se descartan.
+    """
+
+    def __init__(self, max_cola: int):
+        self._cola: "asyncio.Queue[EmailMessage]" = asyncio.Queue(maxsize=max_cola)
+        self._plantillas: Dict[str, Template] = {}
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._tarea: Optional[asyncio.Task] = None
+        # (mensaje, intentos fallidos) sacados de la cola y aún no enviados
+        self._pendientes: List[Tuple[EmailMessage, int]] = []
+
+    def cargar_plantillas(self) -> None:
+        """Compila una vez todas las plantillas HTML (se llama al arrancar)."""
+        entorno = Environment(
+            loader=FileSystemLoader(PLANTILLAS_DIR), autoescape=select_autoescape(["html"])
+        )
+        self._plantillas = {
+            nombre: entorno.get_template(nombre) for nombre in entorno.list_templates(extensions=["html"])
+        }
+
+    def encolar(self, destinatario: str, asunto: str, plantilla: str, **datos) -> bool:
+        """Arma el mensaje con la plantilla y lo deja en cola. False si la cola está llena."""
+        mensaje = EmailMessage()
+        mensaje["From"] = db_settings.MAIL_FROM
+        mensaje["To"] = destinatario
+        mensaje["Subject"] = asunto
+        mensaje.set_content(self._plantillas[plantilla].render(**datos), subtype="html")
+        try:
+            self._cola.put_nowait(mensaje)
+        except asyncio.QueueFull:
+            print(f"Cola de correos llena, no se envió '{asunto}' a {destinatario}")
+            return False
+        return True
+
+    # --- Conexión SMTP ---
+
+    async def _conectar(self) -> aiosmtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                # El servidor pudo cerrar la conexión por inactividad
+                await self._smtp.noop()
+                return self._smtp
+            except aiosmtplib.SMTPException:
+                await self._desconectar()
+
+        smtp = aiosmtplib.SMTP(
+            hostname=db_settings.MAIL_SERVER,
+            port=db_settings.MAIL_PORT,
+            start_tls=db_settings.MAIL_STARTTLS,
+            validate_certs=True
+        )
+        await smtp.connect()
+        if db_settings.MAIL_USE_CREDENTIALS:
+            await smtp.login(db_settings.MAIL_USERNAME, db_settings.MAIL_PASSWORD)
+        self._smtp = smtp
+        return smtp
+
+    async def _desconectar(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            await self._smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    # --- Envío ---
+
+    def _terminado(self, mensaje: EmailMessage, error: Optional[Exception] = None) -> None:
+        if error is not None:
+            print(f"Correo a {mensaje['To']} descartado: {error}")
+        self._cola.task_done()
+
+    def _reintentar(self, lote: List[Tuple[EmailMessage, int]], error: Exception) -> None:
+        for mensaje, intentos in lote:
+            if intentos + 1 >= MAX_INTENTOS_CORREO:
+                self._terminado(mensaje, error)
+            else:
+                self._pendientes.append((mensaje, intentos + 1))
+
+    async def _enviar_lote(self, lote: List[Tuple[EmailMessage, int]]) -> None:
+        """Manda el lote por una sola conexión; si se corta, lo no enviado vuelve a pendientes."""
+        try:
+            smtp = await self._conectar()
+        except Exception as error:
+            self._reintentar(lote, error)
+            raise
+
+        for posicion, (mensaje, _) in enumerate(lote):
+            try:
+                await smtp.send_message(mensaje)
+            except aiosmtplib.SMTPRecipientsRefused as error:
+                # Destinatario rechazado: reintentar no sirve
+                self._terminado(mensaje, error)
+                continue
+            except (aiosmtplib.SMTPException, OSError) as error:
+                self._reintentar(lote[posicion:], error)
+                raise
+            except Exception as error:
+                # Mensaje mal formado (p. ej. una dirección inválida): se descarta solo ese
+                self._terminado(mensaje, error)
+                continue
+            self._terminado(mensaje)
+
+    async def _ciclo(self) -> None:
+        espera = ESPERA_MINIMA
+        while True:
+            if not self._pendientes:
+                self._pendientes.append((await self._cola.get(), 0))
+            while len(self._pendientes) < TAMANO_LOTE_CORREO and not self._cola.empty():
+                self._pendientes.append((self._cola.get_nowait(), 0))
+
+            lote = self._pendientes[:TAMANO_LOTE_CORREO]
+            self._pendientes = self._pendientes[TAMANO_LOTE_CORREO:]
+            try:
+                await self._enviar_lote(lote)
+                espera = ESPERA_MINIMA
+            except Exception as error:
+                # Cualquier error deja la tarea viva: si muriera, no saldría ningún correo más
+                print(f"Error de SMTP, se reintenta en {espera:.0f} s: {error}")
+                await self._desconectar()
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, ESPERA_MAXIMA)
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def cerrar(self) -> None:
+        if self._tarea is not None:
+            try:
+                await asyncio.wait_for(self._cola.join(), SEGUNDOS_CIERRE)
+            except asyncio.TimeoutError:
+                print("Se apagó con correos sin enviar")
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        await self._desconectar()
+
+
+servicio_correo = ServicioCorreo(db_settings.MAIL_QUEUE_MAX)
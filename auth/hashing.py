@@ -0,0 +1,91 @@
+# auth/hashing.py
+from fastapi import HTTPException, status
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+import asyncio
+import time
+
+from db import db_settings
+from .schemas import MetricasHash, User, hash_password
+
+# Lo que se le sugiere esperar al cliente cuando el pool está saturado
+SEGUNDOS_REINTENTO = 2
+
+
+class PoolHash:
+    """
+    Pool de hilos acotado para bcrypt (libera el GIL mientras hashea), así
+    los logins no bloquean el event loop. Si ya hay `max_cola` trabajos
+    esperando, se rechaza en el acto con 503 en vez de encolar sin límite.
+    """
+
+    def __init__(self, hilos: int, max_cola: int):
+        self._hilos = hilos
+        self._max_cola = max_cola
+        self._pool: Optional[ThreadPoolExecutor] = None
+        # Trabajos enviados al pool que todavía no terminan (en curso + en cola)
+        self._pendientes = 0
+        self._completadas = 0
+        self._rechazadas = 0
+        self._espera_total = 0.0
+        self._duracion_total = 0.0
+
+    def _terminado(self, _: Future) -> None:
+        self._pendientes -= 1
+
+    async def ejecutar(self, funcion: Callable[..., Any], *args: Any) -> Any:
+        if self._pendientes >= self._hilos + self._max_cola:
+            self._rechazadas += 1
+            raise HTTPException(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Demasiados inicios de sesión en curso, intenta de nuevo en unos segundos",
+                headers={"Retry-After": str(SEGUNDOS_REINTENTO)}
+            )
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._hilos, thread_name_prefix="bcrypt")
+
+        enviado = time.perf_counter()
+
+        def medido():
+            inicio = time.perf_counter()
+            return inicio - enviado, funcion(*args), time.perf_counter() - inicio
+
+        loop = asyncio.get_running_loop()
+        futuro = self._pool.submit(medido)
+        self._pendientes += 1
+        # El contador baja cuando el hilo termina, aunque la petición se haya cancelado
+        futuro.add_done_callback(lambda f: loop.call_soon_threadsafe(self._terminado, f))
+
+        espera, resultado, duracion = await asyncio.wrap_future(futuro)
+        self._completadas += 1
+        self._espera_total += espera
+        self._duracion_total += duracion
+        return resultado
+
+    def metricas(self) -> MetricasHash:
+        return MetricasHash(
+            hilos=self._hilos,
+            maxCola=self._max_cola,
+            enCurso=min(self._pendientes, self._hilos),
+            enCola=max(0, self._pendientes - self._hilos),
+            completadas=self._completadas,
+            rechazadas=self._rechazadas,
+            esperaPromedioMs=round(self._espera_total * 1000 / self._completadas, 2) if self._completadas else 0,
+            duracionPromedioMs=round(self._duracion_total * 1000 / self._completadas, 2) if self._completadas else 0
+        )
+
+    def cerrar(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+pool_hash = PoolHash(db_settings.BCRYPT_THREADS, db_settings.BCRYPT_MAX_QUEUE)
+
+
+async def verificar_password(usuario: User, clave: str) -> bool:
+    return await pool_hash.ejecutar(usuario.check_password, clave)
+
+
+async def hashear_password(clave: str) -> str:
+    return await pool_hash.ejecutar(hash_password, clave)
@@ -0,0 +1,121 @@
+# auth/limites.py
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Deque, Tuple
+import math
+import time
+
+from db import db_settings
+from .schemas import IntentoVentana
+
+# Claves distintas que recuerda el modo en memoria (IPs, cuentas, teléfonos)
+MAX_CLAVES_MEMORIA = 100_000
+
+
+class Limite:
+    def __init__(self, nombre: str, maximo: int, ventana: float):
+        self.nombre = nombre
+        self.maximo = maximo
+        self.ventana = ventana
+
+
+# Intentos permitidos por ventana deslizante (en segundos)
+LOGIN_POR_IP = Limite("login-ip", 30, 300)
+LOGIN_POR_CUENTA = Limite("login-cuenta", 10, 300)
+DOS_FA_POR_IP = Limite("2fa-ip", 20, 300)
+DOS_FA_POR_TELEFONO = Limite("2fa-telefono", 5, 300)
+CUPON_POR_IP = Limite("cupon-ip", 30, 60)
+
+
+class VentanaMemoria:
+    """
+    Ventana deslizante exacta por proceso: guarda la hora de cada intento
+    aceptado en los últimos `ventana` segundos. Las claves se desalojan
+    por LRU para que un barrido de IPs no haga crecer la memoria.
+    """
+
+    def __init__(self, max_claves: int):
+        self._max_claves = max_claves
+        self._intentos: "OrderedDict[str, Deque[float]]" = OrderedDict()
+
+    async def registrar(self, clave: str, limite: Limite) -> float:
+        """0 si el intento se acepta; si no, los segundos que faltan para poder reintentar."""
+        ahora = time.monotonic()
+        marcas = self._intentos.get(clave)
+        if marcas is None:
+            marcas = self._intentos[clave] = deque()
+            while len(self._intentos) > self._max_claves:
+                self._intentos.popitem(last=False)
+        else:
+            self._intentos.move_to_end(clave)
+
+        while marcas and marcas[0] <= ahora - limite.ventana:
+            marcas.popleft()
+        if len(marcas) >= limite.maximo:
+            return marcas[0] + limite.ventana - ahora
+        marcas.append(ahora)
+        return 0
+
+
+class VentanaMongo:
+    """
+    Ventana compartida entre procesos, aproximada con dos ventanas fijas:
+    lo contado en la anterior pesa según cuánto de ella sigue dentro de la
+    ventana deslizante. Un $inc con upsert por intento; el TTL borra los contadores.
+    """
+
+    async def _contar(self, clave: str, expira: datetime) -> int:
+        coleccion = IntentoVentana.get_motor_collection()
+        for intento in range(2):
+            try:
+                doc = await coleccion.find_one_and_update(
+                    {"_id": clave},
+                    {"$inc": {"contador": 1}, "$setOnInsert": {"expira": expira}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                return doc["contador"]
+            except DuplicateKeyError:
+                # Dos upserts a la vez: el segundo intento incrementa el creado
+                if intento:
+                    raise
+        return 0
+
+    async def registrar(self, clave: str, limite: Limite) -> float:
+        ahora = time.time()
+        indice = int(ahora // limite.ventana)
+        avance = ahora / limite.ventana - indice
+
+        actual = await self._contar(
+            f"{clave}:{indice}", datetime.fromtimestamp((indice + 2) * limite.ventana, timezone.utc)
+        )
+        previo = await IntentoVentana.get_motor_collection().find_one({"_id": f"{clave}:{indice - 1}"})
+        anterior = previo["contador"] if previo else 0
+
+        if anterior * (1 - avance) + actual <= limite.maximo:
+            return 0
+        if actual > limite.maximo:
+            return (1 - avance) * limite.ventana
+        # Hasta que lo que pesa la ventana anterior deje espacio
+        return max(1.0, (1 - (limite.maximo - actual) / anterior - avance) * limite.ventana)
+
+
+limitador = VentanaMongo() if db_settings.RATE_LIMIT_MODE == "mongo" else VentanaMemoria(MAX_CLAVES_MEMORIA)
+
+
+async def limitar(*reglas: Tuple[Limite, str]) -> None:
+    """
+    Cuenta un intento para cada (límite, valor), en orden, y responde 429 con
+    Retry-After al primero que se exceda. Va antes de cualquier consulta o hash.
+    """
+    for limite, valor in reglas:
+        espera = await limitador.registrar(f"{limite.nombre}:{valor}", limite)
+        if espera:
+            raise HTTPException(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "Demasiados intentos, espera un momento antes de volver a intentar",
+                headers={"Retry-After": str(math.ceil(espera))}
+            )
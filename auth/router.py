@@ -6,16 +6,24 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from .schemas import (
     User, UserCreate, TokenRequest, TokenResponse, Perfil, UserBase,
     InvitarMiembroRequest, TokenData,
-    hash_password, Roles, PasswordRecoveryRequest, PasswordResetConfirm, TwoFARequest, TwoFAVerify
+    Roles, PasswordRecoveryRequest, PasswordResetConfirm, TwoFARequest, TwoFAVerify
 )
+from .usuarios import buscar_usuario, invalidar_usuario
+from .hashing import verificar_password, hashear_password
+from .correo import servicio_correo
+from .tokens import revocaciones
+from .codigos import emitir_codigo, verificar_y_consumir, MINUTOS_CODIGO_2FA
+from .limites import limitar, LOGIN_POR_IP, LOGIN_POR_CUENTA, DOS_FA_POR_IP, DOS_FA_POR_TELEFONO
 from admin.schemas import AuditLog, SecuritySettings
+from admin.auditoria import registro_auditoria
 from jose import jwt, JWTError
-from typing import Dict, Any, Optional
+from pydantic import ValidationError
+from typing import Optional
 from beanie import BeanieObjectId
 from db import db_settings
-from datetime import datetime, timedelta
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+from datetime import datetime, timedelta, timezone
 import random
+import uuid
 
 # ---
 
@@ -24,33 +32,34 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 RESET_TOKEN_EXPIRE_MINUTES = 15
 
-conf = ConnectionConfig(
-    MAIL_USERNAME = db_settings.MAIL_USERNAME,
-    MAIL_PASSWORD = db_settings.MAIL_PASSWORD,
-    MAIL_FROM = db_settings.MAIL_FROM,
-    MAIL_PORT = db_settings.MAIL_PORT,
-    MAIL_SERVER = db_settings.MAIL_SERVER,
-    MAIL_STARTTLS = True,
-    MAIL_SSL_TLS = False,
-    USE_CREDENTIALS = True,
-    VALIDATE_CERTS = True
-)
-
 router = APIRouter(
     prefix="/api",
     tags=["1. Autenticación y Usuarios"]
 )
 
 # --- Función de Ayuda para crear Tokens ---
-def create_access_token(data: Dict[str, Any]) -> str:
-    to_encode = data.copy()
+def create_access_token(usuario: User) -> str:
+    """Token con los datos que necesitan los endpoints que autorizan solo por rol."""
+    ahora = datetime.now(timezone.utc)
+    to_encode = {
+        "sub": usuario.email,
+        "uid": str(usuario.id),
+        "rol": str(usuario.rol.value),
+        "nombre": usuario.nombre,
+        "iat": int(ahora.timestamp()),
+        "exp": int((ahora + timedelta(minutes=db_settings.ACCESS_TOKEN_EXPIRE_MINUTES)).timestamp()),
+        "tv": usuario.tokenVersion,
+        "jti": uuid.uuid4().hex
+    }
     encoded_jwt = jwt.encode(
         to_encode, db_settings.SECRET_KEY, algorithm=db_settings.ALGORITHM
     )
     return encoded_jwt
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+
+async def get_current_claims(token: str = Depends(oauth2_scheme)) -> TokenData:
     """
-    Decodifica el token JWT, valida al usuario y lo devuelve.
+    Valida firma, vencimiento y revocación del token y devuelve sus claims,
+    sin consultar la base.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -61,21 +70,40 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         payload = jwt.decode(
             token, db_settings.SECRET_KEY, algorithms=[db_settings.ALGORITHM]
         )
-        email: str = payload.get("sub")
-        rol: str = payload.get("rol")
-        
-        if email is None:
-            raise credentials_exception
-        
-        token_data = TokenData(email=email, rol=rol)
-        
-    except JWTError:
+        # Los tokens antiguos (solo sub y rol) no validan: hay que volver a iniciar sesión
+        token_data = TokenData.model_validate(payload)
+    except (JWTError, ValidationError):
         raise credentials_exception
 
-    usuario = await User.find_one(User.email == token_data.email)
-    
-    if usuario is None:
+    if revocaciones.revocado(token_data):
         raise credentials_exception
+
+    return token_data
+
+def requerir_rol(*roles: Roles):
+    """Dependencia que autoriza solo con los claims del token (sin leer el usuario)."""
+    permitidos = {r.value for r in roles}
+
+    async def verificar(claims: TokenData = Depends(get_current_claims)) -> TokenData:
+        if claims.rol not in permitidos:
+            raise HTTPException(status.HTTP_403_FORBIDDEN, "No tienes permiso para esta acción")
+        return claims
+
+    return verificar
+
+async def get_current_user(claims: TokenData = Depends(get_current_claims)) -> User:
+    """
+    Valida el token y devuelve el usuario (desde el cache de usuarios: sin
+    consulta a la base si ya se vio hace poco).
+    """
+    usuario = await buscar_usuario(claims.sub)
+    
+    if usuario is None or claims.tv < usuario.tokenVersion:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No se pudieron validar las credenciales",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
         
     return usuario
 
@@ -88,17 +116,21 @@ async def login(
 ):
     # Obtenemos la IP del cliente
     client_ip = request.client.host
+    await limitar(
+        (LOGIN_POR_IP, client_ip),
+        (LOGIN_POR_CUENTA, form_data.username.strip().lower())
+    )
 
     usuario = await User.find_one(User.email == form_data.username)
 
-    if not usuario or not usuario.check_password(form_data.password):
+    if not usuario or not await verificar_password(usuario, form_data.password):
         # --- REGISTRAR EL INTENTO FALLIDO ---
-        await AuditLog(
+        await registro_auditoria.registrar(AuditLog(
             usuario=form_data.username,
             accion="Intento de Login",
             ip=client_ip,
             estado="Fallo"
-        ).insert()
+        ))
         # ------------------------------------
         
         raise HTTPException(
@@ -106,16 +138,15 @@ async def login(
             detail="Credenciales inválidas" 
         )
 
-    token_data = {"sub": usuario.email, "rol": str(usuario.rol.value)}
-    access_token = create_access_token(token_data)
+    access_token = create_access_token(usuario)
 
     # --- REGISTRAR EL ÉXITO ---
-    await AuditLog(
+    await registro_auditoria.registrar(AuditLog(
         usuario=usuario.email,
         accion="Inicio de Sesión",
         ip=client_ip,
         estado="Exito"
-    ).insert()
+    ))
     # --------------------------
 
     return TokenResponse(
@@ -128,6 +159,11 @@ async def login(
         )
     )
 
+@router.post("/auth/logout")
+async def logout(claims: TokenData = Depends(get_current_claims)):
+    await revocaciones.revocar_token(claims)
+    return {"mensaje": "Sesión cerrada"}
+
 # --- Endpoints de Perfil ---
 
 @router.get("/perfil", response_model=Perfil)
@@ -151,6 +187,7 @@ async def update_perfil(
     }
 
     await current_user.update({"$set": perfil_data.model_dump()})
+    invalidar_usuario(current_user.email)
     print(f"Perfil de {current_user.email} actualizado.")
     return Perfil(
         nombre=perfil_data.nombre,
@@ -193,7 +230,7 @@ async def registro_usuario(
             detail="El correo electrónico ya está registrado"
         )
         
-    hashed_password = hash_password(user_data.contrasena)
+    hashed_password = await hashear_password(user_data.contrasena)
     
     nuevo_usuario = User(
         nombre=user_data.nombre,
@@ -203,14 +240,16 @@ async def registro_usuario(
     )
     
     await nuevo_usuario.insert()
+    # Por si quedó cacheado como inexistente
+    invalidar_usuario(nuevo_usuario.email)
 
     client_ip = request.client.host
-    await AuditLog(
+    await registro_auditoria.registrar(AuditLog(
         usuario=nuevo_usuario.email,
         accion="Resgistro de Nuevo Usuario",
         ip=client_ip,
         estado="Exito"
-    ).insert()
+    ))
     
     return UserBase(
         email=nuevo_usuario.email,
@@ -226,42 +265,26 @@ async def solicitar_recuperacion(request: PasswordRecoveryRequest):
         return {"mensaje": "Si el correo existe, se ha enviado un enlace."}
 
     expires = datetime.utcnow() + timedelta(minutes=RESET_TOKEN_EXPIRE_MINUTES)
-    to_encode = {"sub": user.email, "type": "recovery", "exp": expires}
+    # El jti queda registrado para que el enlace sirva una sola vez
+    jti = uuid.uuid4().hex
+    await emitir_codigo(f"reset:{jti}", jti, RESET_TOKEN_EXPIRE_MINUTES)
+    to_encode = {"sub": user.email, "type": "recovery", "exp": expires, "jti": jti}
     reset_token = jwt.encode(to_encode, db_settings.SECRET_KEY, algorithm=db_settings.ALGORITHM)
 
     link = f"http://localhost:4321/ResetPassword?token={reset_token}"
 
-    html_content = f"""
-    <html>
-        <body style="font-family: Arial, sans-serif; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #eee; border-radius: 10px;">
-                <h2 style="color: #6E0F2C; text-align: center;">Restablecer Contraseña</h2>
-                <p>Hola <strong>{user.nombre}</strong>,</p>
-                <p>Hemos recibido una solicitud para cambiar tu contraseña en <strong>La Nonna</strong>.</p>
-                <p>Haz clic en el siguiente botón para crear una nueva clave:</p>
-                
-                <div style="text-align: center; margin: 30px 0;">
-                    <a href="{link}" style="background-color: #6E0F2C; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; font-weight: bold;">
-                        Cambiar mi Contraseña
-                    </a>
-                </div>
-                
-                <p style="font-size: 12px; color: #777;">Este enlace expirará en 15 minutos.</p>
-                <p style="font-size: 12px; color: #777;">Si no solicitaste esto, puedes ignorar este correo.</p>
-            </div>
-        </body>
-    </html>
-    """
-
-    message = MessageSchema(
-        subject="Recuperación de Contraseña - La Nonna",
-        recipients=[request.email],  
-        body=html_content,
-        subtype=MessageType.html
+    encolado = servicio_correo.encolar(
+        user.email,
+        "Recuperación de Contraseña - La Nonna",
+        "recuperacion_password.html",
+        nombre=user.nombre,
+        link=link,
+        minutos=RESET_TOKEN_EXPIRE_MINUTES
     )
-
-    fm = FastMail(conf)
-    await fm.send_message(message)
+    if not encolado:
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE, "No se pudo enviar el correo, intenta más tarde"
+        )
 
     return {"mensaje": "Correo enviado con éxito"}
 
@@ -271,8 +294,9 @@ async def ejecutar_reset_password(data: PasswordResetConfirm):
         payload = jwt.decode(data.token, db_settings.SECRET_KEY, algorithms=[db_settings.ALGORITHM])
         email = payload.get("sub")
         token_type = payload.get("type")
+        jti = payload.get("jti")
 
-        if token_type != "recovery":
+        if token_type != "recovery" or not jti:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, "Token inválido")
             
     except JWTError:
@@ -282,9 +306,14 @@ async def ejecutar_reset_password(data: PasswordResetConfirm):
     if not user:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Usuario no encontrado")
 
-    nuevo_hash = hash_password(data.new_password)
-    user.hashed_password = nuevo_hash
-    await user.save()
+    nuevo_hash = await hashear_password(data.new_password)
+    if not await verificar_y_consumir(f"reset:{jti}", jti):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "El enlace ya fue usado o ha expirado")
+
+    await user.update({"$set": {"hashedPassword": nuevo_hash}})
+    # Las sesiones abiertas con la clave anterior dejan de valer
+    await revocaciones.nueva_version(user.id)
+    invalidar_usuario(user.email)
 
     return {"mensaje": "Contraseña actualizada correctamente. Ahora puedes iniciar sesión."}
 
@@ -300,9 +329,7 @@ async def solicitar_2fa(data: TwoFARequest):
         return {"mensaje": "Si el número existe, se envió el código."}
 
     codigo = str(random.randint(1000, 9999))
-    
-    user.verification_code = codigo
-    await user.save()
+    await emitir_codigo(f"2fa:{data.telefono}", codigo, MINUTOS_CODIGO_2FA)
 
     print(f"\n========================================")
     print(f"📱 [SIMULACIÓN SMS] Para: {data.telefono}")
@@ -312,16 +339,9 @@ async def solicitar_2fa(data: TwoFARequest):
     return {"mensaje": "Código enviado."}
 
 @router.post("/auth/2fa/verify")
-async def verificar_2fa(data: TwoFAVerify):
-    user = await User.find_one(User.telefono == data.telefono)
-    
-    if not user:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, "Usuario no encontrado")
-
-    if user.verification_code != data.codigo:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Código incorrecto")
-
-    user.verification_code = None
-    await user.save()
+async def verificar_2fa(request: Request, data: TwoFAVerify):
+    await limitar((DOS_FA_POR_IP, request.client.host), (DOS_FA_POR_TELEFONO, data.telefono))
+    if not await verificar_y_consumir(f"2fa:{data.telefono}", data.codigo):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Código incorrecto o vencido")
 
     return {"mensaje": "Autenticación exitosa. 2FA Activado."}
\ No newline at end of file
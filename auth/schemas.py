@@ -1,7 +1,9 @@
 # auth/schemas.py
 from pydantic import BaseModel, EmailStr, Field
+from datetime import datetime
 from typing import Optional
 from beanie import Document
+from pymongo import IndexModel
 import bcrypt
 from enum import Enum
 
@@ -18,12 +20,18 @@ class User(Document):
     hashed_password : str = Field(..., alias="hashedPassword")
     rol: Roles = Roles.CLIENTE
     telefono: Optional[str] = None
-    verification_code: Optional[str] = None
     foto_url: Optional[str] = None
     direccion: Optional[str] = None
+    # Se incrementa para invalidar todos los tokens ya emitidos del usuario
+    tokenVersion: int = 0
 
     class Settings:
         name = "usuarios"
+        indexes = [
+            IndexModel([("email", 1)], unique=True),
+            [("telefono", 1)],
+            [("tokenVersion", 1)],
+        ]
 
     # --- Metodo de ayuda ---
     def check_password(self, clear_password: str) -> bool:
@@ -62,9 +70,42 @@ class InvitarMiembroRequest(BaseModel):
 class RevocarAccesoRequest(BaseModel):
     email: EmailStr
     
+# Claims firmados del token de acceso
 class TokenData(BaseModel):
-    email: Optional[str] = None
-    rol: Optional[str] = None
+    sub: str
+    uid: str
+    rol: str
+    nombre: str
+    iat: int
+    exp: int
+    tv: int = 0
+    jti: str
+
+class CodigoVerificacion(Document):
+    # "2fa:<teléfono>" o "reset:<jti del token de recuperación>"
+    clave: str
+    codigo: str
+    intentos: int = 0
+    expira: datetime
+
+    class Settings:
+        name = "codigos_verificacion"
+        indexes = [
+            IndexModel([("clave", 1)], unique=True),
+            IndexModel([("expira", 1)], expireAfterSeconds=0),
+        ]
+
+class TokenRevocado(Document):
+    # "jti:<id del token>" revoca una sesión; "uid:<id del usuario>", todas
+    clave: str
+    expira: datetime
+
+    class Settings:
+        name = "tokens_revocados"
+        indexes = [
+            IndexModel([("clave", 1)], unique=True),
+            IndexModel([("expira", 1)], expireAfterSeconds=0),
+        ]
 
 class UserCreate(BaseModel):
     nombre: str
@@ -78,6 +119,29 @@ def hash_password(password: str) -> str:
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
+# --- Límite de intentos (modo compartido en Mongo) ---
+class IntentoVentana(Document):
+    # "<límite>:<valor>:<n° de ventana>"
+    id: str
+    contador: int = 0
+    expira: datetime
+
+    class Settings:
+        name = "limites_intentos"
+        indexes = [
+            IndexModel([("expira", 1)], expireAfterSeconds=0),
+        ]
+
+class MetricasHash(BaseModel):
+    hilos: int
+    maxCola: int
+    enCurso: int
+    enCola: int
+    completadas: int
+    rechazadas: int
+    esperaPromedioMs: float
+    duracionPromedioMs: float
+
 # --- Recuperación de Contraseña  ---
 class PasswordRecoveryRequest(BaseModel):
     email: EmailStr
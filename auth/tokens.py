@@ -0,0 +1,89 @@
+# auth/tokens.py
+from beanie import BeanieObjectId
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Set
+
+from db import db_settings
+from periodicas import TareaPeriodica
+from .schemas import TokenData, TokenRevocado, User
+
+
+class Revocaciones:
+    """
+    Copia en memoria de lo revocado: la lista de tokens y usuarios
+    bloqueados y la versión de token vigente de cada usuario que alguna vez
+    la subió. Se refresca desde Mongo cada TOKEN_REVOCATION_REFRESH_SECONDS;
+    lo que revoca este mismo proceso se aplica en el acto.
+    """
+
+    def __init__(self):
+        self._bloqueados: Set[str] = set()
+        self._versiones: Dict[str, int] = {}
+
+    def revocado(self, claims: TokenData) -> bool:
+        return (
+            f"jti:{claims.jti}" in self._bloqueados
+            or f"uid:{claims.uid}" in self._bloqueados
+            or claims.tv < self._versiones.get(claims.uid, 0)
+        )
+
+    async def refrescar(self) -> None:
+        ahora = datetime.now(timezone.utc)
+        # Lo que se revoque localmente mientras se lee no debe perderse
+        bloqueados_antes = set(self._bloqueados)
+        versiones_antes = dict(self._versiones)
+        bloqueados = {
+            doc["clave"] async for doc in TokenRevocado.get_motor_collection().find(
+                {"expira": {"$gt": ahora}}, {"clave": 1}
+            )
+        }
+        versiones = {
+            str(doc["_id"]): doc["tokenVersion"] async for doc in User.get_motor_collection().find(
+                {"tokenVersion": {"$gt": 0}}, {"tokenVersion": 1}
+            )
+        }
+        bloqueados |= self._bloqueados - bloqueados_antes
+        for uid, version in self._versiones.items():
+            if versiones_antes.get(uid) != version:
+                versiones[uid] = max(version, versiones.get(uid, 0))
+        self._bloqueados = bloqueados
+        self._versiones = versiones
+
+    async def _bloquear(self, clave: str, expira: datetime) -> None:
+        # expira va en UTC: el índice TTL lo compara con la hora UTC de Mongo
+        await TokenRevocado.get_motor_collection().update_one(
+            {"clave": clave}, {"$set": {"expira": expira}}, upsert=True
+        )
+        self._bloqueados.add(clave)
+
+    async def revocar_token(self, claims: TokenData) -> None:
+        """Cierra una sesión: el jti queda bloqueado hasta que el token vence solo."""
+        await self._bloquear(f"jti:{claims.jti}", datetime.fromtimestamp(claims.exp, timezone.utc))
+
+    async def revocar_usuario(self, usuario_id: BeanieObjectId) -> None:
+        """Bloquea todos los tokens de un usuario que ya no existe."""
+        await self._bloquear(
+            f"uid:{usuario_id}",
+            datetime.now(timezone.utc) + timedelta(minutes=db_settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        )
+
+    async def nueva_version(self, usuario_id: BeanieObjectId) -> int:
+        """Invalida los tokens emitidos hasta ahora (cambio de clave o de rol)."""
+        doc = await User.get_motor_collection().find_one_and_update(
+            {"_id": usuario_id},
+            {"$inc": {"tokenVersion": 1}},
+            projection={"tokenVersion": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not doc:
+            return 0
+        self._versiones[str(usuario_id)] = doc["tokenVersion"]
+        return doc["tokenVersion"]
+
+
+revocaciones = Revocaciones()
+
+refresco_revocaciones = TareaPeriodica(
+    "Revocaciones de tokens", revocaciones.refrescar, db_settings.TOKEN_REVOCATION_REFRESH_SECONDS
+)
@@ -0,0 +1,25 @@
+# auth/usuarios.py
+from typing import Optional
+
+from cache import CacheTTL
+from .schemas import User
+
+# Usuario autenticado por email (el "sub" del token). Los endpoints que
+# modifican usuarios invalidan su entrada; el TTL acota lo que puede quedar
+# desactualizado si hay varios procesos de la API.
+usuarios_cache = CacheTTL(max_entradas=10_000, ttl=60)
+
+
+async def buscar_usuario(email: str) -> Optional[User]:
+    """
+    Usuario por email, desde el cache. Devuelve una copia para que un
+    endpoint que la modifique no afecte a las demás peticiones.
+    """
+    usuario = await usuarios_cache.obtener_o_cargar(
+        email, lambda: User.find_one(User.email == email)
+    )
+    return usuario.model_copy() if usuario else None
+
+
+def invalidar_usuario(email: str) -> None:
+    usuarios_cache.invalidar(email)
@@ -0,0 +1,118 @@
+# bench_login.py
+# Prueba de carga del pool de bcrypt: python bench_login.py [logins concurrentes]
+# Usa la base del .env. Levanta la app en proceso (httpx con transporte ASGI) y
+# mide la latencia de GET /api/productos mientras corren logins de verdad contra
+# POST /api/auth/login: sin logins, con bcrypt en el event loop (como antes) y
+# con pool_hash. Los logins rechazados (503 por pool lleno, 429 por el límite de
+# intentos) se cuentan aparte de los completados.
+import asyncio
+import math
+import statistics
+import sys
+import time
+from collections import Counter
+
+import bcrypt
+import httpx
+
+import auth.router
+from auth.hashing import pool_hash
+from auth.limites import LOGIN_POR_CUENTA
+from auth.schemas import Roles, User
+from main import app
+
+CLAVE = "nonna-1234"
+PREFIJO_CORREO = "bench-login-"
+PETICIONES_CATALOGO = 400
+INTERVALO_CATALOGO = 0.005
+URL_CATALOGO = "/api/productos?solo_activos=true"
+
+
+async def _verificar_en_loop(usuario: User, clave: str) -> bool:
+    await asyncio.sleep(0)
+    return usuario.check_password(clave)
+
+
+async def _crear_usuarios(cantidad: int) -> None:
+    """Usuarios desechables con el mismo hash, para no pasar el límite por cuenta."""
+    coleccion = User.get_motor_collection()
+    await coleccion.delete_many({"email": {"$regex": f"^{PREFIJO_CORREO}"}})
+    hashed = bcrypt.hashpw(CLAVE.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    await coleccion.insert_many([
+        {"email": f"{PREFIJO_CORREO}{i}@lanonna.cl", "nombre": "Bench", "hashedPassword": hashed,
+         "rol": Roles.CLIENTE.value, "tokenVersion": 0}
+        for i in range(cantidad)
+    ])
+
+
+def _cliente(ip: str) -> httpx.AsyncClient:
+    # Una IP por login para que el límite por IP no frene la prueba
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 50000)), base_url="http://bench")
+
+
+async def _login(numero: int, estados: Counter) -> None:
+    correo = f"{PREFIJO_CORREO}{numero // LOGIN_POR_CUENTA.maximo}@lanonna.cl"
+    async with _cliente(f"10.{numero // 65536 % 256}.{numero // 256 % 256}.{numero % 256}") as cliente:
+        respuesta = await cliente.post("/api/auth/login", data={"username": correo, "password": CLAVE})
+    estados[respuesta.status_code] += 1
+
+
+async def _catalogo(latencias: list, errores: Counter) -> None:
+    async with _cliente("127.0.0.1") as cliente:
+        for _ in range(PETICIONES_CATALOGO):
+            inicio = time.perf_counter()
+            respuesta = await cliente.get(URL_CATALOGO)
+            latencias.append(time.perf_counter() - inicio)
+            if respuesta.status_code != 200:
+                errores[respuesta.status_code] += 1
+            await asyncio.sleep(INTERVALO_CATALOGO)
+
+
+def _percentil(valores: list, p: float) -> float:
+    return statistics.quantiles(valores, n=100)[int(p) - 1] * 1000
+
+
+async def _escenario(nombre: str, logins: range) -> None:
+    latencias: list = []
+    errores_catalogo: Counter = Counter()
+    estados: Counter = Counter()
+    inicio = time.perf_counter()
+    await asyncio.gather(_catalogo(latencias, errores_catalogo), *(_login(n, estados) for n in logins))
+    duracion = time.perf_counter() - inicio
+    print(
+        f"{nombre:<22} p50 {_percentil(latencias, 50):8.2f} ms"
+        f"   p99 {_percentil(latencias, 99):8.2f} ms   total {duracion:6.2f} s"
+    )
+    if logins:
+        otros = {codigo: n for codigo, n in estados.items() if codigo not in (200, 429, 503)}
+        print(
+            f"{'':<22} logins: {estados[200]} completados, {estados[503]} rechazados (503),"
+            f" {estados[429]} limitados (429), otros {otros or 0}"
+        )
+    if errores_catalogo:
+        print(f"{'':<22} catálogo con errores: {dict(errores_catalogo)}")
+
+
+async def main(logins: int) -> None:
+    async with app.router.lifespan_context(app):
+        # Cada escenario usa sus propias cuentas e IPs: el límite de intentos dura 5 minutos
+        cuentas = math.ceil(logins / LOGIN_POR_CUENTA.maximo)
+        await _crear_usuarios(2 * cuentas)
+        try:
+            print(f"{logins} logins concurrentes, {PETICIONES_CATALOGO} peticiones a {URL_CATALOGO}")
+            await _escenario("sin logins", range(0))
+
+            verificar_con_pool = auth.router.verificar_password
+            auth.router.verificar_password = _verificar_en_loop
+            await _escenario("bcrypt en el loop", range(logins))
+            auth.router.verificar_password = verificar_con_pool
+
+            desde = cuentas * LOGIN_POR_CUENTA.maximo
+            await _escenario("bcrypt en pool_hash", range(desde, desde + logins))
+            print(pool_hash.metricas())
+        finally:
+            await User.get_motor_collection().delete_many({"email": {"$regex": f"^{PREFIJO_CORREO}"}})
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
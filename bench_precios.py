@@ -0,0 +1,69 @@
+# bench_precios.py
+# Micro-benchmark del motor de precios: python bench_precios.py [carritos]
+# Compara calcular() uno a uno con calcular_lote(), que es el mismo loop pero
+# evalúa cada cupón una sola vez; la diferencia sale solo de eso.
+import gc
+import random
+import sys
+import time
+from datetime import date
+
+from cart.precios import LineaPrecio, ReglaCupon, calcular, calcular_lote
+
+
+def _carritos(n: int, semilla: int = 7):
+    azar = random.Random(semilla)
+    carritos = []
+    for _ in range(n):
+        carritos.append([
+            LineaPrecio(
+                variante_sku=f"SKU-{azar.randint(1, 500)}",
+                precio_unitario=azar.randrange(990, 25990, 10),
+                cantidad=azar.randint(1, 6),
+                categoria_id=str(azar.randint(1, 12))
+            )
+            for _ in range(azar.randint(1, 12))
+        ])
+    return carritos
+
+
+def _medir(nombre: str, funcion, repeticiones: int = 5) -> float:
+    # Como timeit: sin el GC para que no meta ruido entre repeticiones
+    mejor = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            funcion()
+            mejor = min(mejor, time.perf_counter() - inicio)
+    finally:
+        gc.enable()
+    print(f"{nombre:<28} {mejor * 1000:9.2f} ms")
+    return mejor
+
+
+def main(n: int) -> None:
+    hoy = date.today()
+    carritos = _carritos(n)
+    porcentaje = ReglaCupon(
+        codigo="NONNA10", tipo="Porcentaje", valor=12.5, pedido_minimo=20000,
+        categorias_excluidas=frozenset({"3"})
+    )
+    monto_fijo = ReglaCupon(codigo="MENOS5000", tipo="Monto Fijo", valor=5000)
+    cupones = [(porcentaje, monto_fijo, None)[i % 3] for i in range(n)]
+    lineas = sum(len(c) for c in carritos)
+    print(f"{n} carritos, {lineas} líneas")
+
+    uno_a_uno = _medir("calcular (uno a uno)", lambda: [
+        calcular(c, r, hoy) for c, r in zip(carritos, cupones)
+    ])
+    lote = _medir("calcular_lote", lambda: calcular_lote(carritos, cupones, hoy))
+    print(f"{'carritos/s (lote)':<28} {n / lote:12,.0f}")
+    print(f"{'speedup lote':<28} {uno_a_uno / lote:12.2f}x")
+
+    # Ambos caminos deben dar exactamente lo mismo
+    assert [calcular(c, r, hoy) for c, r in zip(carritos, cupones)] == calcular_lote(carritos, cupones, hoy)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
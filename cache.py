@@ -0,0 +1,56 @@
+# cache.py
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+import time
+
+
+class CacheTTL:
+    """
+    Cache en memoria con tope de entradas (LRU) y vencimiento por TTL.
+    También guarda los resultados negativos (None), para que una clave
+    inexistente no vuelva a consultar la base en cada petición.
+    """
+
+    def __init__(self, max_entradas: int, ttl: float):
+        self._max_entradas = max_entradas
+        self._ttl = ttl
+        self._entradas: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._generacion = 0
+
+    def obtener(self, clave: Hashable) -> Tuple[bool, Any]:
+        """Devuelve (encontrado, valor); el valor puede ser None si se cacheó un negativo."""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return False, None
+        vence, valor = entrada
+        if vence < time.monotonic():
+            del self._entradas[clave]
+            return False, None
+        self._entradas.move_to_end(clave)
+        return True, valor
+
+    def guardar(self, clave: Hashable, valor: Any, generacion: Optional[int] = None) -> None:
+        # Si alguien invalidó mientras se cargaba el valor, no se guarda
+        if generacion is not None and generacion != self._generacion:
+            return
+        self._entradas[clave] = (time.monotonic() + self._ttl, valor)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self._max_entradas:
+            self._entradas.popitem(last=False)
+
+    async def obtener_o_cargar(self, clave: Hashable, cargar: Callable[[], Awaitable[Any]]) -> Any:
+        encontrado, valor = self.obtener(clave)
+        if encontrado:
+            return valor
+        generacion = self._generacion
+        valor = await cargar()
+        self.guardar(clave, valor, generacion)
+        return valor
+
+    def invalidar(self, clave: Optional[Hashable] = None) -> None:
+        """Sin clave vacía todo el cache."""
+        self._generacion += 1
+        if clave is None:
+            self._entradas.clear()
+        else:
+            self._entradas.pop(clave, None)
@@ -0,0 +1,193 @@
+# cart/precios.py
+# Motor de precios del carrito. No hace I/O: recibe una foto del carrito y el
+# cupón ya convertidos a estas dataclasses y trabaja siempre en pesos enteros
+# (CLP no tiene decimales), así no se acumulan errores de float.
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class LineaPrecio:
+    variante_sku: str
+    precio_unitario: int
+    cantidad: int
+    categoria_id: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ReglaCupon:
+    codigo: str
+    tipo: str
+    valor: float
+    activo: bool = True
+    pedido_minimo: int = 0
+    vigencia_desde: Optional[date] = None
+    vigencia_hasta: Optional[date] = None
+    categorias_excluidas: FrozenSet[str] = frozenset()
+
+
+@dataclass
+class ResultadoPrecio:
+    subtotales: List[int]
+    subtotal: int
+    descuento: int
+    total: int
+    cupon_aplicado: Optional[str] = None
+    mensaje_cupon: Optional[str] = None
+
+
+def a_clp(monto: float) -> int:
+    """Redondea a peso entero, mitad hacia arriba (5990.5 -> 5991)."""
+    return int(Decimal(str(monto)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def lineas_desde_items(items) -> List[LineaPrecio]:
+    """Foto de los items de un carrito (CartItem o equivalente)."""
+    return [
+        LineaPrecio(
+            variante_sku=item.variante_sku,
+            precio_unitario=a_clp(item.precioUnitario),
+            cantidad=item.cantidad,
+            categoria_id=getattr(item, "categoriaId", None)
+        )
+        for item in items
+    ]
+
+
+def regla_desde_cupon(cupon) -> ReglaCupon:
+    """Convierte un documento Cupon (o cualquier objeto con sus campos) en ReglaCupon."""
+    return ReglaCupon(
+        codigo=cupon.codigo,
+        tipo=cupon.tipo,
+        valor=cupon.valor,
+        activo=cupon.estado == "Activo",
+        pedido_minimo=a_clp(cupon.pedidoMinimo or 0),
+        vigencia_desde=cupon.vigenciaDesde,
+        vigencia_hasta=cupon.vigenciaHasta,
+        categorias_excluidas=frozenset(cupon.categoriasExcluidas or [])
+    )
+
+
+def motivo_no_vigente(regla: ReglaCupon, hoy: Optional[date] = None) -> Optional[str]:
+    """Por qué el cupón no se puede usar hoy, o None si está vigente."""
+    hoy = hoy or date.today()
+    if not regla.activo:
+        return "Cupón no válido"
+    if regla.vigencia_desde and regla.vigencia_desde > hoy:
+        return "El cupón aún no está vigente"
+    if regla.vigencia_hasta and regla.vigencia_hasta < hoy:
+        return "El cupón ha expirado"
+    return None
+
+
+def _parametros(regla: ReglaCupon, hoy: date) -> Tuple[str, str, int]:
+    """
+    Lo que del cupón no depende del carrito: motivo de no vigencia ("" si
+    está vigente), tipo normalizado y valor entero (centésimas de porcentaje
+    o pesos).
+    """
+    motivo = motivo_no_vigente(regla, hoy) or ""
+    tipo = regla.tipo.lower()
+    if tipo == "porcentaje":
+        # Porcentaje en centésimas para que 12.5% siga siendo aritmética entera
+        valor = a_clp(regla.valor * 100)
+    elif tipo == "monto fijo":
+        valor = a_clp(regla.valor)
+    else:
+        motivo = motivo or "Cupón no válido"
+        valor = 0
+    return motivo, tipo, valor
+
+
+def _descuento(
+    regla: ReglaCupon,
+    parametros: Tuple[str, str, int],
+    lineas: Sequence[LineaPrecio],
+    subtotales: Sequence[int],
+    subtotal: int
+) -> Tuple[int, Optional[str], Optional[str]]:
+    """Devuelve (descuento, cupón aplicado, mensaje) aplicando todas las reglas del cupón."""
+    motivo, tipo, valor = parametros
+    if motivo:
+        return 0, None, motivo
+    if subtotal < regla.pedido_minimo:
+        return 0, None, f"El cupón requiere un pedido mínimo de ${regla.pedido_minimo}"
+
+    # Solo descuentan las líneas de categorías no excluidas
+    if regla.categorias_excluidas:
+        excluidas = regla.categorias_excluidas
+        base = sum(
+            s for linea, s in zip(lineas, subtotales)
+            if linea.categoria_id not in excluidas
+        )
+    else:
+        base = subtotal
+    if base == 0:
+        return 0, None, "El cupón no aplica a los productos del carrito"
+
+    if tipo == "porcentaje":
+        descuento = (base * valor + 5000) // 10000
+    else:
+        descuento = valor
+
+    # Nunca más que lo descontable: el total no puede quedar negativo
+    descuento = min(descuento, base)
+    return descuento, regla.codigo, f"Cupón '{regla.codigo}' aplicado"
+
+
+def calcular(
+    lineas: Sequence[LineaPrecio],
+    cupon: Optional[ReglaCupon] = None,
+    hoy: Optional[date] = None
+) -> ResultadoPrecio:
+    """Precio de un carrito: subtotal por línea, descuento y total."""
+    subtotales = [linea.precio_unitario * linea.cantidad for linea in lineas]
+    subtotal = sum(subtotales)
+    if cupon is None:
+        return ResultadoPrecio(subtotales, subtotal, 0, subtotal)
+    descuento, aplicado, mensaje = _descuento(
+        cupon, _parametros(cupon, hoy or date.today()), lineas, subtotales, subtotal
+    )
+    return ResultadoPrecio(
+        subtotales=subtotales,
+        subtotal=subtotal,
+        descuento=descuento,
+        total=subtotal - descuento,
+        cupon_aplicado=aplicado,
+        mensaje_cupon=mensaje
+    )
+
+
+def calcular_lote(
+    carritos: Sequence[Sequence[LineaPrecio]],
+    cupones: Optional[Sequence[Optional[ReglaCupon]]] = None,
+    hoy: Optional[date] = None
+) -> List[ResultadoPrecio]:
+    """
+    Precio de varios carritos en un solo llamado. Es un loop por carrito, con
+    el mismo trabajo por línea que calcular(); lo único que se ahorra es lo
+    que depende solo del cupón (vigencia, tipo, valor entero), que se calcula
+    una vez por cupón distinto y no una vez por carrito. No está vectorizado:
+    armar columnas desde las dataclasses costaría lo mismo que este loop.
+    """
+    hoy = hoy or date.today()
+    cupones = cupones or [None] * len(carritos)
+
+    # Por id: el mismo cupón suele venir como el mismo objeto en todo el lote
+    parametros: Dict[int, Tuple[str, str, int]] = {}
+    resultados = []
+    for lineas, regla in zip(carritos, cupones):
+        subtotales = [linea.precio_unitario * linea.cantidad for linea in lineas]
+        subtotal = sum(subtotales)
+
+        if regla is None:
+            resultados.append(ResultadoPrecio(subtotales, subtotal, 0, subtotal))
+            continue
+        clave = id(regla)
+        if clave not in parametros:
+            parametros[clave] = _parametros(regla, hoy)
+        descuento, aplicado, mensaje = _descuento(regla, parametros[clave], lineas, subtotales, subtotal)
+        resultados.append(ResultadoPrecio(subtotales, subtotal, descuento, subtotal - descuento, aplicado, mensaje))
+    return resultados
@@ -0,0 +1,254 @@
+# cart/reservas.py
+from fastapi import HTTPException, status
+from beanie import BeanieObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+import uuid
+
+from admin.schemas import ReglasCarrito
+from cache import CacheTTL
+from catalog.schemas import Producto
+from db import db_settings
+from periodicas import TareaPeriodica
+from .schemas import ReservaStock
+
+# Lo que puede durar el ida y vuelta con Webpay antes de devolver el stock
+MINUTOS_PAGO = 30
+TAMANO_LOTE_LIBERACION = 500
+# expira y cerrada van en UTC: el índice TTL de cerrada las compara con la hora UTC de Mongo
+
+# El PUT de reglas en el panel admin invalida este cache
+reglas_cache = CacheTTL(max_entradas=1, ttl=60)
+
+
+async def _minutos_reserva() -> int:
+    reglas = await reglas_cache.obtener_o_cargar("reglas", ReglasCarrito.find_one)
+    if reglas:
+        return reglas.tiempoReservaStockMinutos
+    return ReglasCarrito.model_fields["tiempoReservaStockMinutos"].default
+
+
+# --- Stock de las variantes ---
+
+async def _descontar_stock(producto_id: BeanieObjectId, sku: str, cantidad: int) -> Optional[bool]:
+    """
+    Descuenta en un solo update condicionado a que alcance. Devuelve True si
+    descontó, False si no alcanza y None si la variante no controla stock.
+    """
+    productos = Producto.get_motor_collection()
+    resultado = await productos.update_one(
+        {"_id": producto_id, "variantes": {"$elemMatch": {"sku": sku, "stock": {"$gte": cantidad}}}},
+        {"$inc": {"variantes.$.stock": -cantidad}}
+    )
+    if resultado.modified_count:
+        return True
+    sin_control = await productos.count_documents(
+        {"_id": producto_id, "variantes": {"$elemMatch": {"sku": sku, "stock": None}}}, limit=1
+    )
+    return None if sin_control else False
+
+
+def _devolucion(producto_id: BeanieObjectId, sku: str, cantidad: int) -> UpdateOne:
+    return UpdateOne(
+        {"_id": producto_id, "variantes": {"$elemMatch": {"sku": sku, "stock": {"$ne": None}}}},
+        {"$inc": {"variantes.$.stock": cantidad}}
+    )
+
+
+async def _devolver_stock(devoluciones: Counter) -> None:
+    """devoluciones: (producto_id, sku) -> unidades; un bulk_write para todas."""
+    operaciones = [_devolucion(p, s, n) for (p, s), n in devoluciones.items() if n > 0]
+    if operaciones:
+        await Producto.get_motor_collection().bulk_write(operaciones, ordered=False)
+
+
+# --- Reservas ---
+
+async def reservar(usuario_id: BeanieObjectId, producto_id: BeanieObjectId, sku: str, cantidad: int) -> bool:
+    """
+    Reserva unidades para el carrito del usuario: primero el descuento atómico
+    del stock y luego la reserva (una activa por usuario y SKU, que se va
+    sumando y renueva su vencimiento). False si no hay stock suficiente.
+    """
+    descontado = await _descontar_stock(producto_id, sku, cantidad)
+    if descontado is None:
+        return True
+    if not descontado:
+        return False
+
+    expira = datetime.now(timezone.utc) + timedelta(minutes=await _minutos_reserva())
+    coleccion = ReservaStock.get_motor_collection()
+    for intento in range(2):
+        try:
+            await coleccion.find_one_and_update(
+                {"usuarioId": usuario_id, "variante_sku": sku, "estado": "activa"},
+                {
+                    "$inc": {"cantidad": cantidad},
+                    "$set": {"expira": expira},
+                    "$setOnInsert": {"productoId": producto_id}
+                },
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Dos upserts a la vez: el segundo intento encuentra la reserva creada
+            if intento:
+                await _devolver_stock(Counter({(producto_id, sku): cantidad}))
+                raise
+    return True
+
+
+async def liberar(usuario_id: BeanieObjectId, sku: str, cantidad: Optional[int] = None) -> None:
+    """Devuelve al stock `cantidad` unidades reservadas (todas si es None)."""
+    coleccion = ReservaStock.get_motor_collection()
+    reserva = await coleccion.find_one({"usuarioId": usuario_id, "variante_sku": sku, "estado": "activa"})
+    if not reserva:
+        return
+
+    n = reserva["cantidad"] if cantidad is None else min(cantidad, reserva["cantidad"])
+    if n >= reserva["cantidad"]:
+        cambiado = await coleccion.find_one_and_update(
+            {"_id": reserva["_id"], "estado": "activa", "cantidad": reserva["cantidad"]},
+            {"$set": {"estado": "liberada", "cerrada": datetime.now(timezone.utc)}}
+        )
+    else:
+        cambiado = await coleccion.find_one_and_update(
+            {"_id": reserva["_id"], "estado": "activa", "cantidad": {"$gte": n}},
+            {"$inc": {"cantidad": -n}}
+        )
+    if cambiado:
+        await _devolver_stock(Counter({(reserva["productoId"], sku): n}))
+
+
+async def ajustar(
+    usuario_id: BeanieObjectId, producto_id: BeanieObjectId, sku: str, anterior: int, nueva: int
+) -> bool:
+    """Lleva la reserva de una línea de `anterior` a `nueva` unidades."""
+    if nueva > anterior:
+        return await reservar(usuario_id, producto_id, sku, nueva - anterior)
+    if nueva < anterior:
+        await liberar(usuario_id, sku, anterior - nueva)
+    return True
+
+
+# --- Checkout ---
+
+async def preparar_pago(usuario_id: BeanieObjectId, items: Iterable, numero_orden: str) -> None:
+    """
+    Asegura que cada línea del carrito esté cubierta (las reservas pudieron
+    vencer) y las pasa a en_pago, atadas a la orden. 409 si ya no hay stock.
+    """
+    coleccion = ReservaStock.get_motor_collection()
+    reservadas = {
+        r["variante_sku"]: r["cantidad"]
+        async for r in coleccion.find({"usuarioId": usuario_id, "estado": "activa"})
+    }
+    for item in items:
+        faltan = item.cantidad - reservadas.get(item.variante_sku, 0)
+        if faltan > 0 and not await reservar(usuario_id, item.producto_id, item.variante_sku, faltan):
+            raise HTTPException(
+                status.HTTP_409_CONFLICT,
+                f"No queda stock suficiente de '{item.nombreProducto}'"
+            )
+
+    await coleccion.update_many(
+        {"usuarioId": usuario_id, "estado": "activa"},
+        {"$set": {
+            "estado": "en_pago",
+            "numeroOrden": numero_orden,
+            "expira": datetime.now(timezone.utc) + timedelta(minutes=MINUTOS_PAGO)
+        }}
+    )
+
+
+async def asegurar_pago(usuario_id: BeanieObjectId, numero_orden: str) -> bool:
+    """
+    Se llama antes de confirmar la transacción en Webpay. Si el pago tardó
+    más que MINUTOS_PAGO, el liberador ya devolvió el stock de la orden: se
+    vuelve a descontar y las reservas regresan a en_pago. False (y nada
+    descontado) si alguna unidad ya se vendió a otro cliente.
+    """
+    coleccion = ReservaStock.get_motor_collection()
+    expira = datetime.now(timezone.utc) + timedelta(minutes=MINUTOS_PAGO)
+    filtro = {"usuarioId": usuario_id, "numeroOrden": numero_orden}
+    # Primero se alarga el plazo de las que siguen en pago, para que no se liberen ahora
+    await coleccion.update_many({**filtro, "estado": "en_pago"}, {"$set": {"expira": expira}})
+
+    liberadas = await coleccion.find({**filtro, "estado": "liberada"}).to_list(None)
+    descontadas: Counter = Counter()
+    for r in liberadas:
+        if await _descontar_stock(r["productoId"], r["variante_sku"], r["cantidad"]) is False:
+            await _devolver_stock(descontadas)
+            return False
+        descontadas[(r["productoId"], r["variante_sku"])] += r["cantidad"]
+
+    if liberadas:
+        await coleccion.update_many(
+            {"_id": {"$in": [r["_id"] for r in liberadas]}, "estado": "liberada"},
+            {"$set": {"estado": "en_pago", "expira": expira}, "$unset": {"cerrada": "", "lote": ""}}
+        )
+    return True
+
+
+async def confirmar_pago(usuario_id: BeanieObjectId, numero_orden: str) -> int:
+    """El pago se aprobó: las unidades ya descontadas quedan vendidas."""
+    resultado = await ReservaStock.get_motor_collection().update_many(
+        {"usuarioId": usuario_id, "numeroOrden": numero_orden, "estado": "en_pago"},
+        {"$set": {"estado": "confirmada", "cerrada": datetime.now(timezone.utc)}}
+    )
+    return resultado.modified_count
+
+
+async def _liberar_lote(filtro: dict) -> int:
+    """
+    Marca como liberadas las reservas del filtro con una etiqueta de lote y
+    devuelve su stock: solo se devuelve lo que este lote alcanzó a marcar.
+    """
+    coleccion = ReservaStock.get_motor_collection()
+    lote = uuid.uuid4().hex
+    marcadas = await coleccion.update_many(
+        filtro, {"$set": {"estado": "liberada", "cerrada": datetime.now(timezone.utc), "lote": lote}}
+    )
+    if not marcadas.modified_count:
+        return 0
+
+    devoluciones: Counter = Counter()
+    async for r in coleccion.find({"lote": lote}, {"productoId": 1, "variante_sku": 1, "cantidad": 1}):
+        devoluciones[(r["productoId"], r["variante_sku"])] += r["cantidad"]
+    await _devolver_stock(devoluciones)
+    return marcadas.modified_count
+
+
+async def cancelar_pago(usuario_id: BeanieObjectId, numero_orden: str) -> int:
+    """Pago rechazado o fallido: el stock vuelve a estar disponible."""
+    return await _liberar_lote({"usuarioId": usuario_id, "numeroOrden": numero_orden, "estado": "en_pago"})
+
+
+async def liberar_vencidas() -> int:
+    """Libera por lotes las reservas activas o en pago cuyo plazo ya venció."""
+    coleccion = ReservaStock.get_motor_collection()
+    total = 0
+    while True:
+        ids = [
+            r["_id"] async for r in coleccion.find(
+                {"estado": {"$in": ["activa", "en_pago"]}, "expira": {"$lte": datetime.now(timezone.utc)}},
+                {"_id": 1}
+            ).limit(TAMANO_LOTE_LIBERACION)
+        ]
+        if not ids:
+            return total
+        total += await _liberar_lote({
+            "_id": {"$in": ids},
+            "estado": {"$in": ["activa", "en_pago"]},
+            "expira": {"$lte": datetime.now(timezone.utc)}
+        })
+        if len(ids) < TAMANO_LOTE_LIBERACION:
+            return total
+
+
+liberador_reservas = TareaPeriodica(
+    "Reservas de stock vencidas liberadas", liberar_vencidas, db_settings.STOCK_REAPER_INTERVAL_SECONDS
+)
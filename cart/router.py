@@ -1,15 +1,22 @@
 # cart/router.py
 from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from .schemas import (
     Carrito, CartOut, CartItem, CartItemAdd, CartItemUpdate, 
     CouponApply, CartMerge
 )
+from .store import carrito_store
+from .reservas import reservar, liberar, ajustar
+from .precios import (
+    ReglaCupon, calcular, lineas_desde_items, regla_desde_cupon, motivo_no_vigente
+)
 from auth.schemas import User, TokenResponse, UserBase
 from auth.router import get_current_user 
-from admin.schemas import Cupon
+from admin.schemas import ReglasCarrito
+from admin.cupones import buscar_cupon
 from catalog.schemas import Producto, VarianteProducto
 from beanie import BeanieObjectId, Link
+from beanie.operators import In
 
 router = APIRouter(
     prefix="/api/carrito",
@@ -18,50 +25,45 @@ router = APIRouter(
 
 # --- Funciones de Ayuda ---
 
+async def regla_cupon(codigo: Optional[str]) -> Optional[ReglaCupon]:
+    if not codigo:
+        return None
+    cupon = await buscar_cupon(codigo)
+    return regla_desde_cupon(cupon) if cupon else None
+
 async def recalcular_totales(carrito: Carrito) -> CartOut:
-    subtotal_general = 0
-    for item in carrito.items:
-        item.subtotal = item.precioUnitario * item.cantidad
-        subtotal_general += item.subtotal
-    
-    descuento = 0
-    mensaje_cupon = None
-    
-    if carrito.cuponCodigo:
-        cupon = await Cupon.find_one(Cupon.codigo == carrito.cuponCodigo)
-        if cupon:
-            if cupon.tipo == "Porcentaje":
-                descuento = subtotal_general * (cupon.valor / 100)
-            elif cupon.tipo == "Monto Fijo":
-                descuento = cupon.valor
-            mensaje_cupon = f"Cupón '{cupon.codigo}' aplicado"
-        else:
-            mensaje_cupon = "Cupón no válido"
-            carrito.cuponCodigo = None 
-
-    total = subtotal_general - descuento
-    
+    """Totales del carrito con el motor de precios; sin consultas si el cupón está en cache."""
+    regla = await regla_cupon(carrito.cuponCodigo)
+    precio = calcular(lineas_desde_items(carrito.items), regla)
+
+    for item, subtotal in zip(carrito.items, precio.subtotales):
+        item.subtotal = subtotal
+
+    mensaje_cupon = precio.mensaje_cupon
+    if carrito.cuponCodigo and regla is None:
+        mensaje_cupon = "Cupón no válido"
+
     return CartOut(
         id=carrito.id,
         items=carrito.items,
-        subtotalGeneral=subtotal_general,
-        descuento=descuento,
-        total=total,
+        subtotalGeneral=precio.subtotal,
+        descuento=precio.descuento,
+        total=precio.total,
         mensajeCupon=mensaje_cupon
     )
 
-async def get_or_create_cart(propietario: User) -> Carrito:
-    carrito = await Carrito.find_one(Carrito.propietario.id == propietario.id)
-    if not carrito:
-        carrito = Carrito(propietario=propietario)
-        await carrito.insert()
-    return carrito
+def categoria_de(producto: Producto) -> Optional[str]:
+    """Id de la categoría del producto, esté o no resuelto el Link."""
+    categoria = producto.categoria
+    if isinstance(categoria, Link):
+        return str(categoria.ref.id)
+    return str(categoria.id) if categoria else None
 
 # === Endpoints para CARRITO  ===
 
 @router.get("", response_model=CartOut)
 async def obtener_carrito(usuario: User = Depends(get_current_user)):
-    carrito = await get_or_create_cart(usuario)
+    carrito = await carrito_store.obtener(usuario)
     return await recalcular_totales(carrito)
 
 @router.post("/items", response_model=CartOut)
@@ -69,8 +71,6 @@ async def agregar_item_al_carrito(
     item_data: CartItemAdd, 
     usuario: User = Depends(get_current_user)
 ):
-    carrito = await get_or_create_cart(usuario)
-    
     producto = await Producto.get(item_data.producto_id)
     if not producto:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Producto no encontrado")
@@ -84,89 +84,150 @@ async def agregar_item_al_carrito(
     if not variante_encontrada:
          raise HTTPException(status.HTTP_404_NOT_FOUND, "SKU de variante no encontrado")
 
-    item_existente = next(
-        (item for item in carrito.items if item.variante_sku == item_data.variante_sku), 
-        None
+    nuevo_item = CartItem(
+        producto_id=item_data.producto_id,
+        variante_sku=item_data.variante_sku,
+        nombreProducto=f"{producto.nombre} ({variante_encontrada.valor})",
+        precioUnitario=variante_encontrada.precio,
+        cantidad=item_data.cantidad,
+        subtotal=0,
+        categoriaId=categoria_de(producto)
     )
-    
-    if item_existente:
-        item_existente.cantidad += item_data.cantidad
-    else:
-        nuevo_item = CartItem(
-            producto_id=item_data.producto_id,
-            variante_sku=item_data.variante_sku,
-            nombreProducto=f"{producto.nombre} ({variante_encontrada.valor})",
-            precioUnitario=variante_encontrada.precio,
-            cantidad=item_data.cantidad,
-            subtotal=0
-        )
-        carrito.items.append(nuevo_item)
-    
-    await carrito.save()
-    return await recalcular_totales(carrito)
+
+    if not await reservar(usuario.id, producto.id, nuevo_item.variante_sku, nuevo_item.cantidad):
+        raise HTTPException(status.HTTP_409_CONFLICT, "No queda stock suficiente")
+    try:
+        actualizado = await carrito_store.agregar_item(usuario, nuevo_item)
+    except Exception:
+        await liberar(usuario.id, nuevo_item.variante_sku, nuevo_item.cantidad)
+        raise
+    return await recalcular_totales(actualizado)
+
+@router.post("/merge", response_model=CartOut)
+async def fusionar_carrito_local(
+    merge_data: CartMerge,
+    usuario: User = Depends(get_current_user)
+):
+    """
+    Fusiona el carrito de invitado al iniciar sesión: una consulta $in para
+    todos los productos y una sola escritura del carrito. Los items cuyo producto o
+    variante ya no existe, o sin stock para reservar, se descartan.
+    """
+    cantidades: Dict[str, int] = {}
+    productos_por_sku: Dict[str, BeanieObjectId] = {}
+    for item in merge_data.itemsLocales:
+        cantidades[item.variante_sku] = cantidades.get(item.variante_sku, 0) + item.cantidad
+        productos_por_sku[item.variante_sku] = item.producto_id
+
+    productos = await Producto.find(In(Producto.id, list(set(productos_por_sku.values())))).to_list()
+    variantes: Dict[tuple, tuple] = {
+        (p.id, v.sku): (p, v) for p in productos for v in p.variantes
+    }
+
+    reglas = await ReglasCarrito.find_one()
+    maximo = (
+        reglas.cantidadMaximaPorSKU if reglas
+        else ReglasCarrito.model_fields["cantidadMaximaPorSKU"].default
+    )
+
+    actuales = {i.variante_sku: i.cantidad for i in (await carrito_store.obtener(usuario)).items}
+
+    validas: Dict[str, int] = {}
+    # sku -> unidades reservadas en esta fusión
+    reservadas: Dict[str, int] = {}
+    nuevos: List[CartItem] = []
+    for sku, cantidad in cantidades.items():
+        encontrado = variantes.get((productos_por_sku[sku], sku))
+        if not encontrado:
+            continue
+        producto, variante = encontrado
+        anterior = actuales.get(sku, 0)
+        agregadas = max(0, min(maximo, anterior + cantidad) - anterior)
+        if agregadas:
+            if not await reservar(usuario.id, producto.id, sku, agregadas):
+                continue
+            reservadas[sku] = agregadas
+        validas[sku] = cantidad
+        nuevos.append(CartItem(
+            producto_id=producto.id,
+            variante_sku=sku,
+            nombreProducto=f"{producto.nombre} ({variante.valor})",
+            precioUnitario=variante.precio,
+            cantidad=min(cantidad, maximo),
+            subtotal=0,
+            categoriaId=categoria_de(producto)
+        ))
+
+    if not validas:
+        return await recalcular_totales(await carrito_store.obtener(usuario))
+
+    try:
+        actualizado = await carrito_store.fusionar(usuario, validas, nuevos, maximo)
+    except Exception:
+        for sku, agregadas in reservadas.items():
+            await liberar(usuario.id, sku, agregadas)
+        raise
+
+    # El tope por SKU pudo bajar una línea que ya lo superaba: se devuelve lo reservado de más
+    finales = {i.variante_sku: i.cantidad for i in actualizado.items}
+    for sku in validas:
+        sobrante = actuales.get(sku, 0) + reservadas.get(sku, 0) - finales.get(sku, 0)
+        if sobrante > 0:
+            await liberar(usuario.id, sku, sobrante)
+    return await recalcular_totales(actualizado)
 
 @router.put("/items", response_model=CartOut)
 async def actualizar_cantidad_item(
     update_data: CartItemUpdate, 
     usuario: User = Depends(get_current_user)
 ):
-    carrito = await get_or_create_cart(usuario)
-    
-    item_existente = next(
-        (item for item in carrito.items if item.variante_sku == update_data.variante_sku), 
-        None
-    )
-    
-    if not item_existente:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, "Item no encontrado en el carrito")
-    
     if update_data.nuevaCantidad < 1:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "La cantidad mínima es 1")
 
-    item_existente.cantidad = update_data.nuevaCantidad
-    await carrito.save()
-    return await recalcular_totales(carrito)
+    carrito = await carrito_store.obtener(usuario)
+    item = next((i for i in carrito.items if i.variante_sku == update_data.variante_sku), None)
+    if not item:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Item no encontrado en el carrito")
+    if not await ajustar(usuario.id, item.producto_id, item.variante_sku, item.cantidad, update_data.nuevaCantidad):
+        raise HTTPException(status.HTTP_409_CONFLICT, "No queda stock suficiente")
+
+    actualizado = await carrito_store.cambiar_cantidad(
+        usuario, update_data.variante_sku, update_data.nuevaCantidad
+    )
+    if not actualizado:
+        # La línea se quitó mientras tanto: se devuelve lo recién reservado
+        await ajustar(usuario.id, item.producto_id, item.variante_sku, update_data.nuevaCantidad, item.cantidad)
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Item no encontrado en el carrito")
+
+    return await recalcular_totales(actualizado)
 
 @router.delete("/items/{variante_sku}", response_model=CartOut)
 async def eliminar_item_del_carrito(
     variante_sku: str, 
     usuario: User = Depends(get_current_user)
 ):
-    carrito = await get_or_create_cart(usuario)
-    
-    item_existente = next(
-        (item for item in carrito.items if item.variante_sku == variante_sku), 
-        None
-    )
-    
-    if not item_existente:
+    actualizado = await carrito_store.quitar_item(usuario, variante_sku)
+    if not actualizado:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Item no encontrado en el carrito")
-    
-    carrito.items.remove(item_existente)
-    await carrito.save()
-    return await recalcular_totales(carrito)
+    await liberar(usuario.id, variante_sku)
+
+    return await recalcular_totales(actualizado)
 
 @router.post("/cupon", response_model=CartOut)
 async def aplicar_cupon(
     cupon_data: CouponApply, 
     usuario: User = Depends(get_current_user)
 ):
-    carrito = await get_or_create_cart(usuario)
-    
-    cupon = await Cupon.find_one(Cupon.codigo == cupon_data.codigoCupon)
-    if not cupon or cupon.estado != "Activo":
-        carrito.cuponCodigo = None
-        await carrito.save()
-        raise HTTPException(status.HTTP_404_NOT_FOUND, "El cupón no es válido o está vencido")
-
-    carrito.cuponCodigo = cupon.codigo
-    await carrito.save()
-    
-    return await recalcular_totales(carrito)
+    cupon = await buscar_cupon(cupon_data.codigoCupon)
+    motivo = motivo_no_vigente(regla_desde_cupon(cupon)) if cupon else "Cupón no válido"
+    if motivo:
+        await carrito_store.fijar_cupon(usuario, None)
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"El cupón no es válido o está vencido: {motivo}")
+
+    actualizado = await carrito_store.fijar_cupon(usuario, cupon.codigo)
+    return await recalcular_totales(actualizado)
 
 @router.delete("/cupon", response_model=CartOut)
 async def quitar_cupon(usuario: User = Depends(get_current_user)):
-    carrito = await get_or_create_cart(usuario)
-    carrito.cuponCodigo = None
-    await carrito.save()
-    return await recalcular_totales(carrito)
\ No newline at end of file
+    actualizado = await carrito_store.fijar_cupon(usuario, None)
+    return await recalcular_totales(actualizado)
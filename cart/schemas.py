@@ -1,7 +1,9 @@
 # cart/schemas.py
 from pydantic import BaseModel, Field
 from typing import Optional, List, Any
+from datetime import datetime
 from beanie import Document, Link, BeanieObjectId
+from pymongo import IndexModel
 from auth.schemas import User 
 
 # --- Modelo Embebido  ---
@@ -12,17 +14,70 @@ class CartItem(BaseModel):
     precioUnitario: float
     cantidad: int
     subtotal: float
+    # Para las exclusiones por categoría de los cupones
+    categoriaId: Optional[str] = None
 
 # --- Modelo de Documento  ---
 class Carrito(Document):
     propietario: Link[User]
     items: List[CartItem] = []
     cuponCodigo: Optional[str] = None
+    # Última escritura; None en carritos anteriores al campo (la compactación los completa)
+    ultimaActividad: Optional[datetime] = None
     
     class Settings:
         name = "carritos"
         indexes = [
             [("propietario", 1)], 
+            # Un carrito por usuario: respalda el upsert de get_or_create_cart
+            IndexModel([("propietario.$id", 1)], unique=True),
+            [("ultimaActividad", 1)],
+        ]
+
+# Días que se guardan los carritos abandonados antes de que el TTL los borre
+DIAS_RETENCION_ARCHIVO = 90
+
+class CarritoArchivado(Document):
+    propietario: Link[User]
+    items: List[CartItem] = []
+    cuponCodigo: Optional[str] = None
+    ultimaActividad: Optional[datetime] = None
+    archivado: datetime
+
+    class Settings:
+        name = "carritos_archivados"
+        indexes = [
+            [("propietario.$id", 1)],
+            IndexModel([("archivado", 1)], expireAfterSeconds=DIAS_RETENCION_ARCHIVO * 24 * 3600),
+        ]
+
+# --- Reservas de stock ---
+class ReservaStock(Document):
+    usuarioId: BeanieObjectId
+    productoId: BeanieObjectId
+    variante_sku: str
+    cantidad: int
+    # activa -> en_pago -> confirmada; o liberada (vencida, quitada o pago fallido)
+    estado: str = "activa"
+    expira: datetime
+    numeroOrden: Optional[str] = None
+    cerrada: Optional[datetime] = None
+    lote: Optional[str] = None
+
+    class Settings:
+        name = "reservas_stock"
+        indexes = [
+            # Una reserva activa por usuario y SKU; las siguientes suman cantidad
+            IndexModel(
+                [("usuarioId", 1), ("variante_sku", 1)],
+                unique=True,
+                partialFilterExpression={"estado": "activa"}
+            ),
+            [("estado", 1), ("expira", 1)],
+            [("usuarioId", 1), ("numeroOrden", 1)],
+            [("lote", 1)],
+            # Las reservas ya cerradas se borran solas; las abiertas no tienen "cerrada"
+            IndexModel([("cerrada", 1)], expireAfterSeconds=7 * 24 * 3600),
         ]
 
 # --- Schemas para la API  ---
@@ -45,11 +100,22 @@ class CartMerge(BaseModel):
 class CartOut(BaseModel):
     id: BeanieObjectId = Field(..., alias="_id")
     items: List[CartItem]
-    subtotalGeneral: float
-    descuento: float
-    total: float
+    subtotalGeneral: int
+    descuento: int
+    total: int
     mensajeCupon: Optional[str] = None
     
     class Config:
         from_attributes = True
-        arbitrary_types_allowed = True
\ No newline at end of file
+        arbitrary_types_allowed = True
+class ResultadoCompactacion(BaseModel):
+    completados: int = 0
+    vaciosBorrados: int = 0
+    archivados: int = 0
+
+class ResultadoRepreciado(BaseModel):
+    carritosRevisados: int = 0
+    carritosActualizados: int = 0
+    lineasActualizadas: int = 0
+    totalAnterior: int = 0
+    totalNuevo: int = 0
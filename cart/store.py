@@ -0,0 +1,403 @@
+# cart/store.py
+from fastapi import HTTPException, status
+from beanie import BeanieObjectId
+from bson import DBRef
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+import asyncio
+
+from auth.schemas import User
+from db import db_settings
+from .schemas import Carrito, CartItem
+
+# user_id -> id de su carrito, para direccionar el documento sin buscarlo
+MAX_CARRITOS_CACHEADOS = 10_000
+_carritos_por_usuario: "OrderedDict[BeanieObjectId, BeanieObjectId]" = OrderedDict()
+
+# Reintentos entre $inc y $push cuando otra petición agrega el mismo SKU a la vez
+INTENTOS_AGREGAR = 3
+
+
+def _recordar_carrito(usuario_id: BeanieObjectId, carrito_id: BeanieObjectId) -> None:
+    _carritos_por_usuario[usuario_id] = carrito_id
+    _carritos_por_usuario.move_to_end(usuario_id)
+    if len(_carritos_por_usuario) > MAX_CARRITOS_CACHEADOS:
+        _carritos_por_usuario.popitem(last=False)
+
+
+def olvidar_carrito(usuario_id: BeanieObjectId) -> None:
+    _carritos_por_usuario.pop(usuario_id, None)
+
+
+async def get_or_create_cart(propietario: User) -> Carrito:
+    """
+    Un solo find_one_and_update con upsert: devuelve el carrito del usuario o
+    lo crea. El índice único sobre propietario.$id impide carritos duplicados;
+    si dos peticiones crean a la vez, la perdedora relee el que ganó.
+    """
+    filtro = {"propietario": DBRef(User.get_motor_collection().name, propietario.id)}
+    coleccion = Carrito.get_motor_collection()
+    try:
+        doc = await coleccion.find_one_and_update(
+            filtro,
+            {"$setOnInsert": {"items": [], "cuponCodigo": None, "ultimaActividad": datetime.now(timezone.utc)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        doc = await coleccion.find_one(filtro)
+
+    carrito = Carrito.model_validate(doc)
+    _recordar_carrito(propietario.id, carrito.id)
+    return carrito
+
+
+async def obtener_carrito_id(propietario: User) -> BeanieObjectId:
+    carrito_id = _carritos_por_usuario.get(propietario.id)
+    if carrito_id is None:
+        return (await get_or_create_cart(propietario)).id
+    _carritos_por_usuario.move_to_end(propietario.id)
+    return carrito_id
+
+
+async def actualizar_carrito(
+    propietario: User, filtro: Dict[str, Any], cambios: Union[Dict[str, Any], List[Dict[str, Any]]]
+) -> Optional[Carrito]:
+    """
+    Aplica un solo update atómico (find_one_and_update; acepta también un
+    pipeline) sobre el carrito del usuario y devuelve el documento ya
+    modificado, o None si el filtro no calzó. Si el carrito cacheado ya no
+    existe, se resuelve de nuevo y se reintenta.
+    """
+    # Toda escritura marca actividad (en UTC); la compactación usa este campo
+    ahora = datetime.now(timezone.utc)
+    if isinstance(cambios, list):
+        cambios = cambios + [{"$set": {"ultimaActividad": ahora}}]
+    else:
+        cambios = {**cambios, "$set": {**cambios.get("$set", {}), "ultimaActividad": ahora}}
+
+    coleccion = Carrito.get_motor_collection()
+    for _ in range(2):
+        carrito_id = await obtener_carrito_id(propietario)
+        doc = await coleccion.find_one_and_update(
+            {"_id": carrito_id, **filtro}, cambios, return_document=ReturnDocument.AFTER
+        )
+        if doc:
+            return Carrito.model_validate(doc)
+        if await coleccion.count_documents({"_id": carrito_id}, limit=1):
+            # El carrito existe: lo que no calzó fue el filtro de items
+            return None
+        olvidar_carrito(propietario.id)
+    return None
+
+
+def _pipeline_merge(cantidades: Dict[str, int], nuevos: List[dict], maximo: int) -> List[dict]:
+    """
+    Update en pipeline: suma las cantidades locales a los items que ya están
+    (con tope por SKU) y agrega al final los que no estaban. Todo en una sola
+    escritura, así un add concurrente no se pierde.
+    """
+    return [{"$set": {"items": {"$let": {
+        "vars": {
+            "actuales": {"$ifNull": ["$items", []]},
+            "skus": {"$literal": list(cantidades.keys())},
+            "cantidades": {"$literal": list(cantidades.values())},
+            "nuevos": {"$literal": nuevos}
+        },
+        "in": {"$concatArrays": [
+            {"$map": {
+                "input": "$$actuales",
+                "as": "item",
+                "in": {"$let": {
+                    "vars": {"i": {"$indexOfArray": ["$$skus", "$$item.variante_sku"]}},
+                    "in": {"$cond": [
+                        {"$eq": ["$$i", -1]},
+                        "$$item",
+                        {"$mergeObjects": ["$$item", {"cantidad": {"$min": [
+                            maximo,
+                            {"$add": ["$$item.cantidad", {"$arrayElemAt": ["$$cantidades", "$$i"]}]}
+                        ]}}]}
+                    ]}
+                }}
+            }},
+            {"$filter": {
+                "input": "$$nuevos",
+                "as": "nuevo",
+                "cond": {"$not": [{"$in": ["$$nuevo.variante_sku", "$$actuales.variante_sku"]}]}
+            }}
+        ]}
+    }}}}]
+
+
+# === Store directo: cada cambio es un update atómico en Mongo ===
+
+class CarritoStoreDirecto:
+
+    async def obtener(self, usuario: User) -> Carrito:
+        return await get_or_create_cart(usuario)
+
+    async def agregar_item(self, usuario: User, item: CartItem) -> Carrito:
+        # Si el SKU ya está se suma en el lugar; si no, se agrega solo si sigue sin estar.
+        # Si otra petición lo agregó entre ambos pasos, se vuelve a intentar el $inc.
+        for _ in range(INTENTOS_AGREGAR):
+            actualizado = await actualizar_carrito(
+                usuario,
+                {"items.variante_sku": item.variante_sku},
+                {"$inc": {"items.$.cantidad": item.cantidad}}
+            )
+            if actualizado:
+                return actualizado
+
+            actualizado = await actualizar_carrito(
+                usuario,
+                {"items.variante_sku": {"$ne": item.variante_sku}},
+                {"$push": {"items": item.model_dump()}}
+            )
+            if actualizado:
+                return actualizado
+
+        raise HTTPException(status.HTTP_409_CONFLICT, "El carrito cambió, intenta nuevamente")
+
+    async def fusionar(
+        self, usuario: User, cantidades: Dict[str, int], nuevos: List[CartItem], maximo: int
+    ) -> Carrito:
+        return await actualizar_carrito(
+            usuario, {}, _pipeline_merge(cantidades, [n.model_dump() for n in nuevos], maximo)
+        )
+
+    async def cambiar_cantidad(self, usuario: User, variante_sku: str, cantidad: int) -> Optional[Carrito]:
+        return await actualizar_carrito(
+            usuario,
+            {"items.variante_sku": variante_sku},
+            {"$set": {"items.$.cantidad": cantidad}}
+        )
+
+    async def quitar_item(self, usuario: User, variante_sku: str) -> Optional[Carrito]:
+        return await actualizar_carrito(
+            usuario,
+            {"items.variante_sku": variante_sku},
+            {"$pull": {"items": {"variante_sku": variante_sku}}}
+        )
+
+    async def fijar_cupon(self, usuario: User, codigo: Optional[str]) -> Carrito:
+        return await actualizar_carrito(usuario, {}, {"$set": {"cuponCodigo": codigo}})
+
+    def iniciar(self) -> None:
+        pass
+
+    async def vaciar(self) -> None:
+        pass
+
+    def olvidar_todo(self) -> None:
+        pass
+
+    def productos_en_memoria(self) -> set:
+        return set()
+
+    def aplicar_precios(self, precios: Dict[Tuple[str, str], float]) -> None:
+        pass
+
+    async def cerrar(self) -> None:
+        pass
+
+
+# === Store write-behind: carritos calientes en memoria, guardados por lotes ===
+
+class CarritoStoreWriteBehind:
+    """
+    Mantiene en memoria los carritos en uso (LRU con tope) y aplica los
+    cambios ahí mismo, con la misma semántica que el store directo. Los
+    carritos modificados se guardan juntos en un bulk_write cada
+    `intervalo` segundos y al apagar. Solo es correcto con un único proceso
+    de la API: otro proceso no ve los cambios aún no guardados.
+    """
+
+    def __init__(self, max_carritos: int, intervalo: float):
+        self._max_carritos = max_carritos
+        self._intervalo = intervalo
+        self._carritos: "OrderedDict[BeanieObjectId, Carrito]" = OrderedDict()
+        self._sucios: set = set()
+        # Sucios que salieron del LRU y esperan el próximo guardado
+        self._desalojados: Dict[BeanieObjectId, Carrito] = {}
+        self._lock_guardado = asyncio.Lock()
+        self._tarea: Optional[asyncio.Task] = None
+
+    # --- Memoria ---
+
+    async def _cargar(self, usuario: User) -> Carrito:
+        carrito = self._carritos.get(usuario.id)
+        if carrito is not None:
+            self._carritos.move_to_end(usuario.id)
+            return carrito
+
+        carrito = self._desalojados.pop(usuario.id, None)
+        if carrito is None:
+            leido = await get_or_create_cart(usuario)
+            # Otra petición pudo cargarlo mientras se leía: gana la que ya está
+            carrito = self._carritos.get(usuario.id) or self._desalojados.pop(usuario.id, None) or leido
+
+        self._carritos[usuario.id] = carrito
+        self._carritos.move_to_end(usuario.id)
+        while len(self._carritos) > self._max_carritos:
+            usuario_id, viejo = self._carritos.popitem(last=False)
+            if usuario_id in self._sucios:
+                self._desalojados[usuario_id] = viejo
+        return carrito
+
+    def _modificado(self, usuario: User, carrito: Carrito) -> Carrito:
+        carrito.ultimaActividad = datetime.now(timezone.utc)
+        self._sucios.add(usuario.id)
+        # Copia: el llamador puede esperar (await) mientras otro cambia el original
+        return carrito.model_copy(deep=True)
+
+    # --- Operaciones ---
+
+    async def obtener(self, usuario: User) -> Carrito:
+        return (await self._cargar(usuario)).model_copy(deep=True)
+
+    async def agregar_item(self, usuario: User, item: CartItem) -> Carrito:
+        carrito = await self._cargar(usuario)
+        existente = next((i for i in carrito.items if i.variante_sku == item.variante_sku), None)
+        if existente:
+            existente.cantidad += item.cantidad
+        else:
+            carrito.items.append(item.model_copy())
+        return self._modificado(usuario, carrito)
+
+    async def fusionar(
+        self, usuario: User, cantidades: Dict[str, int], nuevos: List[CartItem], maximo: int
+    ) -> Carrito:
+        carrito = await self._cargar(usuario)
+        presentes = set()
+        for item in carrito.items:
+            if item.variante_sku in cantidades:
+                item.cantidad = min(maximo, item.cantidad + cantidades[item.variante_sku])
+            presentes.add(item.variante_sku)
+        carrito.items.extend(n.model_copy() for n in nuevos if n.variante_sku not in presentes)
+        return self._modificado(usuario, carrito)
+
+    async def cambiar_cantidad(self, usuario: User, variante_sku: str, cantidad: int) -> Optional[Carrito]:
+        carrito = await self._cargar(usuario)
+        item = next((i for i in carrito.items if i.variante_sku == variante_sku), None)
+        if item is None:
+            return None
+        item.cantidad = cantidad
+        return self._modificado(usuario, carrito)
+
+    async def quitar_item(self, usuario: User, variante_sku: str) -> Optional[Carrito]:
+        carrito = await self._cargar(usuario)
+        restantes = [i for i in carrito.items if i.variante_sku != variante_sku]
+        if len(restantes) == len(carrito.items):
+            return None
+        carrito.items = restantes
+        return self._modificado(usuario, carrito)
+
+    async def fijar_cupon(self, usuario: User, codigo: Optional[str]) -> Carrito:
+        carrito = await self._cargar(usuario)
+        carrito.cuponCodigo = codigo
+        return self._modificado(usuario, carrito)
+
+    # --- Guardado ---
+
+    async def vaciar(self) -> None:
+        """Guarda en un solo bulk_write todos los carritos con cambios pendientes."""
+        async with self._lock_guardado:
+            if not self._sucios:
+                return
+            pendientes: Dict[BeanieObjectId, Carrito] = {}
+            operaciones: List[UpdateOne] = []
+            for usuario_id in self._sucios:
+                carrito = self._carritos.get(usuario_id) or self._desalojados.get(usuario_id)
+                if carrito is None:
+                    continue
+                pendientes[usuario_id] = carrito
+                # Foto tomada antes del await: lo que cambie después queda para la próxima vuelta
+                operaciones.append(UpdateOne(
+                    {"_id": carrito.id},
+                    {
+                        "$set": {
+                            "items": [i.model_dump() for i in carrito.items],
+                            "cuponCodigo": carrito.cuponCodigo,
+                            "ultimaActividad": carrito.ultimaActividad
+                        },
+                        # Si el documento se borró mientras estaba en memoria, se recrea
+                        "$setOnInsert": {"propietario": carrito.propietario.to_ref()}
+                    },
+                    upsert=True
+                ))
+            self._sucios.clear()
+            self._desalojados.clear()
+
+            if not operaciones:
+                return
+            try:
+                await Carrito.get_motor_collection().bulk_write(operaciones, ordered=False)
+            except Exception:
+                # Se reintentan en la próxima vuelta
+                for usuario_id, carrito in pendientes.items():
+                    self._sucios.add(usuario_id)
+                    if usuario_id not in self._carritos:
+                        self._desalojados[usuario_id] = carrito
+                raise
+
+    def productos_en_memoria(self) -> set:
+        carritos = list(self._carritos.values()) + list(self._desalojados.values())
+        return {item.producto_id for carrito in carritos for item in carrito.items}
+
+    def aplicar_precios(self, precios: Dict[Tuple[str, str], float]) -> None:
+        """
+        Lleva los carritos en memoria a `precios` ((producto_id, sku) -> precio).
+        Los que cambian quedan sucios, así el próximo guardado escribe los
+        precios nuevos en vez de pisar los que se repreciaron en Mongo.
+        """
+        for usuario_id, carrito in list(self._carritos.items()) + list(self._desalojados.items()):
+            cambiado = False
+            for item in carrito.items:
+                precio = precios.get((str(item.producto_id), item.variante_sku))
+                if precio is not None and precio != item.precioUnitario:
+                    item.precioUnitario = precio
+                    cambiado = True
+            if cambiado:
+                self._sucios.add(usuario_id)
+
+    def olvidar_todo(self) -> None:
+        """Descarta las copias en memoria sin cambios pendientes (p. ej. tras compactar en Mongo)."""
+        for usuario_id in list(self._carritos):
+            if usuario_id not in self._sucios:
+                del self._carritos[usuario_id]
+
+    async def _ciclo(self) -> None:
+        while True:
+            await asyncio.sleep(self._intervalo)
+            try:
+                await self.vaciar()
+            except Exception as error:
+                print(f"Error guardando carritos: {error}")
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def cerrar(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        await self.vaciar()
+
+
+def crear_store():
+    if db_settings.CART_STORE_MODE == "write_behind":
+        return CarritoStoreWriteBehind(
+            db_settings.CART_STORE_MAX_CARTS, db_settings.CART_FLUSH_INTERVAL_SECONDS
+        )
+    return CarritoStoreDirecto()
+
+
+carrito_store = crear_store()
@@ -0,0 +1,215 @@
+# cart/tareas.py
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from admin.cupones import buscar_cupon
+from catalog.schemas import Producto
+from db import db_settings
+from periodicas import TareaPeriodica
+from .schemas import Carrito, CarritoArchivado, ResultadoCompactacion, ResultadoRepreciado
+from .store import carrito_store
+from .precios import LineaPrecio, ReglaCupon, a_clp, calcular_lote, regla_desde_cupon
+
+TAMANO_LOTE_REPRECIO = 500
+TAMANO_LOTE_COMPACTACION = 500
+# Error de clave duplicada dentro de un BulkWriteError
+_CLAVE_DUPLICADA = 11000
+
+
+async def _precios_vigentes(producto_ids: set) -> Dict[Tuple[str, str], float]:
+    """(producto_id, sku de variante) -> precio actual, con una sola consulta $in."""
+    cursor = Producto.get_motor_collection().find(
+        {"_id": {"$in": list(producto_ids)}},
+        {"variantes.sku": 1, "variantes.precio": 1}
+    )
+    precios = {}
+    async for doc in cursor:
+        for variante in doc.get("variantes") or []:
+            precios[(str(doc["_id"]), variante["sku"])] = variante["precio"]
+    return precios
+
+
+async def _regla(codigo: Optional[str], reglas: Dict[str, Optional[ReglaCupon]]) -> Optional[ReglaCupon]:
+    """Una ReglaCupon por código y lote, así calcular_lote la evalúa una sola vez."""
+    if not codigo:
+        return None
+    if codigo not in reglas:
+        cupon = await buscar_cupon(codigo)
+        reglas[codigo] = regla_desde_cupon(cupon) if cupon else None
+    return reglas[codigo]
+
+
+async def _repreciar_lote(lote: List[dict], resultado: ResultadoRepreciado) -> None:
+    precios = await _precios_vigentes({i["producto_id"] for c in lote for i in c["items"]})
+
+    reglas: Dict[str, Optional[ReglaCupon]] = {}
+    antes: List[List[LineaPrecio]] = []
+    despues: List[List[LineaPrecio]] = []
+    cupones = []
+    operaciones: List[UpdateOne] = []
+    for carrito in lote:
+        lineas_antes, lineas_despues = [], []
+        for item in carrito["items"]:
+            precio = precios.get((str(item["producto_id"]), item["variante_sku"]))
+            linea = LineaPrecio(
+                variante_sku=item["variante_sku"],
+                precio_unitario=a_clp(item["precioUnitario"]),
+                cantidad=item["cantidad"],
+                categoria_id=item.get("categoriaId")
+            )
+            lineas_antes.append(linea)
+            # Variante borrada: se deja como está, el checkout la detecta
+            if precio is None or a_clp(precio) == linea.precio_unitario:
+                lineas_despues.append(linea)
+                continue
+            lineas_despues.append(LineaPrecio(
+                variante_sku=linea.variante_sku,
+                precio_unitario=a_clp(precio),
+                cantidad=linea.cantidad,
+                categoria_id=linea.categoria_id
+            ))
+            # Solo si la línea sigue con el precio leído; no pisa cambios concurrentes
+            operaciones.append(UpdateOne(
+                {
+                    "_id": carrito["_id"],
+                    "items": {"$elemMatch": {
+                        "variante_sku": item["variante_sku"],
+                        "precioUnitario": item["precioUnitario"]
+                    }}
+                },
+                {"$set": {"items.$.precioUnitario": precio}}
+            ))
+        antes.append(lineas_antes)
+        despues.append(lineas_despues)
+        cupones.append(await _regla(carrito.get("cuponCodigo"), reglas))
+
+    resultado.carritosRevisados += len(lote)
+    resultado.totalAnterior += sum(r.total for r in calcular_lote(antes, cupones))
+    resultado.totalNuevo += sum(r.total for r in calcular_lote(despues, cupones))
+    resultado.carritosActualizados += sum(1 for a, d in zip(antes, despues) if a != d)
+
+    if operaciones:
+        escritura = await Carrito.get_motor_collection().bulk_write(operaciones, ordered=False)
+        resultado.lineasActualizadas += escritura.modified_count
+
+
+async def repreciar_carritos(producto_ids: Optional[List] = None) -> ResultadoRepreciado:
+    """
+    Actualiza el precio unitario de los carritos abiertos después de un cambio
+    de precios, por lotes: una consulta de precios por lote, el recálculo con
+    calcular_lote y un bulk_write con updates posicionales.
+    """
+    # Con el store write-behind, primero se guardan los cambios pendientes
+    await carrito_store.vaciar()
+
+    filtro = {"items.0": {"$exists": True}}
+    if producto_ids:
+        filtro["items.producto_id"] = {"$in": list(producto_ids)}
+
+    resultado = ResultadoRepreciado()
+    cursor = Carrito.get_motor_collection().find(
+        filtro, {"items": 1, "cuponCodigo": 1}, batch_size=TAMANO_LOTE_REPRECIO
+    )
+    lote: List[dict] = []
+    async for carrito in cursor:
+        lote.append(carrito)
+        if len(lote) >= TAMANO_LOTE_REPRECIO:
+            await _repreciar_lote(lote, resultado)
+            lote = []
+    if lote:
+        await _repreciar_lote(lote, resultado)
+
+    # Con write-behind, los carritos en memoria (incluidos los que cambiaron
+    # durante el loop) se repricean ahí mismo: su próximo guardado reemplaza
+    # todo items y si no desharía lo escrito arriba
+    en_memoria = carrito_store.productos_en_memoria()
+    if producto_ids:
+        en_memoria &= set(producto_ids)
+    if en_memoria:
+        carrito_store.aplicar_precios(await _precios_vigentes(en_memoria))
+    return resultado
+
+
+# --- Compactación de carritos ---
+
+async def _ids_lote(filtro: dict) -> List:
+    cursor = Carrito.get_motor_collection().find(filtro, {"_id": 1}).limit(TAMANO_LOTE_COMPACTACION)
+    return [doc["_id"] async for doc in cursor]
+
+
+async def _archivar(docs: List[dict]) -> None:
+    """Copia los carritos al archivo; si un lote anterior alcanzó a copiarlos, se ignoran."""
+    ahora = datetime.now(timezone.utc)
+    try:
+        await CarritoArchivado.get_motor_collection().insert_many(
+            [{**doc, "archivado": ahora} for doc in docs], ordered=False
+        )
+    except BulkWriteError as error:
+        if any(e["code"] != _CLAVE_DUPLICADA for e in error.details["writeErrors"]):
+            raise
+
+
+async def compactar_carritos() -> ResultadoCompactacion:
+    """
+    Mantiene chica la colección de carritos: completa ultimaActividad en los
+    antiguos, borra los vacíos sin actividad y mueve a carritos_archivados los
+    abandonados con items. Todo por lotes de ids, y cada borrado vuelve a
+    exigir las condiciones por si el carrito se usó entremedio.
+    """
+    # Los cambios pendientes del store write-behind cuentan como actividad
+    await carrito_store.vaciar()
+
+    coleccion = Carrito.get_motor_collection()
+    resultado = ResultadoCompactacion()
+
+    # Carritos anteriores al campo: la fecha de creación sale del ObjectId (en UTC,
+    # igual que lo que escribe el store, así todos envejecen con el mismo reloj)
+    completados = await coleccion.update_many(
+        {"ultimaActividad": None},
+        [{"$set": {"ultimaActividad": {"$toDate": "$_id"}}}]
+    )
+    resultado.completados = completados.modified_count
+
+    ahora = datetime.now(timezone.utc)
+    vacios = {
+        "items.0": {"$exists": False},
+        "ultimaActividad": {"$lte": ahora - timedelta(hours=db_settings.CART_EMPTY_MAX_AGE_HOURS)}
+    }
+    while ids := await _ids_lote(vacios):
+        borrados = await coleccion.delete_many({"_id": {"$in": ids}, **vacios})
+        resultado.vaciosBorrados += borrados.deleted_count
+        if len(ids) < TAMANO_LOTE_COMPACTACION:
+            break
+
+    abandonados = {
+        "items.0": {"$exists": True},
+        "ultimaActividad": {"$lte": ahora - timedelta(days=db_settings.CART_ARCHIVE_AFTER_DAYS)}
+    }
+    while True:
+        docs = await coleccion.find(abandonados).limit(TAMANO_LOTE_COMPACTACION).to_list(None)
+        if not docs:
+            break
+        await _archivar(docs)
+        borrados = await coleccion.delete_many({"_id": {"$in": [d["_id"] for d in docs]}, **abandonados})
+        resultado.archivados += borrados.deleted_count
+        if len(docs) < TAMANO_LOTE_COMPACTACION:
+            break
+
+    # Las copias en memoria pueden ser de carritos que ya no existen
+    carrito_store.olvidar_todo()
+    return resultado
+
+
+async def _compactar_periodico() -> Optional[ResultadoCompactacion]:
+    resultado = await compactar_carritos()
+    # Sin nada que informar, la tarea no imprime
+    if resultado.completados or resultado.vaciosBorrados or resultado.archivados:
+        return resultado
+    return None
+
+
+compactador_carritos = TareaPeriodica(
+    "Carritos compactados", _compactar_periodico, db_settings.CART_COMPACTION_INTERVAL_SECONDS
+)
@@ -0,0 +1,243 @@
+# catalog/busqueda.py
+from beanie import BeanieObjectId
+from pydantic import ValidationError
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import bisect
+import re
+import unicodedata
+
+from .schemas import Producto, ProductoOut
+
+PESO_NOMBRE = 3
+PESO_CATEGORIA = 2
+PESO_ETIQUETA = 2
+PESO_DESCRIPCION = 1
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes ni diéresis: 'Ñoquis' -> 'noquis'."""
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def tokenizar(texto: Optional[str]) -> List[str]:
+    return _TOKEN.findall(normalizar(texto or ""))
+
+
+class _Entrada:
+    __slots__ = ("pesos", "categoria", "etiquetas", "activo", "nombre", "salida")
+
+    def __init__(self, pesos, categoria, etiquetas, activo, nombre, salida):
+        self.pesos: Dict[str, int] = pesos
+        self.categoria: Optional[Tuple[str, str]] = categoria
+        self.etiquetas: List[Tuple[str, str]] = etiquetas
+        self.activo: bool = activo
+        self.nombre: str = nombre
+        self.salida: ProductoOut = salida
+
+
+class IndiceProductos:
+    """
+    Índice invertido en memoria sobre nombre, descripción, categoría y
+    etiquetas de los productos. Se construye una vez y luego se actualiza
+    producto por producto desde los endpoints de escritura del catálogo.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._vocabulario: List[str] = []
+        self._docs: Dict[str, _Entrada] = {}
+        self._listo = False
+        self._generacion = 0
+        self._lock = asyncio.Lock()
+
+    # --- Mantenimiento ---
+
+    async def asegurar(self) -> None:
+        if self._listo:
+            return
+        async with self._lock:
+            if not self._listo:
+                await self._reconstruir()
+
+    async def _reconstruir(self) -> None:
+        generacion = self._generacion
+        self._postings.clear()
+        self._vocabulario.clear()
+        self._docs.clear()
+        async for producto in Producto.find_all(fetch_links=True):
+            self._indexar(producto)
+        # Si alguien invalidó durante la carga, se vuelve a construir en la próxima búsqueda
+        self._listo = generacion == self._generacion
+
+    def invalidar(self) -> None:
+        self._generacion += 1
+        self._listo = False
+
+    async def actualizar(self, producto_id: BeanieObjectId) -> None:
+        async with self._lock:
+            if not self._listo:
+                return
+            producto = await Producto.get(producto_id, fetch_links=True)
+            self._quitar(str(producto_id))
+            if producto:
+                self._indexar(producto)
+
+    async def quitar(self, producto_id: BeanieObjectId) -> None:
+        async with self._lock:
+            if self._listo:
+                self._quitar(str(producto_id))
+
+    def _indexar(self, producto: Producto) -> None:
+        try:
+            salida = ProductoOut.model_validate(producto)
+        except ValidationError:
+            # Producto con la categoría rota: tampoco se puede listar
+            return
+
+        pesos: Dict[str, int] = {}
+
+        def sumar(texto: Optional[str], peso: int):
+            for token in tokenizar(texto):
+                if pesos.get(token, 0) < peso:
+                    pesos[token] = peso
+
+        categoria = producto.categoria
+        etiquetas = [e for e in producto.etiquetas if hasattr(e, "nombre")]
+
+        sumar(producto.descripcion, PESO_DESCRIPCION)
+        for etiqueta in etiquetas:
+            sumar(etiqueta.nombre, PESO_ETIQUETA)
+        if hasattr(categoria, "nombre"):
+            sumar(categoria.nombre, PESO_CATEGORIA)
+        sumar(producto.nombre, PESO_NOMBRE)
+
+        doc_id = str(producto.id)
+        self._docs[doc_id] = _Entrada(
+            pesos=pesos,
+            categoria=(str(categoria.id), categoria.nombre) if hasattr(categoria, "nombre") else None,
+            etiquetas=[(str(e.id), e.nombre) for e in etiquetas],
+            activo=producto.estado == "Activo",
+            nombre=normalizar(producto.nombre),
+            salida=salida
+        )
+        for token, peso in pesos.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                bisect.insort(self._vocabulario, token)
+            posting[doc_id] = peso
+
+    def _quitar(self, doc_id: str) -> None:
+        entrada = self._docs.pop(doc_id, None)
+        if entrada is None:
+            return
+        for token in entrada.pesos:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[token]
+                i = bisect.bisect_left(self._vocabulario, token)
+                if i < len(self._vocabulario) and self._vocabulario[i] == token:
+                    del self._vocabulario[i]
+
+    # --- Consulta ---
+
+    def _coincidencias(self, termino: str) -> Dict[str, int]:
+        """Puntaje por producto para un término: exacto vale doble que por prefijo."""
+        puntajes: Dict[str, int] = {}
+        i = bisect.bisect_left(self._vocabulario, termino)
+        while i < len(self._vocabulario) and self._vocabulario[i].startswith(termino):
+            token = self._vocabulario[i]
+            factor = 2 if token == termino else 1
+            for doc_id, peso in self._postings[token].items():
+                puntaje = peso * factor
+                if puntajes.get(doc_id, 0) < puntaje:
+                    puntajes[doc_id] = puntaje
+            i += 1
+        return puntajes
+
+    async def buscar(
+        self,
+        consulta: str,
+        categoria: Optional[str] = None,
+        etiqueta: Optional[str] = None,
+        solo_activos: bool = False,
+        limite: int = 20,
+        desplazamiento: int = 0
+    ) -> dict:
+        """
+        Todos los términos deben coincidir, completos o como prefijo (para el
+        typeahead). Las facetas se cuentan sobre los resultados del
+        texto, antes de aplicar los filtros de categoría y etiqueta.
+        """
+        await self.asegurar()
+
+        terminos = tokenizar(consulta)
+        if terminos:
+            puntajes: Optional[Dict[str, int]] = None
+            for termino in terminos:
+                encontrados = self._coincidencias(termino)
+                if puntajes is None:
+                    puntajes = encontrados
+                else:
+                    puntajes = {
+                        doc_id: puntaje + encontrados[doc_id]
+                        for doc_id, puntaje in puntajes.items()
+                        if doc_id in encontrados
+                    }
+                if not puntajes:
+                    break
+        else:
+            puntajes = {doc_id: 0 for doc_id in self._docs}
+
+        candidatos = [
+            doc_id for doc_id in puntajes
+            if not solo_activos or self._docs[doc_id].activo
+        ]
+
+        facetas_categoria: Counter = Counter()
+        facetas_etiqueta: Counter = Counter()
+        nombres: Dict[str, str] = {}
+        seleccionados: List[str] = []
+        for doc_id in candidatos:
+            entrada = self._docs[doc_id]
+            if entrada.categoria:
+                facetas_categoria[entrada.categoria[0]] += 1
+                nombres[entrada.categoria[0]] = entrada.categoria[1]
+            for etiqueta_id, etiqueta_nombre in entrada.etiquetas:
+                facetas_etiqueta[etiqueta_id] += 1
+                nombres[etiqueta_id] = etiqueta_nombre
+
+            if categoria and (not entrada.categoria or entrada.categoria[0] != categoria):
+                continue
+            if etiqueta and all(e[0] != etiqueta for e in entrada.etiquetas):
+                continue
+            seleccionados.append(doc_id)
+
+        seleccionados.sort(key=lambda d: (-puntajes[d], self._docs[d].nombre))
+        pagina = seleccionados[desplazamiento:desplazamiento + limite]
+
+        return {
+            "total": len(seleccionados),
+            "resultados": [self._docs[d].salida for d in pagina],
+            "facetas": {
+                "categorias": [
+                    {"id": i, "nombre": nombres[i], "cantidad": n}
+                    for i, n in facetas_categoria.most_common()
+                ],
+                "etiquetas": [
+                    {"id": i, "nombre": nombres[i], "cantidad": n}
+                    for i, n in facetas_etiqueta.most_common()
+                ]
+            }
+        }
+
+
+indice_productos = IndiceProductos()
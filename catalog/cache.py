@@ -0,0 +1,67 @@
+# catalog/cache.py
+from typing import Hashable, Optional, Tuple
+import hashlib
+
+from cache import CacheTTL
+
+# Las claves incluyen parámetros del cliente (cursor, limit, búsqueda, filtros):
+# sin tope, variar la URL haría crecer la memoria sin límite
+MAX_ENTRADAS_CATALOGO = 2048
+# Las escrituras ya invalidan; el TTL solo acota entradas que nadie vuelve a pedir
+TTL_CATALOGO = 3600
+
+
+class CatalogCache:
+    """
+    Guarda las respuestas del catálogo ya serializadas (bytes JSON) por forma
+    de consulta. Cada entrada queda asociada a la versión del catálogo con la
+    que se generó; cualquier escritura sube la versión y deja obsoletas todas
+    las entradas anteriores. Junto al contenido se guarda su ETag fuerte.
+    """
+
+    def __init__(self, max_entradas: int, ttl: float):
+        self._version = 0
+        self._entradas = CacheTTL(max_entradas, ttl)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def obtener(self, clave: Hashable) -> Optional[Tuple[bytes, str]]:
+        encontrado, entrada = self._entradas.obtener(clave)
+        if not encontrado or entrada[0] != self._version:
+            return None
+        return entrada[1], entrada[2]
+
+    def guardar(self, clave: Hashable, version: int, contenido: bytes) -> str:
+        etag = calcular_etag(contenido)
+        # Si el catálogo cambió mientras se armaba la respuesta, no se guarda
+        if version == self._version:
+            self._entradas.guardar(clave, (version, contenido, etag))
+        return etag
+
+    def invalidar(self) -> None:
+        self._version += 1
+        self._entradas.invalidar()
+
+
+def calcular_etag(contenido: bytes) -> str:
+    return '"' + hashlib.blake2b(contenido, digest_size=16).hexdigest() + '"'
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara el header If-None-Match (puede traer varias etiquetas) con el ETag."""
+    if not if_none_match:
+        return False
+    for candidata in if_none_match.split(","):
+        candidata = candidata.strip()
+        if candidata == "*":
+            return True
+        if candidata.startswith("W/"):
+            candidata = candidata[2:]
+        if candidata == etag:
+            return True
+    return False
+
+
+catalog_cache = CatalogCache(MAX_ENTRADAS_CATALOGO, TTL_CATALOGO)
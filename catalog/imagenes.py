@@ -0,0 +1,125 @@
+# catalog/imagenes.py
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+from typing import BinaryIO, Tuple
+from datetime import datetime
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from .schemas import ArchivoImagen
+
+UPLOAD_DIR = "uploads"
+TMP_DIR = os.path.join(UPLOAD_DIR, ".tmp")
+os.makedirs(TMP_DIR, exist_ok=True)
+
+TAMANO_MAXIMO = 2 * 1024 * 1024
+TAMANO_BLOQUE = 64 * 1024
+EXTENSIONES_PERMITIDAS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif"}
+
+# Protege el par (archivo en disco, contador de referencias) entre subidas y
+# borrados concurrentes de la misma imagen
+_lock_archivos = asyncio.Lock()
+
+
+class ImagenDemasiadoGrande(Exception):
+    pass
+
+
+def _copiar_con_hash(origen: BinaryIO) -> Tuple[str, str, int]:
+    """
+    Copia la subida por bloques a un temporal calculando su sha256.
+    Se ejecuta en el threadpool para no bloquear el event loop.
+    """
+    hasher = hashlib.sha256()
+    tamano = 0
+    fd, ruta_tmp = tempfile.mkstemp(dir=TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as destino:
+            while True:
+                bloque = origen.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                tamano += len(bloque)
+                if tamano > TAMANO_MAXIMO:
+                    raise ImagenDemasiadoGrande()
+                hasher.update(bloque)
+                destino.write(bloque)
+    except BaseException:
+        os.remove(ruta_tmp)
+        raise
+    return hasher.hexdigest(), ruta_tmp, tamano
+
+
+async def guardar_imagen(archivo: UploadFile) -> str:
+    """
+    Guarda la imagen bajo su hash y suma una referencia. Si el mismo contenido
+    ya existe, se reutiliza el archivo. Devuelve la URL pública.
+    """
+    extension = os.path.splitext(archivo.filename or "")[1].lower()
+    if extension not in EXTENSIONES_PERMITIDAS:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Formato de imagen no soportado"
+        )
+
+    try:
+        digest, ruta_tmp, tamano = await run_in_threadpool(_copiar_con_hash, archivo.file)
+    except ImagenDemasiadoGrande:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="La imagen excede el tamaño permitido (2MB)"
+        )
+
+    async with _lock_archivos:
+        registro = await ArchivoImagen.get_motor_collection().find_one_and_update(
+            {"digest": digest},
+            {
+                "$inc": {"referencias": 1},
+                "$setOnInsert": {
+                    "nombre": digest + extension,
+                    "tamano": tamano,
+                    "fechaCreacion": datetime.now()
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        ruta = os.path.join(UPLOAD_DIR, registro["nombre"])
+        if os.path.exists(ruta):
+            os.remove(ruta_tmp)
+        else:
+            os.replace(ruta_tmp, ruta)
+
+    return f"/static/{registro['nombre']}"
+
+
+async def liberar_imagen(url: str, referencias: int = 1) -> None:
+    """Resta referencias; el archivo se borra cuando ningún producto lo usa."""
+    nombre = os.path.basename(url)
+    ruta = os.path.join(UPLOAD_DIR, nombre)
+    coleccion = ArchivoImagen.get_motor_collection()
+
+    async with _lock_archivos:
+        registro = await coleccion.find_one_and_update(
+            {"nombre": nombre},
+            {"$inc": {"referencias": -referencias}},
+            return_document=ReturnDocument.AFTER
+        )
+
+        if registro is None:
+            # Imagen subida antes del almacenamiento por hash: sin contador
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            return
+
+        if registro["referencias"] > 0:
+            return
+
+        resultado = await coleccion.delete_one(
+            {"_id": registro["_id"], "referencias": {"$lte": 0}}
+        )
+        if resultado.deleted_count and os.path.exists(ruta):
+            os.remove(ruta)
@@ -0,0 +1,304 @@
+# catalog/importacion.py
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from beanie.operators import In
+from bson import DBRef
+from pydantic import TypeAdapter, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import itertools
+import json
+
+from .schemas import (
+    Categoria, Etiqueta, Producto, VarianteProducto,
+    ProductoImportacion, ErrorImportacion, ResultadoImportacion
+)
+
+TAMANO_LOTE = 500
+TAMANO_CHUNK = 64 * 1024
+
+# Una fila por variante; las filas consecutivas con el mismo SKU forman un producto
+COLUMNAS_CSV = [
+    "sku", "nombre", "descripcion", "precio_base", "estado", "categoria", "etiquetas",
+    "variante_atributo", "variante_valor", "variante_sku", "variante_precio", "variante_stock"
+]
+SEPARADOR_ETIQUETAS = "|"
+
+_PRODUCTO_IMPORTACION = TypeAdapter(ProductoImportacion)
+
+
+# --- Lectura ---
+
+def _filas_ndjson(texto: io.TextIOBase) -> Iterator[Tuple[int, Any]]:
+    for numero, linea in enumerate(texto, start=1):
+        if not linea.strip():
+            continue
+        try:
+            yield numero, json.loads(linea)
+        except ValueError as error:
+            yield numero, error
+
+
+def _filas_csv(texto: io.TextIOBase) -> Iterator[Tuple[int, Any]]:
+    actual: Optional[Dict[str, Any]] = None
+    fila_actual = 0
+    # La fila 1 es la cabecera
+    for numero, fila in enumerate(csv.DictReader(texto), start=2):
+        sku = (fila.get("sku") or "").strip()
+        if actual is None or sku != actual["sku"]:
+            if actual is not None:
+                yield fila_actual, actual
+            fila_actual = numero
+            etiquetas = fila.get("etiquetas") or ""
+            actual = {
+                "sku": sku,
+                "nombre": fila.get("nombre"),
+                "descripcion": fila.get("descripcion") or None,
+                "precio_base": fila.get("precio_base"),
+                "estado": fila.get("estado") or "Borrador",
+                "categoria": fila.get("categoria"),
+                "etiquetas": [e.strip() for e in etiquetas.split(SEPARADOR_ETIQUETAS) if e.strip()],
+                "variantes": []
+            }
+        if fila.get("variante_sku"):
+            variante = {
+                "atributo": fila.get("variante_atributo"),
+                "valor": fila.get("variante_valor"),
+                "sku": fila.get("variante_sku"),
+                "precio": fila.get("variante_precio")
+            }
+            # Celda vacía: no se toca el stock actual de la variante
+            if fila.get("variante_stock"):
+                variante["stock"] = fila.get("variante_stock")
+            actual["variantes"].append(variante)
+    if actual is not None:
+        yield fila_actual, actual
+
+
+def _variante(v: VarianteProducto) -> Dict[str, Any]:
+    """
+    Expresión de la variante para el update con pipeline. Si el archivo no
+    trae stock, se conserva el que tiene hoy esa variante (ya descontadas
+    las reservas activas); solo se pisa cuando viene explícito.
+    """
+    datos = v.model_dump()
+    if "stock" in v.model_fields_set:
+        return {"$literal": datos}
+    del datos["stock"]
+    previa = {"$arrayElemAt": [
+        {"$filter": {
+            "input": {"$ifNull": ["$variantes", []]},
+            "cond": {"$eq": ["$$this.sku", {"$literal": v.sku}]}
+        }},
+        0
+    ]}
+    return {"$mergeObjects": [
+        {"$literal": datos},
+        {"stock": {"$let": {"vars": {"previa": previa}, "in": {"$ifNull": ["$$previa.stock", None]}}}}
+    ]}
+
+
+def _siguiente_lote(filas: Iterator, n: int) -> List:
+    return list(itertools.islice(filas, n))
+
+
+def _resumir_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors()
+    )
+
+
+# --- Escritura por lotes ---
+
+class _Importador:
+    def __init__(self):
+        self.resultado = ResultadoImportacion()
+        # slug/nombre -> id; None si se buscó y no existe
+        self._categorias: Dict[str, Optional[Any]] = {}
+        self._etiquetas: Dict[str, Optional[Any]] = {}
+        self._skus_vistos = set()
+        self._col_categorias = Categoria.get_motor_collection().name
+        self._col_etiquetas = Etiqueta.get_motor_collection().name
+
+    def registrar_error(self, fila: int, sku: Optional[str], detalle: str) -> None:
+        self.resultado.errores.append(ErrorImportacion(fila=fila, sku=sku, detalle=detalle))
+
+    async def _resolver_referencias(self, productos: List[ProductoImportacion]) -> None:
+        """Una consulta por lote para categorías y otra para etiquetas que aún no se conocen."""
+        slugs = {p.categoria for p in productos} - self._categorias.keys()
+        if slugs:
+            for c in await Categoria.find(In(Categoria.slug, list(slugs))).to_list():
+                self._categorias[c.slug] = c.id
+            for slug in slugs:
+                self._categorias.setdefault(slug, None)
+
+        nombres = {e for p in productos for e in p.etiquetas} - self._etiquetas.keys()
+        if nombres:
+            for e in await Etiqueta.find(In(Etiqueta.nombre, list(nombres))).to_list():
+                self._etiquetas[e.nombre] = e.id
+            for nombre in nombres:
+                self._etiquetas.setdefault(nombre, None)
+
+    async def procesar_lote(self, lote: List[Tuple[int, Any]]) -> None:
+        validos: List[Tuple[int, ProductoImportacion]] = []
+        for fila, datos in lote:
+            self.resultado.procesados += 1
+            if isinstance(datos, Exception):
+                self.registrar_error(fila, None, f"JSON inválido: {datos}")
+                continue
+            sku = datos.get("sku") if isinstance(datos, dict) else None
+            try:
+                producto = _PRODUCTO_IMPORTACION.validate_python(datos)
+            except ValidationError as error:
+                self.registrar_error(fila, sku, _resumir_error(error))
+                continue
+            if producto.sku in self._skus_vistos:
+                self.registrar_error(fila, producto.sku, "SKU repetido en el archivo")
+                continue
+            self._skus_vistos.add(producto.sku)
+            validos.append((fila, producto))
+
+        await self._resolver_referencias([p for _, p in validos])
+
+        operaciones: List[UpdateOne] = []
+        filas_operaciones: List[Tuple[int, str]] = []
+        ahora = datetime.now()
+        for fila, p in validos:
+            categoria_id = self._categorias.get(p.categoria)
+            if categoria_id is None:
+                self.registrar_error(fila, p.sku, f"La categoría '{p.categoria}' no existe")
+                continue
+            faltantes = [e for e in p.etiquetas if self._etiquetas.get(e) is None]
+            if faltantes:
+                self.registrar_error(fila, p.sku, f"Etiquetas inexistentes: {', '.join(faltantes)}")
+                continue
+
+            # Update con pipeline para poder leer el stock actual de cada variante;
+            # los valores del archivo van en $literal para que un "$" no se lea como campo
+            operaciones.append(UpdateOne(
+                {"sku": p.sku},
+                [{"$set": {
+                    "nombre": {"$literal": p.nombre},
+                    "descripcion": {"$literal": p.descripcion},
+                    "precio_base": {"$literal": p.precio_base},
+                    "estado": {"$literal": p.estado},
+                    "categoria": {"$literal": DBRef(self._col_categorias, categoria_id)},
+                    "etiquetas": {"$literal": [DBRef(self._col_etiquetas, self._etiquetas[e]) for e in p.etiquetas]},
+                    "variantes": [_variante(v) for v in p.variantes],
+                    "imagenes": {"$ifNull": ["$imagenes", []]},
+                    "fechaCreacion": {"$ifNull": ["$fechaCreacion", {"$literal": ahora}]}
+                }}],
+                upsert=True
+            ))
+            filas_operaciones.append((fila, p.sku))
+
+        if not operaciones:
+            return
+
+        try:
+            escritura = await Producto.get_motor_collection().bulk_write(operaciones, ordered=False)
+            detalles = escritura.bulk_api_result
+        except BulkWriteError as error:
+            detalles = error.details
+            for fallo in detalles.get("writeErrors", []):
+                fila, sku = filas_operaciones[fallo["index"]]
+                self.registrar_error(fila, sku, fallo.get("errmsg", "Error de escritura"))
+
+        self.resultado.insertados += detalles.get("nUpserted", 0)
+        self.resultado.actualizados += detalles.get("nMatched", 0)
+
+
+async def importar_productos(archivo: UploadFile, formato: str) -> ResultadoImportacion:
+    """
+    Lee el archivo por lotes (el parseo corre en el threadpool), resuelve
+    categorías y etiquetas una vez por lote y escribe cada lote con un
+    bulk_write no ordenado que hace upsert por SKU.
+    """
+    texto = io.TextIOWrapper(archivo.file, encoding="utf-8-sig", newline="")
+    filas = _filas_csv(texto) if formato == "csv" else _filas_ndjson(texto)
+
+    importador = _Importador()
+    try:
+        while True:
+            lote = await run_in_threadpool(_siguiente_lote, filas, TAMANO_LOTE)
+            if not lote:
+                break
+            await importador.procesar_lote(lote)
+    except (UnicodeDecodeError, csv.Error) as error:
+        importador.registrar_error(importador.resultado.procesados + 1, None, f"Archivo ilegible: {error}")
+    finally:
+        texto.detach()
+
+    importador.resultado.errores.sort(key=lambda e: e.fila)
+    return importador.resultado
+
+
+# --- Exportación ---
+
+def _pipeline_exportacion() -> List[dict]:
+    return [
+        {"$sort": {"fechaCreacion": 1, "_id": 1}},
+        {"$lookup": {
+            "from": Categoria.get_motor_collection().name,
+            "localField": "categoria.$id",
+            "foreignField": "_id",
+            "as": "_categoria"
+        }},
+        {"$lookup": {
+            "from": Etiqueta.get_motor_collection().name,
+            "localField": "etiquetas.$id",
+            "foreignField": "_id",
+            "as": "_etiquetas"
+        }},
+        {"$project": {
+            "_id": 0,
+            "sku": 1,
+            "nombre": 1,
+            "descripcion": 1,
+            "precio_base": 1,
+            "estado": 1,
+            "variantes": 1,
+            "categoria": {"$ifNull": [{"$arrayElemAt": ["$_categoria.slug", 0]}, ""]},
+            "etiquetas": "$_etiquetas.nombre"
+        }}
+    ]
+
+
+async def exportar_productos(formato: str) -> AsyncIterator[bytes]:
+    """Recorre el cursor de la agregación y va emitiendo CSV o NDJSON por partes."""
+    cursor = Producto.get_motor_collection().aggregate(_pipeline_exportacion())
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if formato == "csv":
+        escritor.writerow(COLUMNAS_CSV)
+
+    async for doc in cursor:
+        if formato == "csv":
+            base = [
+                doc.get("sku"), doc.get("nombre"), doc.get("descripcion") or "",
+                doc.get("precio_base"), doc.get("estado"), doc.get("categoria"),
+                SEPARADOR_ETIQUETAS.join(doc.get("etiquetas") or [])
+            ]
+            variantes = doc.get("variantes") or []
+            if not variantes:
+                escritor.writerow(base + ["", "", "", "", ""])
+            for v in variantes:
+                stock = v.get("stock")
+                escritor.writerow(base + [
+                    v.get("atributo"), v.get("valor"), v.get("sku"), v.get("precio"),
+                    "" if stock is None else stock
+                ])
+        else:
+            buffer.write(json.dumps(doc, ensure_ascii=False, default=str))
+            buffer.write("\n")
+
+        if buffer.tell() >= TAMANO_CHUNK:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
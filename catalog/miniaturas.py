@@ -0,0 +1,169 @@
+# catalog/miniaturas.py
+from fastapi import HTTPException, status
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+import asyncio
+import mimetypes
+import os
+import time
+
+from .schemas import ArchivoImagen
+from .imagenes import UPLOAD_DIR
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow es opcional: sin él se sirve la imagen original
+    Image = None
+
+CACHE_DIR = "cache_imagenes"
+TAMANO_MAXIMO_CACHE = 256 * 1024 * 1024
+PROCESOS_REDIMENSION = 2
+CALIDAD = 80
+# FileResponse abre el archivo después de que obtener() devuelve la ruta:
+# durante este plazo una variante recién entregada no se desaloja
+SEGUNDOS_PROTECCION = 60.0
+
+# Solo se generan anchos conocidos para que el cache no crezca sin control
+ANCHOS_PERMITIDOS = {160, 320, 480, 640, 960, 1280}
+FORMATOS = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+
+def _redimensionar(origen: str, destino: str, ancho: int, formato: str) -> int:
+    """Corre en el pool de procesos: redimensiona, re-codifica y devuelve el tamaño final."""
+    with Image.open(origen) as original:
+        imagen = ImageOps.exif_transpose(original)
+        if imagen.width > ancho:
+            alto = max(1, round(imagen.height * ancho / imagen.width))
+            imagen = imagen.resize((ancho, alto), Image.LANCZOS)
+        if formato == "jpeg" and imagen.mode not in ("RGB", "L"):
+            imagen = imagen.convert("RGB")
+
+        temporal = f"{destino}.{os.getpid()}.tmp"
+        imagen.save(temporal, format=formato.upper(), quality=CALIDAD, optimize=True)
+    os.replace(temporal, destino)
+    return os.path.getsize(destino)
+
+
+class CacheVariantes:
+    """
+    Cache en disco de las variantes generadas, con tope de tamaño y
+    desalojo LRU. Al arrancar se reconstruye desde el directorio usando
+    la fecha de modificación como orden de uso.
+    """
+
+    def __init__(self, directorio: str, tamano_maximo: int):
+        self._directorio = directorio
+        self._tamano_maximo = tamano_maximo
+        self._entradas: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        # nombre -> momento (monotonic) de la última entrega
+        self._entregadas: Dict[str, float] = {}
+        self._cargado = False
+        self._en_curso: Dict[str, asyncio.Future] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _cargar(self) -> None:
+        os.makedirs(self._directorio, exist_ok=True)
+        archivos = []
+        for entrada in os.scandir(self._directorio):
+            if entrada.is_file() and not entrada.name.endswith(".tmp"):
+                info = entrada.stat()
+                archivos.append((info.st_mtime, entrada.name, info.st_size))
+        for _, nombre, tamano in sorted(archivos):
+            self._entradas[nombre] = tamano
+            self._total += tamano
+        self._cargado = True
+
+    def _buscar(self, nombre: str) -> Optional[str]:
+        if not self._cargado:
+            self._cargar()
+        if nombre not in self._entradas:
+            return None
+        ruta = os.path.join(self._directorio, nombre)
+        if not os.path.exists(ruta):
+            self._total -= self._entradas.pop(nombre)
+            self._entregadas.pop(nombre, None)
+            return None
+        self._entradas.move_to_end(nombre)
+        self._entregadas[nombre] = time.monotonic()
+        return ruta
+
+    def _registrar(self, nombre: str, tamano: int) -> None:
+        if nombre in self._entradas:
+            self._total -= self._entradas.pop(nombre)
+        self._entradas[nombre] = tamano
+        self._total += tamano
+        ahora = time.monotonic()
+        self._entregadas[nombre] = ahora
+        # De la menos usada a la más usada, saltando las que se están sirviendo;
+        # si todas están protegidas, el cache se pasa del tope por un rato
+        for viejo in list(self._entradas):
+            if self._total <= self._tamano_maximo:
+                break
+            entregada = self._entregadas.get(viejo)
+            if entregada is not None and ahora - entregada < SEGUNDOS_PROTECCION:
+                continue
+            self._total -= self._entradas.pop(viejo)
+            self._entregadas.pop(viejo, None)
+            try:
+                os.remove(os.path.join(self._directorio, viejo))
+            except FileNotFoundError:
+                pass
+
+    async def obtener(self, digest: str, ancho: int, formato: str) -> Tuple[str, str]:
+        """Devuelve (ruta, media_type) de la variante pedida, generándola si no existe."""
+        nombre = f"{digest}_{ancho}.{formato}"
+        ruta = self._buscar(nombre)
+        if ruta:
+            return ruta, FORMATOS[formato]
+
+        # Si ya se está generando la misma variante, se espera ese resultado
+        if nombre in self._en_curso:
+            return await asyncio.shield(self._en_curso[nombre])
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_curso[nombre] = futuro
+        try:
+            resultado = await self._generar(digest, nombre, ancho, formato)
+            futuro.set_result(resultado)
+            return resultado
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as error:
+            futuro.set_exception(error)
+            raise
+        finally:
+            del self._en_curso[nombre]
+            # Evita el warning de "exception never retrieved" si nadie esperaba
+            if futuro.done() and not futuro.cancelled():
+                futuro.exception()
+
+    async def _generar(self, digest: str, nombre: str, ancho: int, formato: str) -> Tuple[str, str]:
+        archivo = await ArchivoImagen.find_one(ArchivoImagen.digest == digest)
+        origen = os.path.join(UPLOAD_DIR, archivo.nombre) if archivo else None
+        if not origen or not os.path.exists(origen):
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Imagen no encontrada")
+
+        if Image is None:
+            media_type = mimetypes.guess_type(origen)[0] or "application/octet-stream"
+            return origen, media_type
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=PROCESOS_REDIMENSION)
+
+        destino = os.path.join(self._directorio, nombre)
+        tamano = await asyncio.get_running_loop().run_in_executor(
+            self._pool, _redimensionar, origen, destino, ancho, formato
+        )
+        self._registrar(nombre, tamano)
+        return destino, FORMATOS[formato]
+
+    def cerrar(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+cache_variantes = CacheVariantes(CACHE_DIR, TAMANO_MAXIMO_CACHE)
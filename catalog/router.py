@@ -1,30 +1,150 @@
 # catalog/router.py
 from fastapi import (
     APIRouter, HTTPException, status, 
-    UploadFile, File, Form, Query
+    UploadFile, File, Form, Query, Response, Request, BackgroundTasks
 )
-from typing import List, Optional
-import shutil
-import os
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import List, Optional, Hashable, Callable, Awaitable, Any
+from pydantic import TypeAdapter
+from datetime import datetime
+from bson import ObjectId, DBRef
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+import base64
+import json
 
 from beanie import BeanieObjectId, Link
 from beanie.operators import In
 from .schemas import (
     Categoria, Etiqueta, Producto,
-    CategoriaCreate, CategoriaOut, 
-    ProductoCreate, ProductoOut,
-    VarianteProducto, ImagenProducto,
+    CategoriaCreate, CategoriaOut, CategoriaArbolOut,
+    ProductoCreate, ProductoOut, ProductoPagina, BusquedaProductosOut,
+    ResultadoImportacion,
+    VarianteProducto, AjusteStock, ImagenProducto,
     Vitrina, VitrinaCreate, VitrinaOut
 )
+from .cache import catalog_cache, etag_coincide
+from .imagenes import TAMANO_MAXIMO, guardar_imagen, liberar_imagen
+from .miniaturas import cache_variantes, ANCHOS_PERMITIDOS, FORMATOS
+from .busqueda import indice_productos
+from .importacion import importar_productos, exportar_productos
+from streaming import pide_ndjson, respuesta_streaming
+from cart.tareas import repreciar_carritos
 
 router = APIRouter(
     prefix="/api",
     tags=["2. Catálogo y Productos"]
 )
 
+# Variantes redimensionadas; se registra antes del mount de /static en main.py
+imagenes_router = APIRouter(
+    prefix="/static/img",
+    tags=["2. Catálogo y Productos"]
+)
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# --- Cache de lecturas del catálogo ---
+
+# El storefront revalida en cada visita; si no cambió, recibe un 304 sin cuerpo
+CACHE_CONTROL_CATALOGO = "public, max-age=0, must-revalidate"
+
+_CATEGORIA = TypeAdapter(CategoriaOut)
+_LISTA_CATEGORIAS = TypeAdapter(List[CategoriaOut])
+_ARBOL_CATEGORIAS = TypeAdapter(List[CategoriaArbolOut])
+_ETIQUETA = TypeAdapter(Etiqueta)
+_LISTA_ETIQUETAS = TypeAdapter(List[Etiqueta])
+_PRODUCTO = TypeAdapter(ProductoOut)
+_LISTA_PRODUCTOS = TypeAdapter(List[ProductoOut])
+_PAGINA_PRODUCTOS = TypeAdapter(ProductoPagina)
+_VITRINA = TypeAdapter(VitrinaOut)
+_LISTA_VITRINAS = TypeAdapter(List[VitrinaOut])
+
+async def _respuesta_cacheada(
+    request: Request,
+    clave: Hashable,
+    adaptador: TypeAdapter,
+    cargar: Callable[[], Awaitable[Any]]
+) -> Response:
+    """
+    Sirve el JSON ya serializado desde el cache del catálogo. Si no está (o
+    quedó obsoleto por una escritura) se consulta Mongo y se guarda.
+    Responde 304 cuando el If-None-Match del cliente coincide con el ETag.
+    """
+    entrada = catalog_cache.obtener(clave)
+    if entrada is None:
+        version = catalog_cache.version
+        datos = adaptador.validate_python(await cargar(), from_attributes=True)
+        contenido = adaptador.dump_json(datos, by_alias=True)
+        etag = catalog_cache.guardar(clave, version, contenido)
+    else:
+        contenido, etag = entrada
+
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL_CATALOGO}
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=contenido, media_type="application/json", headers=headers)
+
+# --- Listado paginado de productos (keyset sobre fechaCreacion + _id) ---
+
+def _codificar_cursor(fecha: datetime, producto_id: ObjectId) -> str:
+    crudo = json.dumps({"f": fecha.isoformat(), "i": str(producto_id)})
+    return base64.urlsafe_b64encode(crudo.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decodificar_cursor(cursor: str):
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return datetime.fromisoformat(datos["f"]), ObjectId(datos["i"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Cursor inválido")
+
+def _pipeline_productos(filtro: dict, limite: Optional[int] = None) -> List[dict]:
+    """
+    Arma en una sola agregación el listado de productos: filtra, ordena por
+    la clave del cursor y resuelve la categoría con $lookup, proyectando
+    solo los campos de ProductoOut.
+    """
+    pipeline = [
+        {"$match": filtro},
+        {"$sort": {"fechaCreacion": 1, "_id": 1}},
+    ]
+    if limite:
+        pipeline.append({"$limit": limite})
+    return pipeline + [
+        {"$lookup": {
+            "from": Categoria.get_motor_collection().name,
+            "localField": "categoria.$id",
+            "foreignField": "_id",
+            "as": "categoria"
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": "$_id",
+            "nombre": 1,
+            "sku": 1,
+            "descripcion": 1,
+            "precio_base": 1,
+            "estado": 1,
+            "imagenes": 1,
+            "fechaCreacion": 1,
+            "categoria": {"$let": {
+                "vars": {"c": {"$arrayElemAt": ["$categoria", 0]}},
+                "in": {"id": "$$c._id", "nombre": "$$c.nombre", "slug": "$$c.slug"}
+            }}
+        }}
+    ]
+
+async def _ids_subarbol(categoria_id: ObjectId) -> List[ObjectId]:
+    """La categoría y todas sus descendientes, con una consulta indexada sobre `ancestros`."""
+    descendientes = await Categoria.get_motor_collection().find(
+        {"ancestros": categoria_id}, {"_id": 1}
+    ).to_list(length=None)
+    return [categoria_id] + [d["_id"] for d in descendientes]
+
+async def _filtro_categoria(categoria_id: ObjectId, incluir_subcategorias: bool) -> dict:
+    if not incluir_subcategorias:
+        return {"categoria.$id": categoria_id}
+    return {"categoria.$id": {"$in": await _ids_subarbol(categoria_id)}}
 
 
 # === Endpoints para CATEGORIAS  ===
@@ -50,17 +170,103 @@ async def crear_categoria(categoria_data: CategoriaCreate):
     nueva_categoria = Categoria(
         nombre=categoria_data.nombre,
         slug=categoria_data.slug,
-        categoriaPadre=categoria_padre
+        categoriaPadreId=categoria_padre,
+        ancestros=categoria_padre.ancestros + [categoria_padre.id] if categoria_padre else [],
+        profundidad=categoria_padre.profundidad + 1 if categoria_padre else 0
     )
     
     await nueva_categoria.insert()
+    catalog_cache.invalidar()
     
     return CategoriaOut.model_validate(nueva_categoria)
 
 @router.get("/categorias", response_model=List[CategoriaOut])
-async def obtener_categorias():
-    categorias = await Categoria.find_all().to_list()
-    return categorias
+async def obtener_categorias(request: Request):
+    if pide_ndjson(request):
+        return respuesta_streaming(request, Categoria.find_all(), _CATEGORIA)
+    return await _respuesta_cacheada(
+        request, ("categorias",), _LISTA_CATEGORIAS, Categoria.find_all().to_list
+    )
+
+@router.get("/categorias/arbol", response_model=List[CategoriaArbolOut])
+async def obtener_arbol_categorias(request: Request):
+    async def cargar():
+        categorias = await Categoria.get_motor_collection().find(
+            {}, {"nombre": 1, "slug": 1, "ancestros": 1}
+        ).sort("profundidad", 1).to_list(length=None)
+
+        nodos = {}
+        raices = []
+        for c in categorias:
+            nodo = {"id": c["_id"], "nombre": c["nombre"], "slug": c["slug"], "hijos": []}
+            nodos[c["_id"]] = nodo
+            ancestros = c.get("ancestros") or []
+            padre = nodos.get(ancestros[-1]) if ancestros else None
+            if padre:
+                padre["hijos"].append(nodo)
+            else:
+                raices.append(nodo)
+        return raices
+
+    return await _respuesta_cacheada(request, ("categorias_arbol",), _ARBOL_CATEGORIAS, cargar)
+
+@router.put("/categorias/{categoria_id}", response_model=CategoriaOut)
+async def actualizar_categoria(categoria_id: BeanieObjectId, categoria_data: CategoriaCreate):
+    categoria = await Categoria.get(categoria_id)
+    if not categoria:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Categoría no encontrada")
+
+    slug_existente = await Categoria.find_one(
+        Categoria.slug == categoria_data.slug,
+        Categoria.id != categoria_id
+    )
+    if slug_existente:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"El slug '{categoria_data.slug}' ya está en uso"
+        )
+
+    categoria_padre = None
+    if categoria_data.categoriaPadreId:
+        categoria_padre = await Categoria.get(categoria_data.categoriaPadreId)
+        if not categoria_padre:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "La categoría padre no existe")
+        if categoria_padre.id == categoria.id or categoria.id in categoria_padre.ancestros:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                "Una categoría no puede moverse dentro de sí misma"
+            )
+
+    nuevos_ancestros = categoria_padre.ancestros + [categoria_padre.id] if categoria_padre else []
+    se_movio = nuevos_ancestros != categoria.ancestros
+
+    categoria.nombre = categoria_data.nombre
+    categoria.slug = categoria_data.slug
+    categoria.categoriaPadreId = categoria_padre
+    categoria.ancestros = nuevos_ancestros
+    categoria.profundidad = len(nuevos_ancestros)
+    await categoria.save()
+
+    if se_movio:
+        # Los descendientes reemplazan el tramo de ruta anterior a esta categoría
+        await Categoria.get_motor_collection().update_many(
+            {"ancestros": categoria.id},
+            [
+                {"$set": {"ancestros": {"$concatArrays": [
+                    nuevos_ancestros + [categoria.id],
+                    {"$slice": [
+                        "$ancestros",
+                        {"$add": [{"$indexOfArray": ["$ancestros", categoria.id]}, 1]},
+                        {"$max": [{"$size": "$ancestros"}, 1]}
+                    ]}
+                ]}}},
+                {"$set": {"profundidad": {"$size": "$ancestros"}}}
+            ]
+        )
+
+    catalog_cache.invalidar()
+    indice_productos.invalidar()
+    return CategoriaOut.model_validate(categoria)
 
 @router.delete("/categorias/{categoria_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def eliminar_categoria(categoria_id: BeanieObjectId):
@@ -73,6 +279,20 @@ async def eliminar_categoria(categoria_id: BeanieObjectId):
         )
     
     await categoria.delete()
+
+    # Las subcategorías suben un nivel y quedan colgando del abuelo
+    coleccion = Categoria.get_motor_collection()
+    nuevo_padre = DBRef(coleccion.name, categoria.ancestros[-1]) if categoria.ancestros else None
+    await coleccion.update_many(
+        {"categoriaPadreId.$id": categoria.id},
+        {"$set": {"categoriaPadreId": nuevo_padre}}
+    )
+    await coleccion.update_many(
+        {"ancestros": categoria.id},
+        {"$pull": {"ancestros": categoria.id}, "$inc": {"profundidad": -1}}
+    )
+    catalog_cache.invalidar()
+    indice_productos.invalidar()
     return
 
 
@@ -89,12 +309,16 @@ async def crear_etiqueta(etiqueta_data: Etiqueta):
 
     nueva_etiqueta = Etiqueta(nombre=etiqueta_data.nombre)
     await nueva_etiqueta.insert()
+    catalog_cache.invalidar()
     return nueva_etiqueta
 
 @router.get("/etiquetas", response_model=List[Etiqueta])
-async def obtener_etiquetas():
-    etiquetas = await Etiqueta.find_all().to_list()
-    return etiquetas
+async def obtener_etiquetas(request: Request):
+    if pide_ndjson(request):
+        return respuesta_streaming(request, Etiqueta.find_all(), _ETIQUETA)
+    return await _respuesta_cacheada(
+        request, ("etiquetas",), _LISTA_ETIQUETAS, Etiqueta.find_all().to_list
+    )
 
 
 # === Endpoints para PRODUCTOS  ===
@@ -127,34 +351,161 @@ async def crear_producto(producto_data: ProductoCreate):
     )
     
     await nuevo_producto.insert()
+    catalog_cache.invalidar()
+    await indice_productos.actualizar(nuevo_producto.id)
     
     return ProductoOut.model_validate(nuevo_producto)
 
 @router.get("/productos", response_model=List[ProductoOut])
-async def obtener_productos(solo_activos: bool = False):
-    if solo_activos:
-        productos = await Producto.find(
-            Producto.estado == "Activo", 
-            fetch_links=True
-        ).to_list()
-    else:
-        productos = await Producto.find_all(fetch_links=True).to_list()
-        
-    return productos
+async def obtener_productos(
+    request: Request,
+    solo_activos: bool = False,
+    categoria: Optional[BeanieObjectId] = Query(None, description="Incluye sus subcategorías"),
+    incluir_subcategorias: bool = True
+):
+    if categoria:
+        # Filtro por subárbol: un solo $in indexado y el mismo $lookup del listado paginado
+        async def pipeline_subarbol():
+            filtro = await _filtro_categoria(categoria, incluir_subcategorias)
+            if solo_activos:
+                filtro["estado"] = "Activo"
+            return _pipeline_productos(filtro)
+
+        if pide_ndjson(request):
+            return respuesta_streaming(
+                request,
+                Producto.get_motor_collection().aggregate(await pipeline_subarbol()),
+                _PRODUCTO
+            )
 
-@router.get("/productos/{producto_id}", response_model=ProductoOut)
-async def obtener_producto(producto_id: BeanieObjectId):
-    producto = await Producto.find_one(
-        Producto.id == producto_id,
-        fetch_links=True
+        async def cargar():
+            pipeline = await pipeline_subarbol()
+            return await Producto.get_motor_collection().aggregate(pipeline).to_list(length=None)
+
+        clave = ("productos", solo_activos, categoria, incluir_subcategorias)
+        return await _respuesta_cacheada(request, clave, _LISTA_PRODUCTOS, cargar)
+
+    def consulta():
+        if solo_activos:
+            return Producto.find(
+                Producto.estado == "Activo", 
+                fetch_links=True
+            )
+        return Producto.find_all(fetch_links=True)
+
+    if pide_ndjson(request):
+        return respuesta_streaming(request, consulta(), _PRODUCTO)
+
+    async def cargar():
+        return await consulta().to_list()
+
+    return await _respuesta_cacheada(request, ("productos", solo_activos), _LISTA_PRODUCTOS, cargar)
+
+@router.get("/productos/pagina", response_model=ProductoPagina)
+async def obtener_productos_paginados(
+    request: Request,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto en siguienteCursor"),
+    estado: Optional[str] = None,
+    categoria: Optional[BeanieObjectId] = None,
+    incluir_subcategorias: bool = True,
+    etiqueta: Optional[BeanieObjectId] = None
+):
+    filtro = {}
+    if estado:
+        filtro["estado"] = estado
+    if etiqueta:
+        filtro["etiquetas.$id"] = etiqueta
+    if cursor:
+        fecha, ultimo_id = _decodificar_cursor(cursor)
+        filtro["$or"] = [
+            {"fechaCreacion": {"$gt": fecha}},
+            {"fechaCreacion": fecha, "_id": {"$gt": ultimo_id}}
+        ]
+
+    async def cargar():
+        if categoria:
+            filtro.update(await _filtro_categoria(categoria, incluir_subcategorias))
+        # Se pide uno extra solo para saber si hay página siguiente
+        pipeline = _pipeline_productos(filtro, limit + 1)
+        docs = await Producto.get_motor_collection().aggregate(pipeline).to_list(length=limit + 1)
+
+        siguiente_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            siguiente_cursor = _codificar_cursor(docs[-1]["fechaCreacion"], docs[-1]["id"])
+        return {"items": docs, "siguienteCursor": siguiente_cursor}
+
+    clave = ("productos_pagina", limit, cursor, estado, categoria, incluir_subcategorias, etiqueta)
+    return await _respuesta_cacheada(request, clave, _PAGINA_PRODUCTOS, cargar)
+
+@router.get("/productos/buscar", response_model=BusquedaProductosOut)
+async def buscar_productos(
+    q: str = Query("", description="Texto a buscar; la última palabra puede estar incompleta"),
+    categoria: Optional[BeanieObjectId] = None,
+    etiqueta: Optional[BeanieObjectId] = None,
+    solo_activos: bool = False,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    return await indice_productos.buscar(
+        q,
+        categoria=str(categoria) if categoria else None,
+        etiqueta=str(etiqueta) if etiqueta else None,
+        solo_activos=solo_activos,
+        limite=limit,
+        desplazamiento=offset
     )
-    
-    if not producto:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Producto no encontrado"
+
+@router.post("/productos/importar", response_model=ResultadoImportacion)
+async def importar_catalogo(
+    background_tasks: BackgroundTasks,
+    archivo: UploadFile = File(..., description="CSV (una fila por variante) o NDJSON (un producto por línea)"),
+    formato: Optional[str] = Query(None, description="csv o ndjson; por defecto según la extensión")
+):
+    if formato is None:
+        formato = "csv" if (archivo.filename or "").lower().endswith(".csv") else "ndjson"
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Formato no soportado")
+
+    resultado = await importar_productos(archivo, formato)
+
+    if resultado.insertados or resultado.actualizados:
+        catalog_cache.invalidar()
+        indice_productos.invalidar()
+    if resultado.actualizados:
+        # La importación es la vía que cambia precios de variantes
+        background_tasks.add_task(repreciar_carritos)
+    return resultado
+
+@router.get("/productos/exportar")
+async def exportar_catalogo(formato: str = Query("ndjson", description="csv o ndjson")):
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Formato no soportado")
+
+    media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        exportar_productos(formato),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="productos.{formato}"'}
+    )
+
+@router.get("/productos/{producto_id}", response_model=ProductoOut)
+async def obtener_producto(request: Request, producto_id: BeanieObjectId):
+    async def cargar():
+        producto = await Producto.find_one(
+            Producto.id == producto_id,
+            fetch_links=True
         )
-    return producto
+        
+        if not producto:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Producto no encontrado"
+            )
+        return producto
+
+    return await _respuesta_cacheada(request, ("producto", producto_id), _PRODUCTO, cargar)
 
 @router.put("/productos/{producto_id}", response_model=ProductoOut)
 async def actualizar_producto(producto_id: BeanieObjectId, producto_data: ProductoCreate):
@@ -181,6 +532,8 @@ async def actualizar_producto(producto_id: BeanieObjectId, producto_data: Produc
     update_data["etiquetas"] = etiquetas
     
     await producto.update({"$set": update_data})
+    catalog_cache.invalidar()
+    await indice_productos.actualizar(producto_id)
     
     producto_actualizado = await Producto.get(producto_id, fetch_links=True)
     return ProductoOut.model_validate(producto_actualizado)
@@ -195,6 +548,10 @@ async def eliminar_producto(producto_id: BeanieObjectId):
         )
     
     await producto.delete()
+    for imagen in producto.imagenes:
+        await liberar_imagen(imagen.url)
+    catalog_cache.invalidar()
+    await indice_productos.quitar(producto_id)
     return
 
 # === Endpoints para VARIANTES  ===
@@ -209,6 +566,8 @@ async def crear_variante_para_producto(
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Producto no encontrado")
     
     await producto.update({"$push": {"variantes": variante_data.model_dump()}})
+    catalog_cache.invalidar()
+    await indice_productos.actualizar(producto_id)
     
     producto_actualizado = await Producto.find_one(
         Producto.id == producto_id,
@@ -225,6 +584,20 @@ async def obtener_variantes_por_producto(producto_id: BeanieObjectId):
     
     return producto.variantes
 
+@router.put("/productos/{producto_id}/variantes/{sku}/stock", response_model=VarianteProducto)
+async def fijar_stock_variante(producto_id: BeanieObjectId, sku: str, ajuste: AjusteStock):
+    """Fija las unidades disponibles (sin contar las ya reservadas); null quita el control de stock."""
+    producto = await Producto.get_motor_collection().find_one_and_update(
+        {"_id": producto_id, "variantes.sku": sku},
+        {"$set": {"variantes.$.stock": ajuste.stock}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not producto:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Producto o variante no encontrado")
+    catalog_cache.invalidar()
+    await indice_productos.actualizar(producto_id)
+    return next(v for v in producto["variantes"] if v["sku"] == sku)
+
 # === Endpoints para IMÁGENES  ===
 
 @router.post("/productos/{producto_id}/imagenes", response_model=ImagenProducto)
@@ -238,25 +611,24 @@ async def agregar_imagen_a_producto(
     if not producto:
          raise HTTPException(status.HTTP_404_NOT_FOUND, "Producto no encontrado")
     
-    if archivo.size > 2 * 1024 * 1024:
+    # El límite se vuelve a controlar mientras se copia, por si no viene el tamaño
+    if archivo.size and archivo.size > TAMANO_MAXIMO:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail="La imagen excede el tamaño permitido (2MB)"
         )
 
-    file_path = os.path.join(UPLOAD_DIR, archivo.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(archivo.file, buffer)
-    
-    url_ficticia = f"/static/{archivo.filename}" 
+    url_imagen = await guardar_imagen(archivo)
     
     nueva_imagen = ImagenProducto(
-        url=url_ficticia,
+        url=url_imagen,
         textoAlternativo=textoAlternativo,
         esPrincipal=esPrincipal
     )
     
     await producto.update({"$push": {"imagenes": nueva_imagen.model_dump()}})
+    catalog_cache.invalidar()
+    await indice_productos.actualizar(producto_id)
     
     return nueva_imagen
 
@@ -269,11 +641,16 @@ async def eliminar_imagen_de_producto(
     if not producto:
          raise HTTPException(status.HTTP_404_NOT_FOUND, "Producto no encontrado")
 
-    file_path = os.path.join(UPLOAD_DIR, os.path.basename(url_imagen))
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    referencias = sum(1 for imagen in producto.imagenes if imagen.url == url_imagen)
 
-    await producto.update({"$pull": {"imagenes": {"url": url_imagen}}})
+    resultado = await Producto.get_motor_collection().update_one(
+        {"_id": producto.id, "imagenes.url": url_imagen},
+        {"$pull": {"imagenes": {"url": url_imagen}}}
+    )
+    if resultado.modified_count:
+        await liberar_imagen(url_imagen, max(referencias, 1))
+    catalog_cache.invalidar()
+    await indice_productos.actualizar(producto_id)
     
     return
 
@@ -293,12 +670,17 @@ async def crear_vitrina(data: VitrinaCreate):
         productos=productos 
     )
     await nueva_vitrina.insert()
+    catalog_cache.invalidar()
     
     return VitrinaOut.model_validate(nueva_vitrina)
 
 @router.get("/vitrinas", response_model=List[VitrinaOut])
-async def obtener_vitrinas():
-    return await Vitrina.find_all(fetch_links=True).to_list()
+async def obtener_vitrinas(request: Request):
+    if pide_ndjson(request):
+        return respuesta_streaming(request, Vitrina.find_all(fetch_links=True), _VITRINA)
+    return await _respuesta_cacheada(
+        request, ("vitrinas",), _LISTA_VITRINAS, Vitrina.find_all(fetch_links=True).to_list
+    )
 
 @router.put("/vitrinas/{id}", response_model=VitrinaOut)
 async def actualizar_vitrina(id: BeanieObjectId, data: VitrinaCreate):
@@ -313,6 +695,7 @@ async def actualizar_vitrina(id: BeanieObjectId, data: VitrinaCreate):
     vitrina.productos = productos
     
     await vitrina.save()
+    catalog_cache.invalidar()
     return VitrinaOut.model_validate(vitrina)
 
 @router.delete("/vitrinas/{id}")
@@ -321,4 +704,32 @@ async def eliminar_vitrina(id: BeanieObjectId):
     if not vitrina:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Vitrina no encontrada")
     await vitrina.delete()
-    return {"mensaje": "Vitrina eliminada"}
\ No newline at end of file
+    catalog_cache.invalidar()
+    return {"mensaje": "Vitrina eliminada"}
+
+# === ENDPOINTS VARIANTES DE IMAGEN ===
+
+@imagenes_router.get("/{digest}")
+async def obtener_variante_imagen(
+    digest: str,
+    w: int = Query(320, description="Ancho en píxeles"),
+    fmt: str = Query("webp", description="webp, jpeg o png")
+):
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Imagen no encontrada")
+    if w not in ANCHOS_PERMITIDOS:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Ancho no permitido. Opciones: {sorted(ANCHOS_PERMITIDOS)}"
+        )
+    if fmt not in FORMATOS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Formato no soportado")
+
+    ruta, media_type = await cache_variantes.obtener(digest, w, fmt)
+
+    # La URL depende del hash del contenido, así que nunca cambia
+    return FileResponse(
+        ruta,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
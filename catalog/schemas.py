@@ -3,6 +3,7 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from beanie import Document, Link, BeanieObjectId
+from pymongo import IndexModel
 from datetime import datetime
 
 # --- Modelos para categorias ---
@@ -11,14 +12,24 @@ class Categoria(Document):
     nombre: str
     slug: str = Field(..., unique=True)
     categoriaPadreId: Optional[Link["Categoria"]] = None
+    # Ruta materializada: ids desde la raíz hasta el padre directo
+    ancestros: List[BeanieObjectId] = []
+    profundidad: int = 0
 
     class Settings:
         name = "categorias"
+        indexes = [
+            IndexModel([("slug", 1)], unique=True),
+            [("ancestros", 1)],
+        ]
 
 class Etiqueta(Document):
     nombre: str = Field(..., unique=True)
 
-    class Settings: "etiquetas"        
+    class Settings:
+        indexes = [
+            IndexModel([("nombre", 1)], unique=True),
+        ]
 
 # --- Modelo para Embebidos ---
 
@@ -32,6 +43,11 @@ class VarianteProducto(BaseModel):
     valor: str
     sku: str
     precio: float = Field(..., gt=0)
+    # Unidades disponibles (ya descontadas las reservadas); None = sin control de stock
+    stock: Optional[int] = Field(None, ge=0)
+
+class AjusteStock(BaseModel):
+    stock: Optional[int] = Field(..., ge=0)
 
 class Producto(Document):
     nombre: str 
@@ -49,6 +65,28 @@ class Producto(Document):
 
     class Settings:
         name = "productos"
+        indexes = [
+            IndexModel([("sku", 1)], unique=True),
+            [("estado", 1)],
+            [("fechaCreacion", 1), ("_id", 1)],
+            [("categoria.$id", 1)],
+            [("etiquetas.$id", 1)],
+        ]
+
+# --- Archivo de imagen guardado por contenido (sha256) ---
+class ArchivoImagen(Document):
+    digest: str
+    nombre: str
+    tamano: int
+    referencias: int = 0
+    fechaCreacion: datetime = Field(default_factory=datetime.now)
+
+    class Settings:
+        name = "archivos_imagen"
+        indexes = [
+            IndexModel([("digest", 1)], unique=True),
+            IndexModel([("nombre", 1)], unique=True),
+        ]
 
 class CategoriaCreate(BaseModel):
     nombre: str
@@ -63,6 +101,12 @@ class CategoriaOut(BaseModel):
         from_attributes = True
         arbitrary_types_allowed = True
 
+class CategoriaArbolOut(BaseModel):
+    id: BeanieObjectId
+    nombre: str
+    slug: str
+    hijos: List["CategoriaArbolOut"] = []
+
 class ProductoCreate(BaseModel):
     nombre: str
     sku: str
@@ -87,6 +131,47 @@ class ProductoOut(BaseModel):
         from_attributes = True   
         arbitrary_types_allowed = True             
 
+class ProductoPagina(BaseModel):
+    items: List[ProductoOut] = []
+    siguienteCursor: Optional[str] = None
+
+# --- Modelos para importación / exportación masiva ---
+class ProductoImportacion(BaseModel):
+    sku: str
+    nombre: str
+    descripcion: Optional[str] = None
+    precio_base: float = Field(..., gt=0)
+    estado: str = "Borrador"
+    categoria: str = Field(..., description="Slug de la categoría")
+    etiquetas: List[str] = Field([], description="Nombres de etiquetas existentes")
+    variantes: List[VarianteProducto] = []
+
+class ErrorImportacion(BaseModel):
+    fila: int
+    sku: Optional[str] = None
+    detalle: str
+
+class ResultadoImportacion(BaseModel):
+    procesados: int = 0
+    insertados: int = 0
+    actualizados: int = 0
+    errores: List[ErrorImportacion] = []
+
+# --- Modelos para la búsqueda ---
+class Faceta(BaseModel):
+    id: str
+    nombre: str
+    cantidad: int
+
+class FacetasBusqueda(BaseModel):
+    categorias: List[Faceta] = []
+    etiquetas: List[Faceta] = []
+
+class BusquedaProductosOut(BaseModel):
+    total: int
+    resultados: List[ProductoOut] = []
+    facetas: FacetasBusqueda
+
 # --- Modelo Vitrina ---
 class Vitrina(Document):
     nombre: str
@@ -96,6 +181,9 @@ class Vitrina(Document):
     
     class Settings:
         name = "vitrinas"
+        indexes = [
+            IndexModel([("slug", 1)], unique=True),
+        ]
 
 # Schema de salida (Para la API)
 class VitrinaOut(BaseModel):
@@ -12,11 +12,15 @@ from transbank.common.integration_api_keys import IntegrationApiKeys
 
 from .schemas import (
     WebpayInitResponse, WebpayCommitRequest, IniciarPagoRequest,
-    Orden, OrdenOut, Boleta
+    ItemOrdenInput, Orden, OrdenOut, Boleta
 )
 from auth.schemas import User
 from auth.router import get_current_user
 from admin.schemas import ReglasCarrito
+from cart.router import regla_cupon
+from cart.store import carrito_store
+from cart.reservas import preparar_pago, asegurar_pago, confirmar_pago, cancelar_pago
+from cart.precios import a_clp, calcular, lineas_desde_items
 
 router = APIRouter(prefix="/api/checkout", tags=["3. Carrito y Checkout"])
 
@@ -41,9 +45,35 @@ async def iniciar_pago_webpay(
     datos: IniciarPagoRequest,
     usuario: User = Depends(get_current_user)
 ):
+    # El monto se calcula en el servidor con el motor de precios, solo desde
+    # el carrito guardado: los precios enviados por el cliente no se usan
+    carrito = await carrito_store.obtener(usuario)
+    if not carrito.items:
+        raise HTTPException(status.HTTP_409_CONFLICT, "El carrito está vacío")
+
+    imagenes = {i.nombre: i.img for i in datos.items}
+    precio = calcular(
+        lineas_desde_items(carrito.items),
+        await regla_cupon(carrito.cuponCodigo)
+    )
+    items = [
+        ItemOrdenInput(
+            nombre=i.nombreProducto,
+            precio=a_clp(i.precioUnitario),
+            cantidad=i.cantidad,
+            img=imagenes.get(i.nombreProducto)
+        )
+        for i in carrito.items
+    ]
+    if datos.total and a_clp(datos.total) != precio.total:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            f"El total del carrito cambió a ${precio.total}, revisa tu pedido"
+        )
+
     reglas = await ReglasCarrito.find_one()
     if reglas:
-        total_cantidad = sum(item.cantidad for item in datos.items)
+        total_cantidad = sum(item.cantidad for item in items)
         
         if total_cantidad < reglas.cantidadMinimaGlobal:
             raise HTTPException(
@@ -51,18 +81,21 @@ async def iniciar_pago_webpay(
                 f"El pedido mínimo es de {reglas.cantidadMinimaGlobal} productos."
             )
 
-    if not datos.items or datos.total <= 0:
+    if not items or precio.total <= 0:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Datos de compra inválidos")
 
     buy_order = f"LN-{int(datetime.datetime.now().timestamp())}"
     session_id = str(random.randint(100000, 999999))
+
+    # Las reservas del carrito pasan a estar atadas a esta orden
+    await preparar_pago(usuario.id, carrito.items, buy_order)
     
     nueva_orden = Orden(
         propietario=usuario,
         numeroOrden=buy_order,
         estado="Pendiente",
-        items=datos.items,
-        total=datos.total,
+        items=items,
+        total=precio.total,
         datos_entrega=datos.datos_entrega
     )
     await nueva_orden.insert()
@@ -70,9 +103,12 @@ async def iniciar_pago_webpay(
     tx = get_transaction() 
     
     try:
-        response = tx.create(buy_order, session_id, datos.total, URL_RETORNO)
+        response = tx.create(buy_order, session_id, precio.total, URL_RETORNO)
     except TransbankError as e:
         print(f"Error Transbank: {e}")
+        nueva_orden.estado = "Fallido"
+        await nueva_orden.save()
+        await cancelar_pago(usuario.id, buy_order)
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "No se pudo conectar con Transbank")
 
     nueva_orden.token_ws = response['token']
@@ -98,6 +134,16 @@ async def confirmar_pago_webpay(
     if orden.estado == "Pagado":
         return orden 
 
+    # Sin commit Webpay no cobra: si el stock de la orden ya se liberó y
+    # vendió mientras el cliente pagaba, la orden falla antes de cobrar
+    if not await asegurar_pago(orden.propietario.ref.id, orden.numeroOrden):
+        orden.estado = "Fallido"
+        await orden.save()
+        await cancelar_pago(orden.propietario.ref.id, orden.numeroOrden)
+        raise HTTPException(
+            status.HTTP_409_CONFLICT, "Se agotó el stock de la orden mientras se procesaba el pago"
+        )
+
     tx = get_transaction()
     
     try:
@@ -105,12 +151,14 @@ async def confirmar_pago_webpay(
     except TransbankError as e:
         orden.estado = "Fallido"
         await orden.save()
+        await cancelar_pago(orden.propietario.ref.id, orden.numeroOrden)
         print(f"Error confirmando: {e}")
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Error al confirmar transacción con el banco")
 
     if response.get('status') == 'AUTHORIZED' and response.get('response_code') == 0:
         orden.estado = "Pagado"
         await orden.save()
+        await confirmar_pago(orden.propietario.ref.id, orden.numeroOrden)
         
         numero_boleta = f"B-{orden.numeroOrden}"
         nueva_boleta = Boleta(
@@ -125,4 +173,5 @@ async def confirmar_pago_webpay(
     else:
         orden.estado = "Rechazado"
         await orden.save()
+        await cancelar_pago(orden.propietario.ref.id, orden.numeroOrden)
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "El pago fue rechazado o anulado")
\ No newline at end of file
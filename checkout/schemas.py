@@ -50,6 +50,12 @@ class Orden(Document):
     
     class Settings:
         name = "ordenes"
+        indexes = [
+            [("numeroOrden", 1)],
+            [("token_ws", 1)],
+            [("estado", 1), ("fecha", 1)],
+            [("fecha", 1)],
+        ]
 
 class Boleta(Document):
     orden: Link[Orden]
@@ -60,6 +66,10 @@ class Boleta(Document):
     
     class Settings:
         name = "boletas"
+        indexes = [
+            [("boletaId", 1)],
+            [("fechaEmision", 1)],
+        ]
 
 class OrdenOut(BaseModel):
     id: BeanieObjectId 
@@ -6,9 +6,9 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import List, Type
 
 # --- Imports de Modelos ---
-from auth.schemas import User
-from catalog.schemas import Categoria, Etiqueta, Producto, Vitrina
-from cart.schemas import Carrito
+from auth.schemas import User, IntentoVentana, TokenRevocado, CodigoVerificacion
+from catalog.schemas import Categoria, Etiqueta, Producto, Vitrina, ArchivoImagen
+from cart.schemas import Carrito, CarritoArchivado, ReservaStock
 from admin.schemas import ReglasCarrito, Cupon, SecuritySettings, AuditLog 
 from checkout.schemas import Orden, Boleta
 
@@ -17,21 +17,64 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env")
     SECRET_KEY: str
     ALGORITHM: str
+    # Duración del token de acceso y cada cuánto se relee la lista de revocados
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 480
+    TOKEN_REVOCATION_REFRESH_SECONDS: float = 30.0
     MAIL_USERNAME: str
     MAIL_PASSWORD: str
     MAIL_FROM: str
     MAIL_PORT: int
     MAIL_SERVER: str
+    # Para probar con un servidor local (python -m aiosmtpd -n -l localhost:8025)
+    # se desactivan STARTTLS y el login
+    MAIL_STARTTLS: bool = True
+    MAIL_USE_CREDENTIALS: bool = True
+    MAIL_QUEUE_MAX: int = 1000
+    # Corre explain() sobre las consultas conocidas al arrancar y falla si alguna hace COLLSCAN
+    VERIFY_INDEXES: bool = False
+    # "directo": cada cambio del carrito se escribe en Mongo en el momento.
+    # "write_behind": los carritos en uso viven en memoria y se guardan por lotes
+    # cada CART_FLUSH_INTERVAL_SECONDS y al apagar; una caída puede perder como
+    # máximo ese intervalo de cambios. Solo con un único proceso de la API.
+    CART_STORE_MODE: str = "directo"
+    CART_FLUSH_INTERVAL_SECONDS: float = 2.0
+    CART_STORE_MAX_CARTS: int = 10_000
+    # Cada cuánto se devuelven al stock las reservas vencidas
+    STOCK_REAPER_INTERVAL_SECONDS: float = 30.0
+    # Compactación de carritos: los vacíos se borran tras CART_EMPTY_MAX_AGE_HOURS
+    # sin actividad y los que tienen items pasan a carritos_archivados tras
+    # CART_ARCHIVE_AFTER_DAYS (y el TTL del archivo los borra después)
+    CART_EMPTY_MAX_AGE_HOURS: int = 24
+    CART_ARCHIVE_AFTER_DAYS: int = 30
+    CART_COMPACTION_INTERVAL_SECONDS: float = 3600.0
+    # Hilos para bcrypt y cuántos hasheos pueden esperar antes de responder 503
+    BCRYPT_THREADS: int = 4
+    BCRYPT_MAX_QUEUE: int = 32
+    # Auditoría diferida: se guarda por lotes de AUDIT_BATCH_SIZE o cada
+    # AUDIT_FLUSH_INTERVAL_SECONDS. Con la cola llena, "descartar" bota el
+    # evento (y lo cuenta) y "esperar" frena a quien registra.
+    AUDIT_QUEUE_MAX: int = 10_000
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    AUDIT_OVERFLOW_POLICY: str = "descartar"
+    # Límite de intentos de login, 2FA y validación de cupones.
+    # "memoria": por proceso. "mongo": compartido entre procesos de la API.
+    RATE_LIMIT_MODE: str = "memoria"
 
 db_settings = Settings()
 
 # --- Lista de Modelos ---
 DOCUMENT_MODELS: List[Type] = [
     User, 
+    IntentoVentana,
+    TokenRevocado,
+    CodigoVerificacion,
     Categoria,
     Etiqueta,
     Producto,
     Carrito,
+    CarritoArchivado,
+    ReservaStock,
     ReglasCarrito,
     Cupon,
     Orden,
@@ -39,7 +82,7 @@ DOCUMENT_MODELS: List[Type] = [
     SecuritySettings,
     AuditLog,
     Vitrina,
-    
+    ArchivoImagen,
 ]
 
 async def init_db():
@@ -54,4 +97,14 @@ async def init_db():
         document_models=DOCUMENT_MODELS
     )
 
-    print("Conexión a MONGODB establecida.")
\ No newline at end of file
+    print("Conexión a MONGODB establecida.")
+
+    if db_settings.VERIFY_INDEXES:
+        from indices import verificar_indices
+
+        problemas = await verificar_indices()
+        if problemas:
+            raise RuntimeError(
+                "Consultas sin índice (COLLSCAN): " + "; ".join(problemas)
+            )
+        print("Índices verificados.")
\ No newline at end of file
@@ -0,0 +1,107 @@
+# indices.py
+
+import asyncio
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from beanie import Document
+from bson import DBRef, ObjectId
+
+from auth.schemas import User, TokenRevocado, CodigoVerificacion
+from catalog.schemas import Categoria, Etiqueta, Producto, Vitrina, ArchivoImagen
+from cart.schemas import Carrito, ReservaStock
+from admin.schemas import Cupon, AuditLog
+from checkout.schemas import Orden, Boleta
+
+_ID = ObjectId()
+_FECHA = datetime(2024, 1, 1)
+
+# (modelo, filtro, orden): una entrada por forma de consulta que usan los routers.
+# Los listados completos (find_all) quedan fuera porque recorren todo a propósito.
+CONSULTAS: List[Tuple[Type[Document], Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    (User, {"email": "cliente@nonna.cl"}, None),
+    (User, {"telefono": "+56900000000"}, None),
+    (User, {"tokenVersion": {"$gt": 0}}, None),
+    (TokenRevocado, {"expira": {"$gt": _FECHA}}, None),
+    (TokenRevocado, {"clave": "jti:" + "0" * 32}, None),
+    (CodigoVerificacion, {"clave": "2fa:+56900000000", "expira": {"$gt": _FECHA}}, None),
+    (Categoria, {"slug": "pastas"}, None),
+    (Categoria, {"ancestros": _ID}, None),
+    (Etiqueta, {"nombre": "Vegano"}, None),
+    (Producto, {"sku": "SKU-1"}, None),
+    (Producto, {"sku": "SKU-1", "_id": {"$ne": _ID}}, None),
+    (Producto, {"estado": "Activo"}, None),
+    (Producto, {"categoria.$id": {"$in": [_ID]}}, [("fechaCreacion", 1), ("_id", 1)]),
+    (Producto, {"etiquetas.$id": _ID}, [("fechaCreacion", 1), ("_id", 1)]),
+    (Producto, {}, [("fechaCreacion", 1), ("_id", 1)]),
+    (Vitrina, {"slug": "destacados"}, None),
+    (ArchivoImagen, {"digest": "0" * 64}, None),
+    (ArchivoImagen, {"nombre": "0" * 64 + ".jpg"}, None),
+    (Carrito, {"propietario": DBRef("usuarios", _ID)}, None),
+    (Carrito, {"_id": _ID, "items.variante_sku": "SKU-1-500G"}, None),
+    (Carrito, {"ultimaActividad": None}, None),
+    (Carrito, {"items.0": {"$exists": False}, "ultimaActividad": {"$lte": _FECHA}}, None),
+    (ReservaStock, {"usuarioId": _ID, "variante_sku": "SKU-1-500G", "estado": "activa"}, None),
+    (ReservaStock, {"usuarioId": _ID, "numeroOrden": "LN-1", "estado": "en_pago"}, None),
+    (ReservaStock, {"estado": {"$in": ["activa", "en_pago"]}, "expira": {"$lte": _FECHA}}, None),
+    (ReservaStock, {"lote": "0" * 32}, None),
+    (Cupon, {"codigo": "NONNA10"}, None),
+    (Cupon, {"codigo": "NONNA10", "estado": "Activo"}, None),
+    (AuditLog, {}, [("fecha", -1)]),
+    (Orden, {"token_ws": "token"}, None),
+    (Orden, {"estado": {"$in": ["Pagado", "En Preparación"]}}, [("fecha", 1)]),
+    (Orden, {"estado": {"$in": ["Listo para Despacho", "En Ruta"]}}, [("fecha", 1)]),
+    (Orden, {"estado": "Enviado"}, None),
+    (Orden, {"estado": "Entregado", "fecha": {"$gte": _FECHA}}, None),
+    (Orden, {"fecha": {"$gte": _FECHA, "$lte": _FECHA}}, None),
+    (Orden, {"fecha": {"$gte": _FECHA, "$lte": _FECHA}, "estado": {"$in": ["Pagado"]}}, None),
+    (Boleta, {"fechaEmision": {"$gte": _FECHA, "$lte": _FECHA}}, None),
+]
+
+
+def _tiene_collscan(plan: Any) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_tiene_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(_tiene_collscan(v) for v in plan)
+    return False
+
+
+async def verificar_indices() -> List[str]:
+    """
+    Corre explain() sobre cada forma de consulta y devuelve la lista de las
+    que terminan en COLLSCAN (vacía si todas usan índice).
+    """
+    problemas = []
+    for modelo, filtro, orden in CONSULTAS:
+        cursor = modelo.get_motor_collection().find(filtro)
+        if orden:
+            cursor = cursor.sort(orden)
+        explicacion = await cursor.explain()
+        plan = explicacion.get("queryPlanner", {}).get("winningPlan", {})
+        if _tiene_collscan(plan):
+            problemas.append(
+                f"{modelo.get_motor_collection().name}: {filtro} orden={orden}"
+            )
+    return problemas
+
+
+async def main() -> int:
+    from db import init_db
+
+    await init_db()
+    problemas = await verificar_indices()
+    if problemas:
+        print("Consultas sin índice (COLLSCAN):")
+        for problema in problemas:
+            print(f"  - {problema}")
+        return 1
+    print(f"Las {len(CONSULTAS)} formas de consulta usan índices.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
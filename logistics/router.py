@@ -1,51 +1,60 @@
 # logistics/router.py
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
 from datetime import datetime
 from typing import List, Dict
+from pydantic import TypeAdapter
 from .schemas import PedidoParaPicking, ConfirmacionPicking, PickingItem, DocumentoImpresion
 from checkout.schemas import Orden, OrdenOut
-from auth.schemas import User
-from auth.router import get_current_user
+from auth.schemas import Roles, TokenData
+from auth.router import requerir_rol
+from streaming import respuesta_streaming
 
 router = APIRouter(prefix="/api/logistica", tags=["5. Logística y Despacho"])
 
+_PEDIDO_PICKING = TypeAdapter(PedidoParaPicking)
+_ORDEN_OUT = TypeAdapter(OrdenOut)
+
+# Los tableros solo necesitan el rol: se autoriza con el token, sin leer el usuario
+solo_logistica = requerir_rol(Roles.LOGISTICA, Roles.ADMIN, Roles.DUENO)
+
 # === 1. VISTA BODEGA: Pedidos Nuevos (Pagados) ===
 @router.get("/pedidos-picking", response_model=List[PedidoParaPicking])
-async def obtener_pedidos_picking(usuario: User = Depends(get_current_user)):
-    ordenes = await Orden.find(
+async def obtener_pedidos_picking(request: Request, usuario: TokenData = Depends(solo_logistica)):
+    ordenes = Orden.find(
         {"estado": {"$in": ["Pagado", "En Preparación"]}}
-    ).sort(+Orden.fecha).to_list()
+    ).sort(+Orden.fecha)
     
-    resultado = []
-    for orden in ordenes:
-        items_picking = [
-            PickingItem(
-                sku=getattr(i, 'producto_id', 'GEN'), 
-                nombreProducto=i.nombre, 
-                ubicacion="Pasillo A", 
-                cantidadPedida=i.cantidad
-            ) for i in orden.items
-        ]
-        resultado.append(PedidoParaPicking(
-            id=str(orden.id), 
-            numeroOrden=orden.numeroOrden, 
-            fecha=orden.fecha, 
-            items=items_picking
-        ))
-    return resultado
+    async def pedidos():
+        async for orden in ordenes:
+            items_picking = [
+                PickingItem(
+                    sku=getattr(i, 'producto_id', 'GEN'), 
+                    nombreProducto=i.nombre, 
+                    ubicacion="Pasillo A", 
+                    cantidadPedida=i.cantidad
+                ) for i in orden.items
+            ]
+            yield PedidoParaPicking(
+                id=str(orden.id), 
+                numeroOrden=orden.numeroOrden, 
+                fecha=orden.fecha, 
+                items=items_picking
+            )
+
+    return respuesta_streaming(request, pedidos(), _PEDIDO_PICKING)
 
 # === 2. VISTA DESPACHO: Pedidos Listos para Salir ===
 @router.get("/pedidos-despacho", response_model=List[OrdenOut])
-async def obtener_pedidos_despacho(usuario: User = Depends(get_current_user)):
-    ordenes = await Orden.find(
+async def obtener_pedidos_despacho(request: Request, usuario: TokenData = Depends(solo_logistica)):
+    ordenes = Orden.find(
         {"estado": {"$in": ["Listo para Despacho", "En Ruta"]}}
-    ).sort(+Orden.fecha).to_list()
-    return ordenes
+    ).sort(+Orden.fecha)
+    return respuesta_streaming(request, ordenes, _ORDEN_OUT)
 
 # === 3. CAMBIO DE ESTADO GENÉRICO ===
 @router.put("/pedidos/{orden_id}/estado")
-async def cambiar_estado_orden(orden_id: str, nuevo_estado: str, usuario: User = Depends(get_current_user)):
+async def cambiar_estado_orden(orden_id: str, nuevo_estado: str, usuario: TokenData = Depends(solo_logistica)):
     orden = await Orden.get(orden_id)
     if not orden:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Orden no encontrada")
@@ -56,7 +65,7 @@ async def cambiar_estado_orden(orden_id: str, nuevo_estado: str, usuario: User =
 
 # === 4. CONFIRMACIÓN DE PICKING (Bodega -> Despacho) ===
 @router.post("/picking/confirmar")
-async def confirmar_picking(confirmacion: ConfirmacionPicking, usuario: User = Depends(get_current_user)):
+async def confirmar_picking(confirmacion: ConfirmacionPicking, usuario: TokenData = Depends(solo_logistica)):
     orden = await Orden.get(confirmacion.pedidoId)
     if not orden: raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Orden no encontrada")
     
@@ -67,7 +76,7 @@ async def confirmar_picking(confirmacion: ConfirmacionPicking, usuario: User = D
 @router.get("/picking/{pedido_id}/imprimir-hoja", response_model=DocumentoImpresion) 
 async def imprimir_hoja_picking(
     pedido_id: str,
-    usuario: User = Depends(get_current_user)
+    usuario: TokenData = Depends(solo_logistica)
 ):
     orden = await Orden.get(pedido_id)
     if not orden:
@@ -82,7 +91,7 @@ async def imprimir_hoja_picking(
 # === Endpoint para KPIs del Dashboard ===
 @router.get("/dashboard-kpis")
 async def obtener_kpis_logistica(
-    usuario: User = Depends(get_current_user)
+    usuario: TokenData = Depends(solo_logistica)
 ):
     hoy_inicio = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     
@@ -7,8 +7,16 @@ import os
 from contextlib import asynccontextmanager
 from db import init_db
 from auth.router import router as auth_router
-from catalog.router import router as catalog_router
+from catalog.router import router as catalog_router, imagenes_router
+from catalog.miniaturas import cache_variantes
 from cart.router import router as cart_router
+from cart.store import carrito_store
+from cart.reservas import liberador_reservas
+from cart.tareas import compactador_carritos
+from auth.hashing import pool_hash
+from auth.correo import servicio_correo
+from auth.tokens import refresco_revocaciones
+from admin.auditoria import registro_auditoria
 from admin.router import router as admin_router
 from checkout.router import router as checkout_router
 from logistics.router import router as logistics_router
@@ -17,8 +25,23 @@ from reports.router import router as reports_router
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    refresco_revocaciones.iniciar()
+    registro_auditoria.iniciar()
+    servicio_correo.cargar_plantillas()
+    servicio_correo.iniciar()
+    carrito_store.iniciar()
+    liberador_reservas.iniciar()
+    compactador_carritos.iniciar()
     print("Servidor listo para recibir peticiones.")
     yield
+    await compactador_carritos.cerrar()
+    await liberador_reservas.cerrar()
+    await carrito_store.cerrar()
+    await registro_auditoria.cerrar()
+    await refresco_revocaciones.cerrar()
+    await servicio_correo.cerrar()
+    cache_variantes.cerrar()
+    pool_hash.cerrar()
     print("Servidor apagándose.")
 
 app = FastAPI(
@@ -41,18 +64,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],         
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
     
 
-app.mount("/static", StaticFiles(directory="uploads"), name="static")
 app.include_router(auth_router)
 app.include_router(catalog_router)
+app.include_router(imagenes_router)
 app.include_router(cart_router)
 app.include_router(admin_router)
 app.include_router(checkout_router)
 app.include_router(logistics_router)
 app.include_router(reports_router)
 
+# El mount va después de los routers para que /static/img/{hash} llegue a su endpoint
+app.mount("/static", StaticFiles(directory="uploads"), name="static")
+
 @app.get("/")
 async def root():
     return {"message": "Bienvenido a la API de La Nonna"}
@@ -0,0 +1,40 @@
+# periodicas.py
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+
+
+class TareaPeriodica:
+    """
+    Corre `funcion` cada `intervalo` segundos en una sola tarea de asyncio,
+    desde que se llama iniciar() (en el lifespan) hasta cerrar(). Un error en
+    una vuelta se informa y no detiene las siguientes.
+    """
+
+    def __init__(self, nombre: str, funcion: Callable[[], Awaitable[Any]], intervalo: float):
+        self._nombre = nombre
+        self._funcion = funcion
+        self._intervalo = intervalo
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def _ciclo(self) -> None:
+        while True:
+            try:
+                resultado = await self._funcion()
+                if resultado:
+                    print(f"{self._nombre}: {resultado}")
+            except Exception as error:
+                print(f"Error en {self._nombre}: {error}")
+            await asyncio.sleep(self._intervalo)
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def cerrar(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
@@ -1,7 +1,8 @@
 #reports/router.py
 
-from fastapi import APIRouter, HTTPException, status, Query, Depends
+from fastapi import APIRouter, HTTPException, status, Query, Depends, Request
 from typing import List, Dict, Any, Optional
+from pydantic import TypeAdapter
 from .schemas import (
     AdminKPIResponse, OwnerSummaryResponse, LogisticsKPIResponse,
     VentaReporteItem, AuditEvent, 
@@ -9,14 +10,22 @@ from .schemas import (
     KpiTiempo, MotivoCancelacion
 )
 from datetime import datetime, date, timedelta
-from auth.schemas import User
+from auth.schemas import Roles, TokenData
 from checkout.schemas import Orden, Boleta
-from auth.router import get_current_user
+from auth.router import requerir_rol
+from streaming import respuesta_streaming
 
 router = APIRouter(
     prefix="/api",
 )
 
+_VENTA_REPORTE_ITEM = TypeAdapter(VentaReporteItem)
+_BOLETA = TypeAdapter(Boleta)
+
+# Autorización solo con el rol del token, sin leer el usuario
+solo_admin = requerir_rol(Roles.ADMIN, Roles.DUENO)
+solo_dueno = requerir_rol(Roles.DUENO)
+
 # === Endpoints de Reportes (ADMINISTRADOR) ===
 
 
@@ -24,7 +33,7 @@ router = APIRouter(
 async def get_dashboard_kpi(
     fechaInicio: date,
     fechaFin: date,
-    usuario: User = Depends(get_current_user)
+    usuario: TokenData = Depends(solo_admin)
 ):
     start_datetime = datetime.combine(fechaInicio, datetime.min.time())
     end_datetime = datetime.combine(fechaFin, datetime.max.time())
@@ -37,19 +46,17 @@ async def get_dashboard_kpi(
         {"estado": {"$in": estados_venta}}
     )
     
-    ordenes = await query.to_list()
-    
     venta_productos_pura = 0 
     recaudacion_total_caja = 0
+    numero_pedidos = 0
     
-    for o in ordenes:
+    async for o in query:
+        numero_pedidos += 1
         recaudacion_total_caja += o.total
         for item in o.items:
             venta_productos_pura += (item.precio * item.cantidad)
 
     ingresos_delivery = recaudacion_total_caja - venta_productos_pura        
-            
-    numero_pedidos = len(ordenes)
     
     ticket_promedio = venta_productos_pura / numero_pedidos if numero_pedidos > 0 else 0
     
@@ -92,24 +99,24 @@ async def get_dashboard_kpi(
 
 @router.get("/admin/reporte-ventas", response_model=List[VentaReporteItem], tags=["6. Reportes (Admin)"])
 async def get_reporte_ventas(
+    request: Request,
     fechaInicio: date,
     fechaFin: date,
     categoria: Optional[str] = None, 
-    usuario: User = Depends(get_current_user)
+    usuario: TokenData = Depends(solo_admin)
 ):
     start_datetime = datetime.combine(fechaInicio, datetime.min.time())
     end_datetime = datetime.combine(fechaFin, datetime.max.time())
 
-    ordenes = await Orden.find(
+    ordenes = Orden.find(
         Orden.fecha >= start_datetime,
         Orden.fecha <= end_datetime
-    ).to_list()
+    )
     
-    reporte_items = []
-    for orden in ordenes:
-        for item in orden.items:
-            reporte_items.append(
-                VentaReporteItem(
+    async def reporte_items():
+        async for orden in ordenes:
+            for item in orden.items:
+                yield VentaReporteItem(
                     fecha=orden.fecha,
                     orden=orden.numeroOrden,
                     cliente=str(orden.propietario), 
@@ -119,61 +126,64 @@ async def get_reporte_ventas(
                     total=item.precio * item.cantidad,
                     estado=orden.estado
                 )
-            )
-    return reporte_items
+
+    return respuesta_streaming(request, reporte_items(), _VENTA_REPORTE_ITEM)
 
 @router.get("/admin/reporte-boletas", response_model=List[Boleta], tags=["6. Reportes (Admin)"])
 async def get_reporte_boletas(
+    request: Request,
     fechaInicio: date, 
     fechaFin: date,
     clienteEmail: Optional[str] = None, 
-    usuario: User = Depends(get_current_user)
+    usuario: TokenData = Depends(solo_admin)
 ):
     start_datetime = datetime.combine(fechaInicio, datetime.min.time())
     end_datetime = datetime.combine(fechaFin, datetime.max.time())
     
-    boletas = await Boleta.find(
+    boletas = Boleta.find(
         Boleta.fechaEmision >= start_datetime,
         Boleta.fechaEmision <= end_datetime,
         fetch_links=True
-    ).to_list()
+    )
     
     if clienteEmail:
         clienteEmail = clienteEmail.lower()
-        boletas_filtradas = []
-        for b in boletas:
-            if b.orden and b.orden.propietario:
-                email_usuario = b.orden.propietario.email.lower()
-                nombre_usuario = b.orden.propietario.nombre.lower()
-                
-                if clienteEmail in email_usuario or clienteEmail in nombre_usuario:
-                    boletas_filtradas.append(b)
-        return boletas_filtradas
-
-    return boletas
+
+        async def boletas_filtradas():
+            async for b in boletas:
+                if b.orden and b.orden.propietario:
+                    email_usuario = b.orden.propietario.email.lower()
+                    nombre_usuario = b.orden.propietario.nombre.lower()
+                    
+                    if clienteEmail in email_usuario or clienteEmail in nombre_usuario:
+                        yield b
+        return respuesta_streaming(request, boletas_filtradas(), _BOLETA)
+
+    return respuesta_streaming(request, boletas, _BOLETA)
 
 @router.get("/dueño/resumen-ejecutivo", response_model=OwnerSummaryResponse, tags=["7. Reportes (Dueño)"])
 async def get_resumen_ejecutivo(
     fechaInicio: date, 
     fechaFin: date,
-    usuario: User = Depends(get_current_user)
+    usuario: TokenData = Depends(solo_dueno)
 ):
     start = datetime.combine(fechaInicio, datetime.min.time())
     end = datetime.combine(fechaFin, datetime.max.time())
     estados_validos = ["Pagado", "En Preparación", "Enviado", "Entregado"]
 
-    ordenes = await Orden.find({
+    ordenes = Orden.find({
         "fecha": {"$gte": start, "$lte": end},
         "estado": {"$in": estados_validos}
-    }).to_list()
+    })
 
     venta_neta = 0
-    for o in ordenes:
+    num_pedidos = 0
+    async for o in ordenes:
+        num_pedidos += 1
         if o.items:
             for item in o.items:
                 venta_neta += (item.precio * item.cantidad)
 
-    num_pedidos = len(ordenes)
     ticket_promedio = venta_neta / num_pedidos if num_pedidos > 0 else 0
     
     margen_estimado = venta_neta * 0.40
@@ -211,7 +221,7 @@ async def get_resumen_ejecutivo(
 async def get_reporte_logistica(
     fecha: date, 
     franjaHoraria: Optional[str] = None,
-    usuario: User = Depends(get_current_user)
+    usuario: TokenData = Depends(solo_dueno)
 ):
     return LogisticsKPIResponse(
         tiempoMedioPreparacion=KpiTiempo(minutos=0, alertaSLA=False),
@@ -225,6 +235,6 @@ async def get_reporte_auditoria(
     fechaInicio: date, 
     fechaFin: date,
     usuario: Optional[str] = None,
-    authUser: User = Depends(get_current_user)
+    authUser: TokenData = Depends(solo_dueno)
 ):
     return []
\ No newline at end of file
@@ -0,0 +1,57 @@
+# streaming.py
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from typing import Any, AsyncIterable, AsyncIterator
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Se juntan varios documentos por chunk para no mandar un write por documento
+TAMANO_CHUNK = 16 * 1024
+
+
+def pide_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def _serializar(
+    documentos: AsyncIterable[Any],
+    adaptador: TypeAdapter,
+    inicio: bytes,
+    separador: bytes,
+    sufijo: bytes,
+    fin: bytes
+) -> AsyncIterator[bytes]:
+    buffer = bytearray(inicio)
+    primero = True
+    async for doc in documentos:
+        if not primero:
+            buffer += separador
+        primero = False
+        dato = adaptador.validate_python(doc, from_attributes=True)
+        buffer += adaptador.dump_json(dato, by_alias=True)
+        buffer += sufijo
+        if len(buffer) >= TAMANO_CHUNK:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += fin
+    yield bytes(buffer)
+
+
+def respuesta_streaming(
+    request: Request,
+    documentos: AsyncIterable[Any],
+    adaptador: TypeAdapter
+) -> StreamingResponse:
+    """
+    Serializa los documentos a medida que salen del cursor de Motor.
+    Con `Accept: application/x-ndjson` responde un documento por línea; si no,
+    un arreglo JSON enviado por partes (mismo contenido que la lista completa).
+    """
+    if pide_ndjson(request):
+        cuerpo = _serializar(documentos, adaptador, b"", b"", b"\n", b"")
+        return StreamingResponse(cuerpo, media_type=NDJSON_MEDIA_TYPE)
+
+    cuerpo = _serializar(documentos, adaptador, b"[", b",", b"", b"]")
+    return StreamingResponse(cuerpo, media_type="application/json")
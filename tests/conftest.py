@@ -0,0 +1,15 @@
+# tests/conftest.py
+# db.py lee la configuración al importarse: valores de prueba si no hay .env
+import os
+import sys
+
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017/la_nonna_pruebas")
+os.environ.setdefault("SECRET_KEY", "clave-de-pruebas")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("MAIL_USERNAME", "pruebas")
+os.environ.setdefault("MAIL_PASSWORD", "pruebas")
+os.environ.setdefault("MAIL_FROM", "pruebas@lanonna.cl")
+os.environ.setdefault("MAIL_PORT", "8025")
+os.environ.setdefault("MAIL_SERVER", "localhost")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,152 @@
+# tests/test_correo.py
+# Envío real por SMTP contra un servidor aiosmtpd local (pip install aiosmtpd)
+import asyncio
+import socket
+from email.message import EmailMessage
+
+import pytest
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller
+
+from auth import correo
+from auth.correo import ServicioCorreo
+from db import db_settings
+
+PLANTILLA = "recuperacion_password.html"
+DATOS = {"nombre": "Nonna", "link": "https://lanonna.cl/recuperar", "minutos": 15}
+
+
+class _Buzon:
+    """Handler de aiosmtpd: guarda cada mensaje y la sesión (conexión) por la que llegó."""
+
+    def __init__(self):
+        self.destinatarios = []
+        self.sesiones = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.destinatarios.extend(envelope.rcpt_tos)
+        self.sesiones.append(id(session))
+        return "250 OK"
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def puerto(monkeypatch):
+    puerto = _puerto_libre()
+    monkeypatch.setattr(db_settings, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(db_settings, "MAIL_PORT", puerto)
+    monkeypatch.setattr(db_settings, "MAIL_STARTTLS", False)
+    monkeypatch.setattr(db_settings, "MAIL_USE_CREDENTIALS", False)
+    # Reintentos rápidos para no esperar segundos en cada prueba
+    monkeypatch.setattr(correo, "ESPERA_MINIMA", 0.05)
+    monkeypatch.setattr(correo, "ESPERA_MAXIMA", 0.2)
+    return puerto
+
+
+def _servidor(puerto: int) -> Controller:
+    controlador = Controller(_Buzon(), hostname="127.0.0.1", port=puerto)
+    controlador.start()
+    return controlador
+
+
+def _servicio(max_cola: int = 100) -> ServicioCorreo:
+    servicio = ServicioCorreo(max_cola)
+    servicio.cargar_plantillas()
+    return servicio
+
+
+async def _esperar(condicion, segundos: float = 5.0) -> None:
+    limite = asyncio.get_running_loop().time() + segundos
+    while not condicion():
+        assert asyncio.get_running_loop().time() < limite, "no llegaron los correos a tiempo"
+        await asyncio.sleep(0.02)
+
+
+def test_envia_por_lotes_sobre_una_conexion(puerto):
+    controlador = _servidor(puerto)
+    buzon = controlador.handler
+    total = correo.TAMANO_LOTE_CORREO + 5
+
+    async def prueba():
+        servicio = _servicio()
+        for i in range(total):
+            assert servicio.encolar(f"cliente{i}@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+        servicio.iniciar()
+        await _esperar(lambda: len(buzon.destinatarios) == total)
+        await servicio.cerrar()
+
+    try:
+        asyncio.run(prueba())
+    finally:
+        controlador.stop()
+
+    assert sorted(buzon.destinatarios) == sorted(f"cliente{i}@lanonna.cl" for i in range(total))
+    # Los dos lotes salen por la misma conexión abierta
+    assert len(set(buzon.sesiones)) == 1
+
+
+def test_reconecta_si_el_servidor_se_reinicia(puerto):
+    primero = _servidor(puerto)
+    segundo = None
+
+    async def prueba():
+        nonlocal segundo
+        servicio = _servicio()
+        servicio.iniciar()
+        servicio.encolar("antes@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+        await _esperar(lambda: primero.handler.destinatarios == ["antes@lanonna.cl"])
+
+        # Se cae el servidor: lo encolado mientras tanto se reintenta hasta que vuelve
+        primero.stop()
+        servicio.encolar("durante@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+        await asyncio.sleep(0.1)
+        segundo = _servidor(puerto)
+        servicio.encolar("despues@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+        await _esperar(lambda: len(segundo.handler.destinatarios) == 2)
+        await servicio.cerrar()
+
+    try:
+        asyncio.run(prueba())
+    finally:
+        if segundo is not None:
+            segundo.stop()
+
+    assert sorted(segundo.handler.destinatarios) == ["despues@lanonna.cl", "durante@lanonna.cl"]
+
+
+def test_cola_llena_rechaza_sin_bloquear():
+    servicio = _servicio(max_cola=2)
+
+    assert servicio.encolar("a@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+    assert servicio.encolar("b@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+    assert not servicio.encolar("c@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+
+
+def test_mensaje_mal_formado_no_detiene_el_envio(puerto):
+    controlador = _servidor(puerto)
+    buzon = controlador.handler
+
+    async def prueba():
+        servicio = _servicio()
+        servicio.iniciar()
+        # Sin destinatario: send_message falla con un error que no es de SMTP
+        sin_destinatario = EmailMessage()
+        sin_destinatario["From"] = db_settings.MAIL_FROM
+        sin_destinatario.set_content("hola")
+        servicio._cola.put_nowait(sin_destinatario)
+        servicio.encolar("cliente@lanonna.cl", "Recupera tu clave", PLANTILLA, **DATOS)
+
+        await _esperar(lambda: buzon.destinatarios == ["cliente@lanonna.cl"])
+        assert not servicio._tarea.done()
+        await servicio.cerrar()
+
+    try:
+        asyncio.run(prueba())
+    finally:
+        controlador.stop()
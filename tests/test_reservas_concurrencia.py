@@ -0,0 +1,189 @@
+# tests/test_reservas_concurrencia.py
+# Necesitan un Mongo de verdad (el descuento depende de que el update sea atómico):
+#   MONGO_TEST_URL=mongodb://localhost:27017 python -m pytest tests
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+if not MONGO_TEST_URL:
+    pytest.skip("MONGO_TEST_URL no está definida", allow_module_level=True)
+
+from beanie import BeanieObjectId, init_beanie
+from bson import DBRef
+import httpx
+import motor.motor_asyncio
+
+from auth.router import create_access_token
+from auth.schemas import Roles, User
+from cart import reservas
+from cart.schemas import Carrito, ReservaStock
+from catalog.schemas import Producto
+from db import DOCUMENT_MODELS
+from main import app
+
+SKU = "NONNA-ULTIMA-1"
+COMPRADORES = 300
+
+
+async def _con_base(prueba) -> None:
+    """Corre la prueba sobre una base desechable y la borra al terminar."""
+    cliente = motor.motor_asyncio.AsyncIOMotorClient(MONGO_TEST_URL)
+    base = cliente[f"la_nonna_pruebas_{uuid.uuid4().hex[:8]}"]
+    try:
+        await init_beanie(database=base, document_models=DOCUMENT_MODELS)
+        reservas.reglas_cache.invalidar()
+        await prueba()
+    finally:
+        await cliente.drop_database(base.name)
+        cliente.close()
+
+
+async def _producto_con_stock(stock: int) -> BeanieObjectId:
+    resultado = await Producto.get_motor_collection().insert_one({
+        "nombre": "Lasaña de la nonna",
+        "sku": "NONNA-ULTIMA",
+        "precio_base": 9990,
+        "estado": "Activo",
+        "categoria": DBRef("categorias", BeanieObjectId()),
+        "etiquetas": [],
+        "variantes": [{"atributo": "Tamaño", "valor": "Familiar", "sku": SKU, "precio": 9990, "stock": stock}],
+        "imagenes": [],
+        "fechaCreacion": datetime.now(timezone.utc)
+    })
+    return resultado.inserted_id
+
+
+async def _compradores(cantidad: int) -> list:
+    """Usuarios de verdad en la base, cada uno con su token."""
+    prefijo = uuid.uuid4().hex[:8]
+    await User.get_motor_collection().insert_many([
+        {"email": f"comprador-{prefijo}-{i}@lanonna.cl", "nombre": f"Comprador {i}",
+         "hashedPassword": "x", "rol": Roles.CLIENTE.value, "tokenVersion": 0}
+        for i in range(cantidad)
+    ])
+    return await User.find({"email": {"$regex": f"^comprador-{prefijo}-"}}).to_list()
+
+
+async def _stock(producto_id: BeanieObjectId) -> int:
+    doc = await Producto.get_motor_collection().find_one({"_id": producto_id})
+    return doc["variantes"][0]["stock"]
+
+
+async def _agregar_en_paralelo(producto_id: BeanieObjectId, usuarios: list, cantidad: int) -> tuple:
+    """
+    POST /api/carrito/items de todos los usuarios a la vez, mientras otra tarea
+    va leyendo el stock. Devuelve (códigos de respuesta por usuario, stock mínimo visto).
+    """
+    terminado = asyncio.Event()
+    minimo = await _stock(producto_id)
+
+    async def vigilar():
+        nonlocal minimo
+        while not terminado.is_set():
+            minimo = min(minimo, await _stock(producto_id))
+            await asyncio.sleep(0)
+
+    async def agregar(cliente: httpx.AsyncClient, usuario: User) -> int:
+        respuesta = await cliente.post(
+            "/api/carrito/items",
+            json={"producto_id": str(producto_id), "variante_sku": SKU, "cantidad": cantidad},
+            headers={"Authorization": f"Bearer {create_access_token(usuario)}"}
+        )
+        return respuesta.status_code
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://pruebas") as cliente:
+        vigia = asyncio.create_task(vigilar())
+        try:
+            codigos = await asyncio.gather(*(agregar(cliente, u) for u in usuarios))
+        finally:
+            terminado.set()
+            await vigia
+    minimo = min(minimo, await _stock(producto_id))
+    return dict(zip((u.id for u in usuarios), codigos)), minimo
+
+
+async def _carritos_con_sku() -> set:
+    """Ids de los usuarios cuyo carrito tiene una línea del SKU."""
+    return {
+        doc["propietario"].id
+        async for doc in Carrito.get_motor_collection().find({"items.variante_sku": SKU}, {"propietario": 1})
+    }
+
+
+def test_ultima_unidad_no_se_vende_dos_veces():
+    async def prueba():
+        producto_id = await _producto_con_stock(1)
+        usuarios = await _compradores(COMPRADORES)
+
+        codigos, minimo = await _agregar_en_paralelo(producto_id, usuarios, 1)
+
+        ganadores = {uid for uid, codigo in codigos.items() if codigo == 200}
+        assert len(ganadores) == 1
+        assert all(codigo == 409 for uid, codigo in codigos.items() if uid not in ganadores)
+        assert minimo >= 0
+        assert await _stock(producto_id) == 0
+        # Solo el ganador tiene la línea en el carrito y la reserva activa
+        assert await _carritos_con_sku() == ganadores
+        activas = await ReservaStock.get_motor_collection().find({"estado": "activa"}).to_list(None)
+        assert [(r["usuarioId"], r["cantidad"]) for r in activas] == [(ganadores.pop(), 1)]
+
+    asyncio.run(_con_base(prueba))
+
+
+def test_varias_unidades_con_agregados_concurrentes():
+    async def prueba():
+        producto_id = await _producto_con_stock(5)
+        usuarios = await _compradores(COMPRADORES)
+
+        # Cada comprador pide 2: solo dos alcanzan y sobra una unidad
+        codigos, minimo = await _agregar_en_paralelo(producto_id, usuarios, 2)
+
+        ganadores = {uid for uid, codigo in codigos.items() if codigo == 200}
+        assert len(ganadores) == 2
+        assert minimo >= 0
+        assert await _stock(producto_id) == 1
+        assert await _carritos_con_sku() == ganadores
+
+    asyncio.run(_con_base(prueba))
+
+
+def test_pago_tardio_no_vende_lo_que_ya_se_llevo_otro():
+    async def prueba():
+        producto_id = await _producto_con_stock(1)
+        comprador, otro = BeanieObjectId(), BeanieObjectId()
+        assert await reservas.reservar(comprador, producto_id, SKU, 1)
+        await reservas.preparar_pago(comprador, [], "ORD-TARDIA")
+
+        # El pago en Webpay tarda más que MINUTOS_PAGO y el liberador devuelve la unidad
+        await ReservaStock.get_motor_collection().update_many(
+            {"numeroOrden": "ORD-TARDIA"}, {"$set": {"expira": datetime.now(timezone.utc) - timedelta(minutes=1)}}
+        )
+        assert await reservas.liberar_vencidas() == 1
+        assert await reservas.reservar(otro, producto_id, SKU, 1)
+
+        assert not await reservas.asegurar_pago(comprador, "ORD-TARDIA")
+        assert await _stock(producto_id) == 0
+
+    asyncio.run(_con_base(prueba))
+
+
+def test_pago_tardio_recupera_la_unidad_si_sigue_libre():
+    async def prueba():
+        producto_id = await _producto_con_stock(1)
+        comprador = BeanieObjectId()
+        assert await reservas.reservar(comprador, producto_id, SKU, 1)
+        await reservas.preparar_pago(comprador, [], "ORD-TARDIA")
+        await ReservaStock.get_motor_collection().update_many(
+            {"numeroOrden": "ORD-TARDIA"}, {"$set": {"expira": datetime.now(timezone.utc) - timedelta(minutes=1)}}
+        )
+        assert await reservas.liberar_vencidas() == 1
+
+        assert await reservas.asegurar_pago(comprador, "ORD-TARDIA")
+        assert await _stock(producto_id) == 0
+        assert await reservas.confirmar_pago(comprador, "ORD-TARDIA") == 1
+
+    asyncio.run(_con_base(prueba))